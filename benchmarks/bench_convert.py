@@ -0,0 +1,101 @@
+"""
+Benchmark of the numpy to QImage conversion
+
+Compares the former `np.array(img * factor)` path with ImageConverter on
+synthetic 16 bit frames and reports time per megapixel and peak memory
+allocated by numpy per conversion once warmed up (the reusable output
+buffer of ImageConverter is allocated by the first call).
+
+Usage: python benchmarks/bench_convert.py [--sizes 1 12 24] [--repeat 5]
+"""
+
+import argparse
+import os
+import pathlib
+import sys
+import time
+import tracemalloc
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1] / 'src'))
+
+import numpy as np  # noqa: E402
+from PyQt6.QtGui import QImage  # noqa: E402
+from cxx_image_io import ImageMetadata, PixelRepresentation, PixelType  # noqa: E402
+from display import ImageConverter  # noqa: E402
+
+
+def legacy_convert(img, metadata):
+    factor = int(65535.0 / (2**metadata.fileInfo.pixelPrecision - 1))
+    image = np.array(img * factor)
+    return QImage(image.data, image.shape[1], image.shape[0],
+                  QImage.Format.Format_Grayscale16), image
+
+
+def make_metadata(pixelType, precision):
+    metadata = ImageMetadata()
+    metadata.fileInfo.pixelType = pixelType
+    metadata.fileInfo.pixelRepresentation = PixelRepresentation.UINT16
+    metadata.fileInfo.pixelPrecision = precision
+    return metadata
+
+
+def measure(function, repeat):
+    function()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    elapsed = (time.perf_counter() - start) / repeat
+    # tracemalloc 会拖慢每次小的分配，内存峰值单独测一次
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sizes', type=float, nargs='+', default=[1, 12, 24])
+    parser.add_argument('--precisions',
+                        type=int,
+                        nargs='+',
+                        default=[10, 12, 14, 16])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print('{:<10}{:>6}{:>6}{:>16}{:>16}{:>14}{:>14}'.format(
+        'type', 'MP', 'bits', 'legacy ms/MP', 'engine ms/MP', 'legacy MB',
+        'engine MB'))
+    for megapixels in args.sizes:
+        width = int(np.sqrt(megapixels * 1e6 * 4 / 3)) // 2 * 2
+        height = int(megapixels * 1e6 / width) // 2 * 2
+        for precision in args.precisions:
+            gray = rng.integers(0, 2**precision, (height, width),
+                                dtype=np.uint16)
+            rgb = rng.integers(0, 2**precision, (height, width, 3),
+                               dtype=np.uint16)
+            cases = [('bayer', gray,
+                      make_metadata(PixelType.BAYER_GBRG, precision)),
+                     ('rgb', rgb, make_metadata(PixelType.RGB, precision))]
+            for name, img, metadata in cases:
+                converter = ImageConverter()
+                engine_time, engine_peak = measure(
+                    lambda: converter.convert(img, metadata), args.repeat)
+                if name == 'bayer':
+                    legacy_time, legacy_peak = measure(
+                        lambda: legacy_convert(img, metadata), args.repeat)
+                    legacy = ('{:.2f}'.format(legacy_time * 1e3 / megapixels),
+                              '{:.1f}'.format(legacy_peak / 2**20))
+                else:
+                    # 旧实现没有 16 位 RGB 路径
+                    legacy = ('n/a', 'n/a')
+                print('{:<10}{:>6g}{:>6}{:>16}{:>16.2f}{:>14}{:>14.1f}'.format(
+                    name, megapixels, precision, legacy[0],
+                    engine_time * 1e3 / megapixels, legacy[1],
+                    engine_peak / 2**20))
+
+
+if __name__ == '__main__':
+    main()
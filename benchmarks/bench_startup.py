@@ -0,0 +1,164 @@
+"""
+Startup time of the viewer
+
+Each trial starts a fresh interpreter that imports `display`, opens an image
+with ImageDisplayer and waits for the first paint of the window and the first
+pixels of the image, which come from the preview embedded in the file when
+there is one. Reports the median import time, time to first paint and time to
+first pixels, and which of the modules that are meant to load after the first
+frame were already imported.
+
+Fails (exit code 1) when pyqtgraph or qdarkstyle are imported before the
+first paint, when a time exceeds --max-import-ms / --max-first-paint-ms /
+--max-first-pixels-ms, or when it is more than --tolerance slower than a
+--baseline saved with --save.
+
+Usage: python benchmarks/bench_startup.py [--image img.jpg] [--trials 5]
+"""
+
+import argparse
+import json
+import os
+import pathlib
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC = pathlib.Path(__file__).resolve().parents[1] / 'src'
+DEFERRED_MODULES = ['pyqtgraph', 'qdarkstyle']
+
+
+def child(image):
+    start = time.perf_counter()
+    sys.path.insert(0, str(SRC))
+    import display
+    imported = time.perf_counter()
+
+    from PyQt6.QtWidgets import QApplication
+    app = QApplication([])
+    displayer = display.ImageDisplayer(pathlib.Path(image),
+                                       preview_cache=None)
+    result = {}
+
+    def painted():
+        result['first_paint_ms'] = (time.perf_counter() - start) * 1e3
+        result['loaded_before_paint'] = [
+            name for name in DEFERRED_MODULES if name in sys.modules
+        ]
+        if 'first_pixels_ms' in result:
+            app.quit()
+
+    def pixels(stage, ms):
+        result['first_pixels_ms'] = (time.perf_counter() - start) * 1e3
+        result['first_pixels_stage'] = stage
+        if 'first_paint_ms' in result:
+            app.quit()
+
+    displayer.firstPaint.connect(painted)
+    displayer.firstPixels.connect(pixels)
+    displayer.resize(1000, 800)
+    displayer.show()
+    displayer.openIndex(0)
+    app.exec()
+    # 退出时窗口已经关闭，之后才启动的直方图等后台任务要等它们结束
+    for task in list(displayer.tasks):
+        task.wait()
+    result['import_ms'] = (imported - start) * 1e3
+    print(json.dumps(result))
+    display.shutdownDecodePool()
+
+
+def trial(image):
+    env = dict(os.environ, QT_QPA_PLATFORM='offscreen')
+    output = subprocess.run(
+        [sys.executable, __file__, '--child', '--image', image],
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def sample_image(directory):
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt6.QtGui import QImage
+    path = pathlib.Path(directory) / 'startup.png'
+    image = QImage(4000, 3000, QImage.Format.Format_RGB888)
+    image.fill(0x808080)
+    image.save(str(path))
+    return str(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--image',
+                        help='Image to open, a 12 MP PNG by default.')
+    parser.add_argument('--trials', type=int, default=5)
+    parser.add_argument('--max-import-ms', type=float)
+    parser.add_argument('--max-first-paint-ms', type=float)
+    parser.add_argument('--max-first-pixels-ms', type=float)
+    parser.add_argument('--baseline', help='JSON saved by --save.')
+    parser.add_argument('--tolerance',
+                        type=float,
+                        default=0.25,
+                        help='Allowed slowdown against the baseline.')
+    parser.add_argument('--save', help='Write the medians to this JSON file.')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.image)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        image = args.image or sample_image(directory)
+        # 第一次运行预热文件缓存，不计入结果
+        trial(image)
+        trials = [trial(image) for _ in range(args.trials)]
+
+    medians = {
+        key: statistics.median(t[key] for t in trials)
+        for key in ('import_ms', 'first_paint_ms', 'first_pixels_ms')
+    }
+    loaded = sorted({name for t in trials for name in t['loaded_before_paint']})
+    stages = sorted({t['first_pixels_stage'] for t in trials})
+    print('import {:.0f} ms, first paint {:.0f} ms, first pixels {:.0f} ms '
+          '({}) (median of {})'.format(medians['import_ms'],
+                                       medians['first_paint_ms'],
+                                       medians['first_pixels_ms'],
+                                       ', '.join(stages), args.trials))
+
+    failures = []
+    if loaded:
+        failures.append('loaded before first paint: {}'.format(
+            ', '.join(loaded)))
+    limits = {
+        'import_ms': args.max_import_ms,
+        'first_paint_ms': args.max_first_paint_ms,
+        'first_pixels_ms': args.max_first_pixels_ms
+    }
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for key in limits:
+            if key not in baseline:
+                # 旧的基线没有这一项
+                continue
+            limit = baseline[key] * (1 + args.tolerance)
+            limits[key] = min(limits[key] or limit, limit)
+    for key, limit in limits.items():
+        if limit is not None and medians[key] > limit:
+            failures.append('{} {:.0f} > {:.0f}'.format(
+                key, medians[key], limit))
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(medians, f, indent=4)
+    for failure in failures:
+        print('FAIL: {}'.format(failure))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,388 @@
+"""
+Benchmark suite of the viewer on synthetic images
+
+Covers every pixel type of the README format table, UINT8 and UINT16
+grayscale, RGB, RGBA and Bayer, at each size of --sizes (MP). For each case
+a file is generated (PNG for 8 bit grayscale/RGB/RGBA, PLAIN with a sidecar
+otherwise), then a fresh interpreter under QT_QPA_PLATFORM=offscreen times:
+
+    decode        openRawFile, or read_image when the file is not memory mapped
+    convert       ImageViewer.convertNumpyArrayToQImage of the whole image
+    fromImage     QPixmap.fromImage of the converted image
+    zoom          one wheelEvent step and the repaint of the view, median of
+                  zooming out to the minimum and back
+    coordinates   update_coordinates for 1000 mouse moves
+    levels        one black/white point change through ToneMapping and the
+                  repaint of the view at 100%, median of 20 changes
+    histogram     HistogramEngine setup and the subsampled pass shown at once
+    histogram_exact   the exact pass computed in the background
+
+Times are the best of --repeat runs in ms, and the peak RSS of the process is recorded after
+each stage. Results are written as JSON with --save and compared with
+--baseline: a stage more than --tolerance slower, or a peak RSS more than
+--tolerance larger, fails the run (exit code 1).
+
+Usage: python benchmarks/bench_suite.py [--sizes 1 12 100] [--save out.json]
+                                        [--baseline base.json]
+"""
+
+import argparse
+import json
+import os
+import pathlib
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC = pathlib.Path(__file__).resolve().parents[1] / 'src'
+REPRESENTATIONS = ['uint8', 'uint16']
+PIXEL_TYPES = ['grayscale', 'rgb', 'rgba', 'bayer']
+CHANNELS = {'grayscale': 1, 'rgb': 3, 'rgba': 4, 'bayer': 1}
+STAGES = [
+    'decode', 'convert', 'fromImage', 'zoom', 'coordinates', 'levels',
+    'histogram', 'histogram_exact'
+]
+
+
+def case_name(representation, pixel_type, megapixels):
+    return '{}-{}-{:g}MP'.format(representation, pixel_type, megapixels)
+
+
+def image_size(megapixels):
+    width = int((megapixels * 1e6 * 4 / 3)**0.5) // 4 * 4
+    height = int(megapixels * 1e6 / width) // 2 * 2
+    return height, width
+
+
+def peak_rss_mb():
+    # Linux 上 ru_maxrss 的单位是 KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def generate(path, representation, pixel_type, megapixels, precision):
+    """Write a reproducible image: horizontal ramp plus seeded noise"""
+    import numpy as np
+    from cxx_image_io import (write_image, ImageLayout, ImageMetadata,
+                              ImageWriter, PixelRepresentation, PixelType)
+
+    height, width = image_size(megapixels)
+    channels = CHANNELS[pixel_type]
+    dtype = np.uint8 if representation == 'uint8' else np.uint16
+    bits = 8 if representation == 'uint8' else precision
+    maximum = 2**bits - 1
+    shape = (height, width) if channels == 1 else (height, width, channels)
+    image = np.empty(shape, dtype=dtype)
+    ramp = np.linspace(0, maximum * 7 // 8, width).astype(dtype)
+    rng = np.random.default_rng(0)
+    for top in range(0, height, 256):
+        chunk = image[top:top + 256]
+        chunk[...] = ramp if channels == 1 else ramp[:, None]
+        chunk += rng.integers(0, maximum // 8 + 1, chunk.shape, dtype=dtype)
+
+    if path.suffix == '.png':
+        metadata = ImageMetadata()
+        metadata.fileInfo.width = width
+        metadata.fileInfo.height = height
+        metadata.fileInfo.pixelPrecision = 8
+        metadata.fileInfo.pixelRepresentation = PixelRepresentation.UINT8
+        metadata.fileInfo.pixelType = {
+            'grayscale': PixelType.GRAYSCALE,
+            'rgb': PixelType.RGB,
+            'rgba': PixelType.RGBA
+        }[pixel_type]
+        metadata.fileInfo.imageLayout = (ImageLayout.INTERLEAVED if
+                                         channels > 1 else ImageLayout.PLANAR)
+        write_image(path, image, ImageWriter.Options(metadata))
+        return
+
+    image.tofile(path)
+    fileInfo = {
+        'fileFormat': 'plain',
+        'width': width,
+        'height': height,
+        'pixelPrecision': bits,
+        'pixelType': 'bayer_gbrg' if pixel_type == 'bayer' else pixel_type
+    }
+    if channels > 1:
+        fileInfo['imageLayout'] = 'interleaved'
+    with open(path.with_suffix('.json'), 'w') as f:
+        json.dump({'fileInfo': fileInfo}, f, indent=4)
+
+
+def timed(function, repeat):
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append((time.perf_counter() - start) * 1e3)
+    return min(times), result
+
+
+def measure(path, repeat):
+    """Time the viewer stages on one file, in this process"""
+    sys.path.insert(0, str(SRC))
+    import numpy as np
+    from PyQt6.QtWidgets import QApplication, QLabel
+    from PyQt6.QtGui import QPixmap, QWheelEvent, QMouseEvent
+    from PyQt6.QtCore import Qt, QEvent, QPoint, QPointF
+    import display
+
+    app = QApplication([])
+    stages = {}
+
+    def record(stage, ms):
+        stages[stage] = {'ms': ms, 'rss_mb': peak_rss_mb()}
+
+    startup_rss_mb = peak_rss_mb()
+
+    def decode():
+        raw = display.openRawFile(path)
+        if raw is not None:
+            return raw, raw.metadata
+        image, serialized = display.decodeImage(path)
+        return image, display.deserializeMetadata(serialized)
+
+    ms, (image, metadata) = timed(decode, repeat)
+    record('decode', ms)
+
+    pixelStatus, zoomStatus = QLabel(), QLabel()
+    viewer = display.ImageViewer(image, metadata, pixelStatus, zoomStatus)
+    viewer.resize(1280, 800)
+    viewer.show()
+    app.processEvents()
+
+    array = np.asarray(image)
+    ms, qimage = timed(
+        lambda: viewer.convertNumpyArrayToQImage(array, metadata), repeat)
+    record('convert', ms)
+    ms, pixmap = timed(lambda: QPixmap.fromImage(qimage), repeat)
+    record('fromImage', ms)
+    del qimage, pixmap, array
+
+    # 先画出 100% 的视图，缩放只计入新分块的转换和重绘
+    viewer.viewport().repaint()
+    center = QPointF(viewer.viewport().width() / 2,
+                     viewer.viewport().height() / 2)
+    steps = []
+    for delta in (-120, 120):
+        previous = None
+        while previous != viewer.scale_factor:
+            previous = viewer.scale_factor
+            event = QWheelEvent(center, viewer.mapToGlobal(center),
+                                QPoint(0, 0), QPoint(0, delta),
+                                Qt.MouseButton.NoButton,
+                                Qt.KeyboardModifier.NoModifier,
+                                Qt.ScrollPhase.NoScrollPhase, False)
+            start = time.perf_counter()
+            viewer.wheelEvent(event)
+            viewer.viewport().repaint()
+            steps.append((time.perf_counter() - start) * 1e3)
+    record('zoom', statistics.median(steps))
+
+    rng = np.random.default_rng(0)
+    positions = rng.random((1000, 2)) * (viewer.viewport().width(),
+                                         viewer.viewport().height())
+    events = [
+        QMouseEvent(QEvent.Type.MouseMove, QPointF(x, y),
+                    viewer.mapToGlobal(QPointF(x, y)),
+                    Qt.MouseButton.NoButton, Qt.MouseButton.NoButton,
+                    Qt.KeyboardModifier.NoModifier) for x, y in positions
+    ]
+    def move():
+        for event in events:
+            viewer.update_coordinates(event)
+
+    ms, _ = timed(move, repeat)
+    record('coordinates', ms)
+
+    viewer.resetTransform()
+    viewer.viewport().repaint()
+    steps = []
+    for i in range(20):
+        tone = display.ToneMapping(0.01 * i, 1.0 - 0.01 * i, 1.0 + 0.05 * i)
+        start = time.perf_counter()
+        viewer.setTone(tone)
+        viewer.viewport().repaint()
+        steps.append((time.perf_counter() - start) * 1e3)
+    record('levels', statistics.median(steps))
+
+    def histogram():
+        engine = display.HistogramEngine(image, metadata)
+        engine.compute(step=engine.quickStep())
+        return engine
+
+    ms, engine = timed(histogram, repeat)
+    record('histogram', ms)
+    ms, _ = timed(engine.compute, repeat)
+    record('histogram_exact', ms)
+
+    viewer.close()
+    return {
+        'height': int(image.shape[0]),
+        'width': int(image.shape[1]),
+        'stages': stages,
+        'startup_rss_mb': startup_rss_mb,
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+
+def environment():
+    sys.path.insert(0, str(SRC))
+    import numpy as np
+    from PyQt6.QtCore import QT_VERSION_STR
+    import display
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpus': os.cpu_count(),
+        'numpy': np.__version__,
+        'qt': QT_VERSION_STR,
+        'cxx_image_io': display.decoderVersion()
+    }
+
+
+def run_child(*args):
+    env = dict(os.environ, QT_QPA_PLATFORM='offscreen')
+    output = subprocess.run([sys.executable, __file__, *map(str, args)],
+                            env=env,
+                            check=True,
+                            capture_output=True,
+                            text=True).stdout
+    return json.loads(output.strip().splitlines()[-1]) if output else None
+
+
+def run_case(directory, representation, pixel_type, megapixels, args):
+    if representation == 'uint8' and pixel_type != 'bayer':
+        suffix = '.png'
+    else:
+        suffix = '.plain8' if representation == 'uint8' else '.plain16'
+    path = pathlib.Path(directory) / (
+        case_name(representation, pixel_type, megapixels) + suffix)
+    try:
+        run_child('--generate', path, representation, pixel_type, megapixels,
+                  args.precision)
+        return run_child('--measure', path, args.repeat)
+    finally:
+        path.unlink(missing_ok=True)
+        path.with_suffix('.json').unlink(missing_ok=True)
+
+
+def compare(results, baseline, tolerance, min_delta_ms):
+    """Regressions of `results` against `baseline`, as messages"""
+    failures = []
+    for name, case in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        for stage in STAGES:
+            new = case['stages'][stage]['ms']
+            old = reference['stages'].get(stage, {}).get('ms')
+            if old is not None and new > old * (
+                    1 + tolerance) and new - old > min_delta_ms:
+                failures.append('{} {}: {:.2f} ms, baseline {:.2f} ms'.format(
+                    name, stage, new, old))
+        new, old = case['peak_rss_mb'], reference['peak_rss_mb']
+        if new > old * (1 + tolerance):
+            failures.append('{} peak RSS: {:.0f} MB, baseline {:.0f} MB'.format(
+                name, new, old))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sizes',
+                        type=float,
+                        nargs='+',
+                        default=[1, 12, 100],
+                        help='Image sizes in MP.')
+    parser.add_argument('--representations',
+                        nargs='+',
+                        choices=REPRESENTATIONS,
+                        default=REPRESENTATIONS)
+    parser.add_argument('--pixel-types',
+                        nargs='+',
+                        choices=PIXEL_TYPES,
+                        default=PIXEL_TYPES)
+    parser.add_argument('--precision',
+                        type=int,
+                        default=12,
+                        help='Pixel precision of the UINT16 images.')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--save', help='Write the results to this JSON file.')
+    parser.add_argument('--baseline', help='JSON saved by --save.')
+    parser.add_argument('--tolerance',
+                        type=float,
+                        default=0.25,
+                        help='Allowed slowdown against the baseline.')
+    parser.add_argument('--min-delta-ms',
+                        type=float,
+                        default=1.0,
+                        help='Slowdowns below this are ignored as noise.')
+    parser.add_argument('--generate', nargs=5, help=argparse.SUPPRESS)
+    parser.add_argument('--measure', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.generate:
+        path, representation, pixel_type, megapixels, precision = args.generate
+        sys.path.insert(0, str(SRC))
+        import display  # noqa: F401, cxx_image 需要先导入 cxx_image_io
+        generate(pathlib.Path(path), representation, pixel_type,
+                 float(megapixels), int(precision))
+        return
+    if args.measure:
+        print(json.dumps(measure(pathlib.Path(args.measure[0]),
+                                 int(args.measure[1]))))
+        return
+
+    columns = STAGES + ['peak_rss_mb']
+    print(('{:<22}' + '{:>16}' * len(columns)).format('case', *columns))
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for megapixels in args.sizes:
+            for representation in args.representations:
+                for pixel_type in args.pixel_types:
+                    name = case_name(representation, pixel_type, megapixels)
+                    case = run_case(directory, representation, pixel_type,
+                                    megapixels, args)
+                    results[name] = case
+                    values = [case['stages'][s]['ms'] for s in STAGES]
+                    print(('{:<22}' + '{:>16.2f}' * len(STAGES) +
+                           '{:>16.0f}').format(name, *values,
+                                               case['peak_rss_mb']),
+                          flush=True)
+
+    report = {
+        'environment': environment(),
+        'config': {
+            'sizes': args.sizes,
+            'precision': args.precision,
+            'repeat': args.repeat
+        },
+        'results': results
+    }
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=4)
+
+    failures = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['environment'] != report['environment']:
+            print('Baseline recorded on a different environment: {}'.format(
+                baseline['environment']))
+        failures = compare(results, baseline['results'], args.tolerance,
+                           args.min_delta_ms)
+    for failure in failures:
+        print('FAIL: {}'.format(failure))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -8,181 +8,3848 @@ Author: Yuan SUN
 """
 
 import sys
+# Qt 控件、numpy、cxx_image_io 和进程池在第一次绘制前就要用到：加载线程随窗口
+# 一起启动，立即读取内嵌预览并提交解码。绘制之后才用到的 pyqtgraph、
+# qdarkstyle 和 QtNetwork 在使用处导入
 from PyQt6.QtWidgets import (QApplication, QWidget, QHBoxLayout, QVBoxLayout,
                              QTabWidget, QFrame, QGroupBox, QScrollArea,
                              QLabel, QGridLayout, QMessageBox, QGraphicsView,
-                             QGraphicsScene, QGraphicsPixmapItem)
-from PyQt6.QtGui import QPixmap, QImage, QPainter
-from PyQt6.QtCore import Qt
-import pyqtgraph as pg
-from cxx_image_io import read_image, PixelRepresentation, PixelType
+                             QGraphicsScene, QGraphicsItem, QProgressBar,
+                             QPushButton, QComboBox, QRubberBand, QSpinBox,
+                             QSplitter, QSlider, QDoubleSpinBox, QCheckBox)
+from PyQt6.QtGui import (QPixmap, QImage, QPainter, QKeySequence, QShortcut,
+                         QColor, QFontDatabase)
+from PyQt6.QtCore import (Qt, QRect, QRectF, QSize, QThread, QTimer,
+                          QFileSystemWatcher, pyqtSignal)
+from PyQt6 import sip
+from cxx_image_io import (read_image, write_image,
+                          ExifMetadata, FileFormat,
+                          CxxImageReader, ImageLayout, ImageMetadata,
+                          ImageWriter, LibRaw, LibRaw_errors, LibRawImageReader, LibRawParameters, Matrix3, Metadata,
+                          PixelRepresentation, PixelType)
 import argparse
+import atexit
+import bisect
+import collections
+import concurrent.futures.process
+import contextlib
+import csv
+import getpass
+import glob
+import hashlib
+import itertools
+import json
+import math
+import mmap
+import multiprocessing
+import os
 import pathlib
+import shutil
+import struct
+import tempfile
+import threading
+import time
 import numpy as np
-import qdarkstyle
+
+
+def currentRss():
+    """Resident memory of the process in bytes, None without /proc"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+class Profiler:
+    """Named timing spans written as a Chrome trace, and cache hit counts.
+
+    Spans are only recorded once `enabled` is set (``--profile``), each one
+    with the change of resident memory during the span. Hit counts are
+    always kept, they are shown by the HUD of the viewer.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.origin = time.perf_counter()
+        self.events = []
+        self.hits = collections.Counter()
+
+    @contextlib.contextmanager
+    def span(self, name, **args):
+        if not self.enabled:
+            yield
+            return
+        rss = currentRss()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            if rss is not None:
+                args['rss_delta_mb'] = (currentRss() - rss) / 2**20
+            self.events.append((name, start, end, self.thread(), args))
+
+    def mark(self, name):
+        """Instant event, e.g. the first paint of the window"""
+        if self.enabled:
+            now = time.perf_counter()
+            self.events.append((name, now, None, self.thread(), {}))
+
+    @staticmethod
+    def thread():
+        # 线程结束后 ident 会被复用，加上 QThread 子类的名字区分
+        if threading.current_thread() is threading.main_thread():
+            return threading.get_ident(), 'main'
+        return threading.get_ident(), type(QThread.currentThread()).__name__
+
+    def hit(self, cache, hit):
+        self.hits[cache, bool(hit)] += 1
+
+    def hitRate(self, cache):
+        hits, misses = self.hits[cache, True], self.hits[cache, False]
+        return hits, hits + misses
+
+    def summary(self):
+        """Per span name: count, total ms, max ms, memory delta MB"""
+        stages = {}
+        for name, start, end, _, args in self.events:
+            if end is None:
+                continue
+            count, total, longest, rss = stages.get(name, (0, 0, 0, 0))
+            ms = (end - start) * 1e3
+            stages[name] = (count + 1, total + ms, max(longest, ms),
+                            rss + args.get('rss_delta_mb', 0))
+        return stages
+
+    def dump(self, path):
+        pid = os.getpid()
+        threads = {}
+        trace = []
+        for name, start, end, thread, args in self.events:
+            if thread not in threads:
+                threads[thread] = len(threads) + 1
+                trace.append({
+                    'name': 'thread_name',
+                    'ph': 'M',
+                    'pid': pid,
+                    'tid': threads[thread],
+                    'args': {
+                        'name': thread[1]
+                    }
+                })
+            event = {
+                'name': name,
+                'cat': 'display',
+                'ts': (start - self.origin) * 1e6,
+                'pid': pid,
+                'tid': threads[thread],
+                'args': args
+            }
+            if end is None:
+                event.update(ph='i', s='p')
+            else:
+                event.update(ph='X', dur=(end - start) * 1e6)
+            trace.append(event)
+        caches = {
+            cache: dict(zip(('hits', 'lookups'), self.hitRate(cache)))
+            for cache, _ in self.hits
+        }
+        with open(path, 'w') as f:
+            json.dump({
+                'traceEvents': trace,
+                'displayTimeUnit': 'ms',
+                'otherData': {
+                    'caches': caches
+                }
+            }, f)
+
+        print('Profile written to {}'.format(path))
+        print('{:<36}{:>8}{:>12}{:>12}{:>14}'.format('span', 'count',
+                                                    'total ms', 'max ms',
+                                                    'memory MB'))
+        for name, (count, total, longest,
+                   rss) in sorted(self.summary().items(),
+                                  key=lambda item: -item[1][1]):
+            print('{:<36}{:>8}{:>12.1f}{:>12.1f}{:>+14.1f}'.format(
+                name, count, total, longest, rss))
+        for cache, rate in caches.items():
+            print('{} cache: {hits}/{lookups} hits'.format(cache, **rate))
+
+
+profiler = Profiler()
+
+BAYER_TYPES = [
+    PixelType.BAYER_RGGB, PixelType.BAYER_BGGR, PixelType.BAYER_GRBG,
+    PixelType.BAYER_GBRG
+]
+
+
+class ImageConverter:
+    """Wrap numpy images as QImage with as few copies as possible.
+
+    8 bit images are wrapped in place using their own row stride. 16 bit
+    images below 16 bit precision are stretched to the full range by bit
+    replication, processed in row chunks into one output buffer that is
+    reused between calls. The returned QImage points to that memory, so it
+    is only valid until the next call or while `img` is alive; convert it to
+    a QPixmap or `copy()` it to keep it.
+    """
+
+    # 每块约 128K 个值，源数据和中间结果都留在 L2 缓存中
+    chunk_values = 2**17
+
+    def __init__(self):
+        self.buffer = np.empty(0, dtype=np.uint16)
+        self.scratch = np.empty(0, dtype=np.uint16)
+
+    @staticmethod
+    def reuse(buffer, shape):
+        size = math.prod(shape)
+        if buffer.size < size:
+            buffer = np.empty(size, dtype=np.uint16)
+        return buffer, buffer[:size].reshape(shape)
+
+    @staticmethod
+    def hasPackedRows(img, channels):
+        itemsize = img.dtype.itemsize
+        return (img.strides[0] > 0 and img.strides[1] == itemsize * channels
+                and (img.ndim == 2 or img.strides[2] == itemsize))
+
+    @staticmethod
+    def wrap(image, qformat):
+        return QImage(sip.voidptr(image.ctypes.data), image.shape[1],
+                      image.shape[0], image.strides[0], qformat)
+
+    def stretch(self, img, precision, shape):
+        """16 bit values scaled from `precision` bits to the full range, RGB
+        padded with an opaque X channel when `shape` has 4 channels"""
+        self.buffer, out = self.reuse(self.buffer, shape)
+        chunk_rows = max(
+            1, self.chunk_values // max(1, math.prod(img.shape[1:])))
+        for top in range(0, img.shape[0], chunk_rows):
+            rows = slice(top, top + chunk_rows)
+            chunk = out[rows]
+            source = img[rows]
+            if precision and precision < 16:
+                self.scratch, scratch = self.reuse(self.scratch,
+                                                   (3, ) + source.shape)
+                # RGB 写入 RGBX 时先在连续内存中计算
+                work = chunk if chunk.shape == source.shape else scratch[2]
+                maximum = 2**precision - 1
+                if source.max(initial=0) > maximum:
+                    # 超出精度的值先截断，否则移位后溢出到高位
+                    source = np.minimum(source, maximum, out=scratch[1])
+                # v * 65535 / (2^p - 1) 约等于把 p 位的值重复填满 16 位，
+                # 如 10 位为 v << 6 | v >> 4，每一项都直接从源数据移位
+                shifts = range(16 - precision, -precision, -precision)
+                np.left_shift(source, shifts[0], out=work)
+                for shift in shifts[1:]:
+                    if shift >= 0:
+                        np.left_shift(source, shift, out=scratch[0])
+                    else:
+                        np.right_shift(source, -shift, out=scratch[0])
+                    np.bitwise_or(work, scratch[0], out=work)
+                source = work
+            if source is chunk:
+                continue
+            if chunk.shape == source.shape:
+                np.copyto(chunk, source)
+            else:
+                # 逐通道写入比一次三通道的跨步拷贝快一倍
+                for channel in range(source.shape[2]):
+                    np.copyto(chunk[..., channel], source[..., channel])
+                chunk[..., 3] = 65535
+        return out
+
+    def convert(self, img, metadata):
+        pixelType = metadata.fileInfo.pixelType
+        precision = metadata.fileInfo.pixelPrecision
+        if metadata.fileInfo.pixelRepresentation == PixelRepresentation.UINT8:
+            if pixelType in BAYER_TYPES or pixelType == PixelType.GRAYSCALE:
+                qformat, channels = QImage.Format.Format_Grayscale8, 1
+            elif pixelType == PixelType.RGB:
+                qformat, channels = QImage.Format.Format_RGB888, 3
+            elif pixelType == PixelType.RGBA:
+                qformat, channels = QImage.Format.Format_RGBA8888, 4
+            else:
+                raise ValueError(
+                    "Unsupported pixel type  on 8 bits: {} ".format(
+                        pixelType))
+            if not self.hasPackedRows(img, channels):
+                img = np.ascontiguousarray(img)
+            return self.wrap(img, qformat)
+
+        elif (metadata.fileInfo.pixelRepresentation ==
+              PixelRepresentation.UINT16):
+            if pixelType in BAYER_TYPES or pixelType == PixelType.GRAYSCALE:
+                qformat, shape = QImage.Format.Format_Grayscale16, img.shape
+            elif pixelType == PixelType.RGB:
+                # Qt 没有 48 位 RGB 格式，补上不透明的 X 通道
+                qformat, shape = QImage.Format.Format_RGBX64, img.shape[:2] + (
+                    4, )
+            elif pixelType == PixelType.RGBA:
+                qformat, shape = QImage.Format.Format_RGBA64, img.shape
+            else:
+                raise ValueError(
+                    "Unsupported pixel type  on 16 bits: {} ".format(
+                        pixelType))
+            channels = shape[2] if len(shape) == 3 else 1
+            if (not precision or precision >= 16) and shape == img.shape \
+                    and self.hasPackedRows(img, channels):
+                return self.wrap(img, qformat)
+            return self.wrap(self.stretch(img, precision, shape), qformat)
+
+        else:
+            raise ValueError("Unsupported pixel representation: {} ".format(
+                metadata.fileInfo.pixelRepresentation))
+
+    def toUint8(self, img, metadata):
+        """8 bit array with the same value mapping as `convert`, without Qt"""
+        fileInfo = metadata.fileInfo
+        if fileInfo.pixelType not in BAYER_TYPES + [
+                PixelType.GRAYSCALE, PixelType.RGB, PixelType.RGBA
+        ]:
+            raise ValueError("Unsupported pixel type: {} ".format(
+                fileInfo.pixelType))
+        if fileInfo.pixelRepresentation == PixelRepresentation.UINT8:
+            return np.ascontiguousarray(img)
+        if fileInfo.pixelRepresentation == PixelRepresentation.UINT16:
+            out = self.stretch(img, fileInfo.pixelPrecision, img.shape)
+            return (out >> 8).astype(np.uint8)
+        raise ValueError("Unsupported pixel representation: {} ".format(
+            fileInfo.pixelRepresentation))
+
+
+def convertNumpyArrayToQImage(img, metadata):
+    """Standalone conversion, the returned QImage owns its pixels"""
+    return ImageConverter().convert(img, metadata).copy()
+
+
+# 每种 CFA 排列下各通道在 2x2 单元中的位置 (dy, dx)
+BAYER_OFFSETS = {
+    PixelType.BAYER_RGGB: {
+        'R': (0, 0),
+        'Gr': (0, 1),
+        'Gb': (1, 0),
+        'B': (1, 1)
+    },
+    PixelType.BAYER_BGGR: {
+        'B': (0, 0),
+        'Gb': (0, 1),
+        'Gr': (1, 0),
+        'R': (1, 1)
+    },
+    PixelType.BAYER_GRBG: {
+        'Gr': (0, 0),
+        'R': (0, 1),
+        'B': (1, 0),
+        'Gb': (1, 1)
+    },
+    PixelType.BAYER_GBRG: {
+        'Gb': (0, 0),
+        'B': (0, 1),
+        'R': (1, 0),
+        'Gr': (1, 1)
+    },
+}
+
+
+def displayMetadata(pixelType, pixelRepresentation, pixelPrecision):
+    """Minimal metadata describing an array prepared for display"""
+    metadata = ImageMetadata()
+    metadata.fileInfo.pixelType = pixelType
+    metadata.fileInfo.pixelRepresentation = pixelRepresentation
+    metadata.fileInfo.pixelPrecision = pixelPrecision
+    return metadata
+
+
+IMAGE_EXTENSIONS = {
+    '.bmp', '.cfa', '.dng', '.jpg', '.jpeg', '.rawmipi', '.rawmipi10',
+    '.rawmipi12', '.raw', '.plain16', '.png', '.tif', '.tiff', '.cr2', '.nef',
+    '.arw', '.rw2', '.dcr', '.srw', '.orf', '.pef'
+}
+
+
+def collectImagePaths(pattern):
+    """Image files given as a file, a directory or a glob pattern"""
+    path = pathlib.Path(pattern)
+    if path.is_file():
+        return [path]
+    if path.is_dir():
+        candidates = path.iterdir()
+    else:
+        candidates = (pathlib.Path(p)
+                      for p in glob.glob(pattern, recursive=True))
+    return sorted(p for p in candidates
+                  if p.is_file() and p.suffix.lower() in IMAGE_EXTENSIONS)
+
+
+def serializeMetadata(metadata):
+    """Plain dict of the metadata, safe to pickle or write as JSON"""
+    serialized = metadata.serialize()
+    if getattr(metadata, 'libRawParameters', None):
+        serialized['LibRawParams'] = dict(metadata.libRawParameters.__dict__)
+    return serialized
+
+
+def _enumValue(enum, name):
+    for member, value in enum.__members__.items():
+        if member.lower() == str(name).lower():
+            return value
+    raise ValueError("Unknown {} value: {}".format(enum.__name__, name))
+
+
+def _metadataValue(section, key, value):
+    if section == 'fileInfo' and key in ('fileFormat', 'imageLayout',
+                                         'pixelType', 'pixelRepresentation'):
+        enum = {
+            'fileFormat': FileFormat,
+            'imageLayout': ImageLayout,
+            'pixelType': PixelType,
+            'pixelRepresentation': PixelRepresentation
+        }[key]
+        return [_enumValue(enum, value)]
+    if section == 'calibrationData' and key == 'colorMatrix':
+        return [Matrix3(np.array(value, dtype=np.float64))]
+    if section == 'cameraControls' and key == 'whiteBalance':
+        whiteBalance = ImageMetadata.WhiteBalance()
+        whiteBalance.gainR, whiteBalance.gainB = value
+        return [whiteBalance]
+    if isinstance(value, list) and len(value) == 2:
+        # EXIF 有理数，先试无符号再试有符号
+        rationals = [ExifMetadata.SRational] if min(value) < 0 else [
+            ExifMetadata.Rational, ExifMetadata.SRational
+        ]
+        return [rational(*value) for rational in rationals]
+    return [value]
+
+
+def deserializeMetadata(serialized):
+    """Rebuild a metadata object from the output of serializeMetadata"""
+    libRawParams = serialized.get('LibRawParams')
+    if libRawParams:
+        metadata = Metadata(
+            LibRawParameters(libRawParams['rawWidth'],
+                             libRawParams['rawHeight'],
+                             libRawParams['rawWidthVisible'],
+                             libRawParams['rawHeightVisible'],
+                             libRawParams['topMargin'],
+                             libRawParams['leftMargin']))
+    else:
+        metadata = ImageMetadata()
+    for section in ('fileInfo', 'exifMetadata', 'shootingParams',
+                    'cameraControls', 'calibrationData'):
+        target = getattr(metadata, section)
+        for key, value in serialized.get(section, {}).items():
+            for candidate in _metadataValue(section, key, value):
+                try:
+                    setattr(target, key, candidate)
+                    break
+                except (TypeError, ValueError):
+                    continue
+        # pybind 返回的是副本，需要整体写回
+        setattr(metadata, section, target)
+    return metadata
+
+
+RAW_FILE_FORMATS = {
+    '.plain16': FileFormat.PLAIN,
+    '.rawmipi': FileFormat.RAW10,
+    '.rawmipi10': FileFormat.RAW10,
+    '.rawmipi12': FileFormat.RAW12,
+}
+
+RAW_FILE_PIXEL_TYPES = BAYER_TYPES + [
+    PixelType.QUADBAYER_RGGB, PixelType.QUADBAYER_BGGR,
+    PixelType.QUADBAYER_GRBG, PixelType.QUADBAYER_GBRG, PixelType.GRAYSCALE
+]
+
+
+class RawFile:
+    """Sidecar described PLAIN, MIPI RAW10 or RAW12 file opened with
+    np.memmap.
+
+    Behaves like a read-only 2D numpy array: indexing with integers or
+    slices, e.g. ``raw[y0:y1, x0:x1]`` or ``raw[::4, ::4]``, reads and unpacks
+    only the requested rows and the packed groups covering the requested
+    columns. Nothing is read when the file is opened.
+    """
+
+    ndim = 2
+
+    def __init__(self, path, metadata, fileFormat):
+        fileInfo = metadata.fileInfo
+        self.path = path
+        self.metadata = metadata
+        self.fileFormat = fileFormat
+        height, width = fileInfo.height, fileInfo.width
+        if not height or not width:
+            raise ValueError("Sidecar of {} has no image size".format(path))
+        precision = fileInfo.pixelPrecision or {
+            FileFormat.PLAIN: 16,
+            FileFormat.RAW10: 10,
+            FileFormat.RAW12: 12
+        }[fileFormat]
+        self.shape = (height, width)
+        if fileFormat == FileFormat.PLAIN:
+            self.dtype = np.dtype(np.uint8 if precision <= 8 else '<u2')
+            row_bytes = width * self.dtype.itemsize
+        else:
+            # 一组像素打包成若干字节：RAW10 4 个像素 5 字节，RAW12 2 个像素 3 字节
+            self.dtype = np.dtype(np.uint16)
+            self.group = 4 if fileFormat == FileFormat.RAW10 else 2
+            self.group_bytes = self.group * (
+                10 if fileFormat == FileFormat.RAW10 else 12) // 8
+            if width % self.group:
+                raise ValueError("Invalid image width for {}: {}".format(
+                    fileFormat, width))
+            row_bytes = width // self.group * self.group_bytes
+        size = os.path.getsize(path)
+        stride = row_bytes
+        if fileInfo.widthAlignment:
+            stride = -(-row_bytes // fileInfo.widthAlignment
+                       ) * fileInfo.widthAlignment
+        elif size > row_bytes * height and size % height == 0:
+            # 和 cxx_image 一样，由文件大小推算行对齐
+            stride = size // height
+        if size < stride * height:
+            raise ValueError("{} is too small for a {}x{} image".format(
+                path, width, height))
+        self.raw = np.memmap(path, np.uint8, 'r', shape=(height, stride))
+        if fileFormat == FileFormat.PLAIN:
+            self.pixels = self.raw[:, :row_bytes].view(self.dtype)
+
+        fileInfo.pixelPrecision = precision
+        fileInfo.pixelRepresentation = PixelRepresentation.UINT8 if (
+            self.dtype.itemsize == 1) else PixelRepresentation.UINT16
+        fileInfo.imageLayout = ImageLayout.PLANAR
+        metadata.fileInfo = fileInfo
+
+    @property
+    def nbytes(self):
+        return self.shape[0] * self.shape[1] * self.dtype.itemsize
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None):
+        image = self[:, :]
+        return image if dtype is None else image.astype(dtype)
+
+    def __getitem__(self, key):
+        rows, cols, squeeze = keySlices(key, self.shape)
+        if self.fileFormat == FileFormat.PLAIN:
+            image = np.array(self.pixels[rows, cols])
+        else:
+            image = self.unpack(rows, cols)
+        if len(squeeze) == 2:
+            return image[0, 0]
+        return image.squeeze(squeeze) if squeeze else image
+
+    def unpack(self, rows, cols):
+        start, stop, step = cols.indices(self.shape[1])
+        if step < 0 or stop <= start:
+            return self.unpack(rows, slice(0, self.shape[1]))[:, cols]
+        # 只解包覆盖所需列的数据组
+        first, last = start // self.group, -(-stop // self.group)
+        packed = np.asarray(self.raw[rows, first * self.group_bytes:last *
+                                     self.group_bytes])
+        packed = packed.reshape(len(packed), last - first, self.group_bytes)
+        out = np.empty(packed.shape[:2] + (self.group, ), dtype=np.uint16)
+        if self.fileFormat == FileFormat.RAW10:
+            low = packed[..., 4:5]
+            np.left_shift(packed[..., :4], 2, out=out, dtype=np.uint16)
+            out |= (low >> np.array([0, 2, 4, 6], dtype=np.uint8)) & 3
+        else:
+            low = packed[..., 2]
+            np.left_shift(packed[..., :2], 4, out=out, dtype=np.uint16)
+            out[..., 0] |= low & 0xF
+            out[..., 1] |= low >> 4
+        out = out.reshape(len(packed), -1)
+        offset = first * self.group
+        return out[:, start - offset:stop - offset:step]
+
+
+def readSidecar(image_path, sidecar):
+    """Metadata of a raw file described by its sidecar JSON, None when the
+    sidecar parser of cxx_image_io is not available"""
+    try:
+        # cxx_image_io 没有公开 sidecar 的解析函数，只能用它内部的编译模块
+        # cxx_image，导入 cxx_image_io 之后才在 sys.path 上。找不到时返回
+        # None，由 read_image 解码整个文件
+        from cxx_image import parser
+    except ImportError:
+        return None
+    return parser.readMetadata(str(image_path), str(sidecar))
+
+
+def openRawFile(image_path, metadata_path=None):
+    """RawFile for a PLAIN / MIPI RAW file with a sidecar, else None"""
+    image_path = pathlib.Path(image_path)
+    sidecar = pathlib.Path(
+        metadata_path) if metadata_path else image_path.with_suffix('.json')
+    if not sidecar.exists():
+        return None
+    metadata = readSidecar(image_path, sidecar)
+    if metadata is None:
+        return None
+    fileFormat = metadata.fileInfo.fileFormat or RAW_FILE_FORMATS.get(
+        image_path.suffix.lower())
+    if fileFormat is None or (metadata.fileInfo.pixelType
+                              not in RAW_FILE_PIXEL_TYPES + [None]):
+        return None
+    return RawFile(image_path, metadata, fileFormat)
+
+
+class DifferenceImage:
+    """Lazy ``a - b`` or ``a / b`` of two images of the same shape.
+
+    Behaves like a read-only float32 array: only the requested slices of
+    `a` and `b` are read and combined, so an ImagePyramid over it computes
+    the visible tiles on demand without any full size intermediate. Ratios
+    with a zero denominator are NaN.
+    """
+
+    dtype = np.dtype(np.float32)
+    modes = ('difference', 'ratio')
+
+    def __init__(self, a, b, mode='difference'):
+        if a.shape != b.shape:
+            raise ValueError("Cannot compare a {} image with a {} image".format(
+                'x'.join(map(str, a.shape)), 'x'.join(map(str, b.shape))))
+        if mode not in self.modes:
+            raise ValueError("Unknown comparison: {}".format(mode))
+        self.a, self.b, self.mode = a, b, mode
+        self.shape = a.shape
+        self.ndim = len(a.shape)
+
+    @property
+    def nbytes(self):
+        return 0
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None):
+        image = self[:, :]
+        return image if dtype is None else image.astype(dtype)
+
+    def __getitem__(self, key):
+        a = np.asarray(self.a[key], dtype=self.dtype)
+        b = np.asarray(self.b[key], dtype=self.dtype)
+        if self.mode == 'difference':
+            return a - b
+        return np.divide(a, b, out=np.full_like(a, np.nan), where=b != 0)
+
+
+def cfaChannel(pixelType, y, x):
+    """Bayer channel of pixel (`y`, `x`), None for other pixel types"""
+    offsets = BAYER_OFFSETS.get(QUADBAYER_TYPES.get(pixelType, pixelType))
+    if offsets is None:
+        return None
+    cell = 2 if pixelType in QUADBAYER_TYPES else 1
+    position = (y // cell % 2, x // cell % 2)
+    for channel, offset in offsets.items():
+        if offset == position:
+            return channel
+
+
+def keySlices(key, shape):
+    """Slices of an index of a 2D array, and the axes indexed by an integer
+    to squeeze from the result"""
+    if not isinstance(key, tuple):
+        key = (key, )
+    key = key + (slice(None), ) * (2 - len(key))
+    squeeze = tuple(i for i, k in enumerate(key) if not isinstance(k, slice))
+    rows, cols = (k if isinstance(k, slice) else slice(k % n, k % n + 1)
+                  for k, n in zip(key, shape))
+    return rows, cols, squeeze
+
+
+class PlaneView:
+    """Pixels (`dy` + 2i, `dx` + 2j) of a RawFile, the counterpart of the
+    strided view ``image[dy::2, dx::2]`` of an array: indexing reads only
+    the requested rows and columns of the plane from the file."""
+
+    ndim = 2
+
+    def __init__(self, image, dy, dx):
+        self.image, self.dy, self.dx = image, dy, dx
+        rows, cols = image.shape
+        self.shape = ((rows - dy + 1) // 2, (cols - dx + 1) // 2)
+        self.dtype = image.dtype
+
+    @property
+    def nbytes(self):
+        return 0
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None):
+        image = self[:, :]
+        return image if dtype is None else image.astype(dtype)
+
+    def __getitem__(self, key):
+        rows, cols, squeeze = keySlices(key, self.shape)
+        image = self.image[self.sourceSlice(rows, self.dy, self.shape[0]),
+                           self.sourceSlice(cols, self.dx, self.shape[1])]
+        if len(squeeze) == 2:
+            return image[0, 0]
+        return image.squeeze(squeeze) if squeeze else image
+
+    @staticmethod
+    def sourceSlice(key, offset, size):
+        indices = range(*key.indices(size))
+        if not indices:
+            return slice(0, 0)
+        stop = offset + 2 * indices[-1] + (1 if indices.step > 0 else -1)
+        return slice(offset + 2 * indices.start, stop if stop >= 0 else None,
+                     2 * indices.step)
+
+
+def bayerPlanes(image, pixelType):
+    """R, Gr, Gb and B planes of a Bayer image, strided views sharing the
+    memory of `image`, or PlaneViews of a RawFile"""
+    return {
+        channel: PlaneView(image, dy, dx) if isinstance(image, RawFile) else
+        image[dy::2, dx::2]
+        for channel, (dy, dx) in BAYER_OFFSETS[pixelType].items()
+    }
+
+
+class PlaneMosaic:
+    """The four planes of a Bayer image side by side, R and Gr on top, Gb
+    and B below.
+
+    Behaves like a read-only 2D array, like DifferenceImage: indexing with
+    slices of positive step reads only the part of each plane that falls
+    in the requested rows and columns.
+    """
+
+    ndim = 2
+    layout = (('R', 'Gr'), ('Gb', 'B'))
+
+    def __init__(self, planes):
+        self.planes = planes
+        self.plane_shape = tuple(
+            max(plane.shape[axis] for plane in planes.values())
+            for axis in (0, 1))
+        self.shape = (2 * self.plane_shape[0], 2 * self.plane_shape[1])
+        self.dtype = planes['R'].dtype
+
+    @property
+    def nbytes(self):
+        return 0
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None):
+        image = self[:, :]
+        return image if dtype is None else image.astype(dtype)
+
+    def __getitem__(self, key):
+        rows, cols, squeeze = keySlices(key, self.shape)
+        ys = range(*rows.indices(self.shape[0]))
+        xs = range(*cols.indices(self.shape[1]))
+        image = np.zeros((len(ys), len(xs)), dtype=self.dtype)
+        height, width = self.plane_shape
+        for qy, names in enumerate(self.layout):
+            # 落在这一行象限中的输出行
+            y0, y1 = (bisect.bisect_left(ys, qy * height),
+                      bisect.bisect_left(ys, (qy + 1) * height))
+            if y0 == y1:
+                continue
+            plane_rows = slice(ys[y0] - qy * height, ys[y1 - 1] - qy * height +
+                               1, ys.step)
+            for qx, name in enumerate(names):
+                x0, x1 = (bisect.bisect_left(xs, qx * width),
+                          bisect.bisect_left(xs, (qx + 1) * width))
+                if x0 == x1:
+                    continue
+                plane_cols = slice(xs[x0] - qx * width,
+                                   xs[x1 - 1] - qx * width + 1, xs.step)
+                part = self.planes[name][plane_rows, plane_cols]
+                image[y0:y0 + part.shape[0], x0:x0 + part.shape[1]] = part
+        if len(squeeze) == 2:
+            return image[0, 0]
+        return image.squeeze(squeeze) if squeeze else image
+
+    def source(self, y, x):
+        """Channel and position in its plane of the mosaic pixel (y, x)"""
+        height, width = self.plane_shape
+        return self.layout[y // height][x // width], y % height, x % width
+
+    def quadrant(self, y, x):
+        """(top, left, bottom, right) of the plane holding pixel (y, x)"""
+        height, width = self.plane_shape
+        top, left = y // height * height, x // width * width
+        return top, left, top + height, left + width
+
+
+def clippingLevels(metadata, dtype):
+    """Black and white levels of the calibration data, else the range of
+    the pixel precision"""
+    fileInfo = metadata.fileInfo
+    calibration = metadata.calibrationData
+    black = calibration.blackLevel
+    black = float(np.mean(black)) if black is not None else 0.0
+    if calibration.whiteLevel:
+        white = float(calibration.whiteLevel)
+    elif np.issubdtype(dtype, np.integer):
+        white = float(2**fileInfo.pixelPrecision -
+                      1 if fileInfo.pixelPrecision else np.iinfo(dtype).max)
+    else:
+        white = 1.0
+    return black, white
+
+
+def clippingCounts(image, black, white, chunk_rows=256):
+    """Pixels at or above `white` and at or below `black` in the whole
+    image, read in chunks of rows. A color pixel is saturated when one of
+    its components is, crushed when all of them are."""
+    saturated = crushed = 0
+    for top in range(0, image.shape[0], chunk_rows):
+        chunk = np.asarray(image[top:top + chunk_rows])
+        high, low = chunk >= white, chunk <= black
+        if chunk.ndim == 3:
+            high, low = high.any(axis=2), low.all(axis=2)
+        saturated += int(np.count_nonzero(high))
+        crushed += int(np.count_nonzero(low))
+    return saturated, crushed, image.shape[0] * image.shape[1]
+
+
+def planeStatistics(image, metadata, chunk_rows=512):
+    """Count, mean, standard deviation and clipped fraction of the R, Gr,
+    Gb and B planes.
+
+    The image is read once, in chunks of rows viewed as (rows / 2, 2,
+    cols / 2, 2) CFA cells, and the four planes are reduced together.
+    Values at or above the white level, or at the top of the pixel
+    precision, are counted as clipped.
+    """
+    fileInfo = metadata.fileInfo
+    integer = np.issubdtype(image.dtype, np.integer)
+    _, white = clippingLevels(metadata, image.dtype)
+    rows, cols = image.shape[0] // 2 * 2, image.shape[1] // 2 * 2
+    acc_type = np.uint64 if integer else np.float64
+    sums = np.zeros((2, 2), dtype=acc_type)
+    squares = np.zeros((2, 2), dtype=acc_type)
+    clipped = np.zeros((2, 2), dtype=np.int64)
+    for top in range(0, rows, chunk_rows):
+        bottom = min(top + chunk_rows, rows)
+        cells = np.asarray(image[top:bottom, :cols]).reshape(
+            (bottom - top) // 2, 2, cols // 2, 2)
+        values = cells.astype(acc_type)
+        sums += values.sum(axis=(0, 2))
+        squares += (values * values).sum(axis=(0, 2))
+        clipped += (cells >= white).sum(axis=(0, 2))
+    count = rows * cols // 4
+    stats = {}
+    for channel, (dy, dx) in BAYER_OFFSETS[fileInfo.pixelType].items():
+        if count == 0:
+            stats[channel] = None
+            continue
+        total, square = sums[dy, dx], squares[dy, dx]
+        if integer:
+            # Python 整数精确计算方差
+            total, square = int(total), int(square)
+            variance = (count * square - total * total) / count**2
+        else:
+            variance = max(square / count - (total / count)**2, 0.0)
+        stats[channel] = (count, total / count, math.sqrt(variance),
+                          int(clipped[dy, dx]) / count)
+    return stats
+
+
+def decodeImage(image_path, metadata_path=None, spill_bytes=None,
+                spill_dir=None):
+    """read_image for a worker process, metadata returned serialized.
+
+    An image larger than `spill_bytes` is written to a .npy file in
+    `spill_dir` and its path returned instead of the pixels, to be opened
+    with decodedResult as a memory map.
+    """
+    image, metadata = read_image(image_path, metadata_path)
+    if spill_bytes is not None and image.nbytes > spill_bytes:
+        fd, path = tempfile.mkstemp(suffix='.npy', dir=spill_dir)
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, image)
+        return path, serializeMetadata(metadata)
+    return image, serializeMetadata(metadata)
+
+
+_decoded_lock = threading.Lock()
+
+
+def decodedResult(future):
+    """Image and metadata of a finished decodeImage future.
+
+    A spilled image is mapped once, the loader and the prefetcher may both
+    hold the same future.
+    """
+    with _decoded_lock:
+        if not hasattr(future, 'decoded'):
+            image, serialized = future.result()
+            if isinstance(image, str):
+                path, image = image, np.load(image, mmap_mode='r')
+                with contextlib.suppress(OSError):
+                    # 映射建立后文件可以删除，空间在映射释放时回收；Windows 上留到退出时
+                    os.unlink(path)
+            future.decoded = image, deserializeMetadata(serialized)
+        return future.decoded
+
+
+_spill_dir = None
+
+
+def spillArgs(memory_budget):
+    """decodeImage arguments spilling images over a quarter of the budget"""
+    if memory_budget is None:
+        return ()
+    return memory_budget // 4, spillDir()
+
+
+def spillDir():
+    """Temporary directory of the spilled images, removed at exit"""
+    global _spill_dir
+    if _spill_dir is None:
+        _spill_dir = tempfile.mkdtemp(prefix='display-image-')
+        atexit.register(shutil.rmtree, _spill_dir, True)
+    return _spill_dir
+
+
+_decode_pool = None
+
+
+def decodePool():
+    """Process pool shared by the loader and the prefetcher.
+
+    read_image holds the GIL while decoding, so decoding in a thread would
+    freeze the GUI for the whole decode.
+    """
+    global _decode_pool
+    if _decode_pool is None:
+        _decode_pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=2, mp_context=multiprocessing.get_context('spawn'))
+    return _decode_pool
+
+
+def shutdownDecodePool():
+    global _decode_pool
+    if _decode_pool is not None:
+        _decode_pool.shutdown(cancel_futures=True)
+        _decode_pool = None
+
+
+def submitDecode(image_path, metadata_path=None, memory_budget=None):
+    """decodeImage future from the decode pool.
+
+    A decoder process that dies, e.g. LibRaw crashing on a corrupt file or
+    the OOM killer, breaks the whole pool: it is then replaced by a new one.
+    """
+    args = (decodeImage, image_path, metadata_path) + spillArgs(memory_budget)
+    try:
+        return decodePool().submit(*args)
+    except concurrent.futures.process.BrokenProcessPool:
+        # 已提交的任务都已失败，关闭旧的进程池后重建
+        shutdownDecodePool()
+        return decodePool().submit(*args)
+
+
+class BayerDemosaic:
+    """8 bit sRGB preview of a Bayer mosaic built from strided numpy slices.
+
+    Black and white level, white balance gains and the color matrix come
+    from the image metadata when present. `binned` averages every 2x2 CFA
+    cell into one half resolution pixel, `bilinear` interpolates the missing
+    channels at full resolution. Both work on chunks of `chunk_rows` rows,
+    processed in parallel, so float intermediates stay bounded by the chunk
+    size times the number of CPUs.
+    """
+
+    modes = ('binned', 'bilinear')
+    chunk_rows = 256
+
+    def __init__(self, metadata):
+        fileInfo = metadata.fileInfo
+        self.offsets = BAYER_OFFSETS[fileInfo.pixelType]
+        precision = fileInfo.pixelPrecision or (
+            16 if fileInfo.pixelRepresentation == PixelRepresentation.UINT16
+            else 8)
+        calibration = metadata.calibrationData
+        black = calibration.blackLevel
+        white = calibration.whiteLevel
+        self.black = float(np.mean(black)) if black is not None else 0.0
+        self.white = float(
+            white) if white is not None else float(2**precision - 1)
+        self.gains = {'R': 1.0, 'Gr': 1.0, 'Gb': 1.0, 'B': 1.0}
+        whiteBalance = metadata.cameraControls.whiteBalance
+        if whiteBalance is not None and whiteBalance.gainR > 0 \
+                and whiteBalance.gainB > 0:
+            self.gains['R'] = whiteBalance.gainR
+            self.gains['B'] = whiteBalance.gainB
+        colorMatrix = calibration.colorMatrix
+        self.colorMatrix = np.array(
+            colorMatrix, dtype=np.float32) if colorMatrix is not None else None
+        # 线性值量化到 4096 级后查表做 sRGB 伽马
+        linear = np.linspace(0.0, 1.0, 4096)
+        self.gamma = np.round(255.0 * np.where(
+            linear <= 0.0031308, 12.92 * linear, 1.055 * linear**
+            (1 / 2.4) - 0.055)).astype(np.uint8)
+
+    def normalize(self, mosaic, first_row=0):
+        """Black/white level and white balance applied site by site"""
+        out = mosaic.astype(np.float32)
+        out -= self.black
+        out *= 1.0 / max(self.white - self.black, 1.0)
+        for channel, (dy, dx) in self.offsets.items():
+            if self.gains[channel] != 1.0:
+                out[(dy + first_row) % 2::2, dx::2] *= self.gains[channel]
+        return out
+
+    def finish(self, rgb):
+        if self.colorMatrix is not None:
+            rgb = rgb @ self.colorMatrix.T
+        np.clip(rgb, 0.0, 1.0, out=rgb)
+        rgb *= 4095.0
+        return self.gamma[rgb.astype(np.uint16)]
+
+    def forEachChunk(self, rows, process):
+        # numpy 运算会释放 GIL，各行块可以并行处理
+        with concurrent.futures.ThreadPoolExecutor(os.cpu_count()) as pool:
+            list(pool.map(process, range(0, rows, self.chunk_rows)))
+
+    def binned(self, image):
+        rows, cols = image.shape[0] // 2 * 2, image.shape[1] // 2 * 2
+        out = np.empty((rows // 2, cols // 2, 3), dtype=np.uint8)
+
+        def process(top):
+            mosaic = self.normalize(image[top:min(top + self.chunk_rows, rows),
+                                          :cols])
+
+            def plane(channel):
+                dy, dx = self.offsets[channel]
+                return mosaic[dy::2, dx::2]
+
+            rgb = np.empty(plane('R').shape + (3, ), dtype=np.float32)
+            rgb[..., 0] = plane('R')
+            np.add(plane('Gr'), plane('Gb'), out=rgb[..., 1])
+            rgb[..., 1] *= 0.5
+            rgb[..., 2] = plane('B')
+            out[top // 2:top // 2 + rgb.shape[0]] = self.finish(rgb)
+
+        self.forEachChunk(rows, process)
+        return out
+
+    def bilinear(self, image):
+        rows, cols = image.shape[0] // 2 * 2, image.shape[1] // 2 * 2
+        out = np.empty((rows, cols, 3), dtype=np.uint8)
+
+        def process(top):
+            bottom = min(top + self.chunk_rows, rows)
+            # 上下各多取一行，边界用 reflect 补齐，保持 CFA 相位
+            first, last = max(top - 1, 0), min(bottom + 1, rows)
+            mosaic = self.normalize(image[first:last, :cols], first)
+            mosaic = np.pad(mosaic, ((1 - (top - first), 1 -
+                                      (last - bottom)), (1, 1)),
+                            mode='reflect')
+            height = bottom - top
+            rgb = np.empty((height, cols, 3), dtype=np.float32)
+
+            def at(dy, dx, sy=0, sx=0):
+                return mosaic[1 + dy + sy:1 + dy + sy + height:2,
+                              1 + dx + sx:1 + dx + sx + cols:2]
+
+            for channel, (dy, dx) in self.offsets.items():
+                site = rgb[dy::2, dx::2]
+                site[..., 'RGB'.index(channel[0])] = at(dy, dx)
+                if channel in ('R', 'B'):
+                    site[..., 1] = (at(dy, dx, -1, 0) + at(dy, dx, 1, 0) +
+                                    at(dy, dx, 0, -1) + at(dy, dx, 0, 1)) * 0.25
+                    site[..., 2 if channel == 'R' else 0] = (
+                        at(dy, dx, -1, -1) + at(dy, dx, -1, 1) +
+                        at(dy, dx, 1, -1) + at(dy, dx, 1, 1)) * 0.25
+                else:
+                    horizontal = (at(dy, dx, 0, -1) + at(dy, dx, 0, 1)) * 0.5
+                    vertical = (at(dy, dx, -1, 0) + at(dy, dx, 1, 0)) * 0.5
+                    # 红色行上的绿色：左右是红，上下是蓝
+                    if channel == 'Gr':
+                        site[..., 0], site[..., 2] = horizontal, vertical
+                    else:
+                        site[..., 0], site[..., 2] = vertical, horizontal
+            out[top:bottom] = self.finish(rgb)
+
+        self.forEachChunk(rows, process)
+        return out
+
+    def preview(self, image, mode):
+        """RGB8 array and its size in full resolution pixels per pixel"""
+        if mode == 'binned':
+            return self.binned(image), 2
+        return self.bilinear(image), 1
+
+
+QUADBAYER_TYPES = {
+    PixelType.QUADBAYER_RGGB: PixelType.BAYER_RGGB,
+    PixelType.QUADBAYER_BGGR: PixelType.BAYER_BGGR,
+    PixelType.QUADBAYER_GRBG: PixelType.BAYER_GRBG,
+    PixelType.QUADBAYER_GBRG: PixelType.BAYER_GBRG,
+}
+
+
+HISTOGRAM_PENS = {
+    'R': (255, 60, 60),
+    'G': (60, 220, 60),
+    'Gr': (60, 220, 60),
+    'Gb': (150, 255, 120),
+    'B': (80, 130, 255),
+    'A': (160, 160, 160),
+    'Y': (230, 230, 230),
+    'U': (80, 130, 255),
+    'V': (255, 60, 60),
+}
+
+
+class HistogramEngine:
+    """Per-channel histograms at native bit depth computed with np.bincount.
+
+    Every pixel is counted at ``value + offset``, where the offset pattern
+    gives each channel (RGB component, Bayer or Quad Bayer plane) its own run
+    of `bins` counters, so a single bincount per chunk of rows fills all
+    channels. `compute` accepts a region of interest and a stride; strides
+    are rounded so that the CFA phases are kept.
+    """
+
+    chunk_rows = 256
+    quick_pixels = 2**20
+
+    def __init__(self, image, metadata):
+        fileInfo = metadata.fileInfo
+        self.image = image
+        self.integer = np.issubdtype(image.dtype, np.integer)
+        precision = fileInfo.pixelPrecision or image.dtype.itemsize * 8
+        # 浮点图像按 [0, 1] 分成 1024 级
+        self.bins = 2**precision if self.integer else 1024
+        pixelType = fileInfo.pixelType
+        bayerType = QUADBAYER_TYPES.get(pixelType, pixelType)
+        if bayerType in BAYER_OFFSETS and image.ndim == 2:
+            self.channels = ['R', 'Gr', 'Gb', 'B']
+            pattern = np.empty((2, 2), dtype=np.intp)
+            for i, channel in enumerate(self.channels):
+                pattern[BAYER_OFFSETS[bayerType][channel]] = i * self.bins
+            if pixelType in QUADBAYER_TYPES:
+                pattern = np.kron(pattern, np.ones((2, 2), dtype=np.intp))
+            self.pattern = pattern
+        elif image.ndim == 3:
+            names = 'YUV' if pixelType == PixelType.YUV else 'RGBA'
+            self.channels = list(names[:image.shape[2]])
+            self.pattern = np.arange(image.shape[2], dtype=np.intp) * self.bins
+        else:
+            self.channels = ['Y']
+            self.pattern = np.zeros((1, 1), dtype=np.intp)
+        self.period = self.pattern.shape[0] if image.ndim == 2 else 1
+
+    def quickStep(self):
+        """Stride that samples about `quick_pixels` pixels"""
+        rows, cols = self.image.shape[:2]
+        return max(1, int(math.ceil(math.sqrt(rows * cols /
+                                              self.quick_pixels))))
+
+    def compute(self, rect=None, step=1):
+        """Counts per channel over `rect` (top, left, bottom, right)"""
+        rows, cols = self.image.shape[:2]
+        top, left, bottom, right = rect or (0, 0, rows, cols)
+        # 起点对齐到 CFA 周期，步长模周期为 1，抽样后 CFA 相位不变
+        top, left = top - top % self.period, left - left % self.period
+        step += (1 - step) % self.period
+        height = len(range(top, min(bottom, rows), step))
+        width = len(range(left, min(right, cols), step))
+        counts = np.zeros(len(self.channels) * self.bins, dtype=np.int64)
+        if height == 0 or width == 0:
+            return self.split(counts)
+        if self.image.ndim == 2:
+            offsets = np.tile(self.pattern,
+                              (self.chunk_rows // self.period,
+                               -(-width // self.period)))[:, :width]
+        else:
+            offsets = self.pattern
+        for first in range(0, height, self.chunk_rows):
+            last = min(first + self.chunk_rows, height)
+            chunk = self.image[top + first * step:top + last * step:step,
+                               left:left + width * step:step]
+            if not self.integer:
+                chunk = np.clip(chunk, 0.0, 1.0) * (self.bins - 1)
+            elif np.iinfo(chunk.dtype).max >= self.bins:
+                # 超出位深的值计入最后一级，不能溢出到下一个通道
+                chunk = np.minimum(chunk, self.bins - 1)
+            index = chunk.astype(np.intp)
+            index += offsets[:last - first] if index.ndim == 2 else offsets
+            counts += np.bincount(index.ravel(), minlength=len(counts))
+        return self.split(counts)
+
+    def split(self, counts):
+        return {
+            channel: counts[i * self.bins:(i + 1) * self.bins]
+            for i, channel in enumerate(self.channels)
+        }
+
+
+class IntegralStats:
+    """Mean and standard deviation of any rectangle, per channel, in O(1).
+
+    `build` computes summed-area tables of the values and of their squares
+    for every CFA plane (or color component), in chunks of rows. Once the
+    tables reach `max_memory_bytes` in total, the next ones are kept in a
+    temporary memory-mapped file. A rectangle then costs four lookups per table. Integer sums are
+    exact in uint64 up to 16 bit values on 2**32 pixels, and the variance
+    is computed from them with Python integers. Minimum and maximum do
+    not decompose like sums and are read from the pixels by `extrema`.
+    """
+
+    chunk_rows = 256
+    max_memory_bytes = 64 * 1024 * 1024
+
+    def __init__(self, image, metadata):
+        self.image = image
+        self.integer = np.issubdtype(image.dtype, np.integer)
+        self.dtype = np.dtype(np.uint64 if self.integer else np.float64)
+        pixelType = metadata.fileInfo.pixelType
+        bayerType = QUADBAYER_TYPES.get(pixelType, pixelType)
+        # 每个通道由若干个 (dy, dx) 子平面组成，周期为 self.period
+        if bayerType in BAYER_OFFSETS and image.ndim == 2:
+            self.period = 4 if pixelType in QUADBAYER_TYPES else 2
+            cell = self.period // 2
+            offsets = BAYER_OFFSETS[bayerType]
+            self.channels = {
+                channel: [(offsets[channel][0] * cell + a,
+                           offsets[channel][1] * cell + b)
+                          for a in range(cell) for b in range(cell)]
+                for channel in ['R', 'Gr', 'Gb', 'B']
+            }
+        elif image.ndim == 3:
+            names = 'YUV' if pixelType == PixelType.YUV else 'RGBA'
+            self.period = 1
+            self.channels = {
+                name: [c]
+                for c, name in enumerate(names[:image.shape[2]])
+            }
+        else:
+            self.period = 1
+            self.channels = {'Y': [(0, 0)]}
+        self.tables = {}
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def planeShape(self, key):
+        rows, cols = self.image.shape[:2]
+        if isinstance(key, int):
+            return rows, cols
+        return (len(range(key[0], rows, self.period)),
+                len(range(key[1], cols, self.period)))
+
+    def plane(self, key, top, bottom):
+        """Rows [top, bottom) of a CFA plane or color component"""
+        if isinstance(key, int):
+            return self.image[top:bottom, :, key]
+        dy, dx = key
+        return self.image[dy + top * self.period:dy +
+                          bottom * self.period:self.period, dx::self.period]
+
+    def allocate(self, shape):
+        nbytes = math.prod(shape) * self.dtype.itemsize
+        if self.allocated + nbytes <= self.max_memory_bytes:
+            self.allocated += nbytes
+            return np.zeros(shape, dtype=self.dtype)
+        # 100 MP 的图像两张表约 1.6 GB，放在临时文件中按需换入
+        return np.memmap(tempfile.TemporaryFile(), self.dtype, 'w+',
+                         shape=shape)
+
+    def build(self):
+        tables = {}
+        self.allocated = 0
+        for keys in self.channels.values():
+            for key in keys:
+                height, width = self.planeShape(key)
+                sums_pair = [
+                    self.allocate((height + 1, width + 1)) for _ in range(2)
+                ]
+                for table in sums_pair:
+                    table[0] = 0
+                    table[:, 0] = 0
+                for top in range(0, height, self.chunk_rows):
+                    if self.cancelled:
+                        return self
+                    bottom = min(top + self.chunk_rows, height)
+                    values = np.asarray(self.plane(key, top, bottom),
+                                        dtype=self.dtype)
+                    for table, chunk in zip(sums_pair,
+                                            (values, values * values)):
+                        sums = np.cumsum(chunk, axis=1)
+                        np.cumsum(sums, axis=0, out=sums)
+                        sums += table[top, 1:]
+                        table[top + 1:bottom + 1, 1:] = sums
+                tables[key] = sums_pair
+        # 全部建好后再替换，GUI 线程不会读到一半的表
+        self.tables = tables
+        return self
+
+    def value(self, entry):
+        # Python 整数精确，也不会像 uint64 标量一样溢出告警
+        return int(entry) if self.integer else float(entry)
+
+    def planeRange(self, start, stop, offset, size):
+        """Rows (or columns) of a CFA plane inside [start, stop)"""
+        first = min(max(0, -(-(start - offset) // self.period)), size)
+        last = min(max(first, -(-(stop - offset) // self.period)), size)
+        return first, last
+
+    def stats(self, rect):
+        """{channel: (count, mean, std)} over `rect` (top, left, bottom,
+        right), None for channels without pixels in it. Read from the
+        pixels until `build` is done."""
+        if not self.tables:
+            return self.pixelStats(rect)
+        top, left, bottom, right = rect
+        result = {}
+        for channel, keys in self.channels.items():
+            count = total = squares = 0
+            for key in keys:
+                dy, dx = (0, 0) if isinstance(key, int) else key
+                height, width = self.planeShape(key)
+                y0, y1 = self.planeRange(top, bottom, dy, height)
+                x0, x1 = self.planeRange(left, right, dx, width)
+                sums = self.tables[key]
+                if y1 == y0 or x1 == x0:
+                    continue
+                count += (y1 - y0) * (x1 - x0)
+                corners = [
+                    self.value(table[y1, x1]) - self.value(table[y0, x1]) -
+                    self.value(table[y1, x0]) + self.value(table[y0, x0])
+                    for table in sums
+                ]
+                total += corners[0]
+                squares += corners[1]
+            result[channel] = self.moments(count, total, squares)
+        return result
+
+    def moments(self, count, total, squares):
+        if count == 0:
+            return None
+        variance = (count * squares - total * total) / count**2
+        return count, total / count, math.sqrt(max(variance, 0))
+
+    def pixels(self, rect):
+        """{channel: [values of each plane in `rect`]}"""
+        top, left, bottom, right = rect
+        region = np.asarray(self.image[top:bottom, left:right])
+        return {
+            channel: [
+                region[..., key] if isinstance(key, int) else
+                region[(key[0] - top) % self.period::self.period,
+                       (key[1] - left) % self.period::self.period]
+                for key in keys
+            ]
+            for channel, keys in self.channels.items()
+        }
+
+    def pixelStats(self, rect):
+        result = {}
+        for channel, planes in self.pixels(rect).items():
+            values = [plane.astype(self.dtype) for plane in planes]
+            result[channel] = self.moments(
+                sum(v.size for v in values),
+                sum(self.value(v.sum()) for v in values),
+                sum(self.value((v * v).sum()) for v in values))
+        return result
+
+    def extrema(self, rect):
+        """{channel: (min, max)} read from the pixels of `rect`"""
+        result = {}
+        for channel, planes in self.pixels(rect).items():
+            planes = [plane for plane in planes if plane.size]
+            result[channel] = (min(p.min() for p in planes),
+                               max(p.max() for p in planes)) if planes else None
+        return result
+
+    @staticmethod
+    def histogramExtrema(counts, bins, integer=True):
+        """{channel: (min, max)} from the histogram of the same region"""
+        result = {}
+        for channel, values in counts.items():
+            nonzero = np.flatnonzero(values)
+            if len(nonzero) == 0:
+                result[channel] = None
+            elif integer:
+                result[channel] = (int(nonzero[0]), int(nonzero[-1]))
+            else:
+                result[channel] = (nonzero[0] / (bins - 1),
+                                   nonzero[-1] / (bins - 1))
+        return result
+
+
+# 伪彩色映射的控制点 (位置, RGB)
+COLORMAPS = {
+    'jet': [(0.0, (0, 0, 128)), (0.125, (0, 0, 255)), (0.375, (0, 255, 255)),
+            (0.625, (255, 255, 0)), (0.875, (255, 0, 0)), (1.0, (128, 0, 0))],
+    'heat': [(0.0, (0, 0, 0)), (0.4, (230, 0, 0)), (0.8, (255, 230, 0)),
+             (1.0, (255, 255, 255))],
+}
+
+
+class ToneMapping:
+    """Black point, white point, gamma and false color of the display.
+
+    `black` and `white` are fractions of the full scale. Tiles are mapped
+    through a lookup table with one 8 bit gray or RGB entry per native
+    value, 2**precision entries built once per setting, so changing the
+    levels only maps the tiles on screen again instead of converting the
+    whole image.
+    """
+
+    def __init__(self, black=0.0, white=1.0, gamma=1.0, colormap=None):
+        self.black = black
+        self.white = white
+        self.gamma = gamma
+        self.colormap = colormap
+        self.luts = {}
+
+    def isIdentity(self):
+        return (self.black == 0.0 and self.white == 1.0 and self.gamma == 1.0
+                and self.colormap is None)
+
+    def lut(self, precision):
+        if precision not in self.luts:
+            size = 2**precision
+            x = np.arange(size, dtype=np.float32) / (size - 1)
+            x = np.clip((x - self.black) / max(self.white - self.black, 1e-6),
+                        0.0, 1.0)
+            if self.gamma != 1.0:
+                x **= 1.0 / self.gamma
+            if self.colormap is None:
+                lut = x * 255
+            else:
+                positions = [p for p, _ in COLORMAPS[self.colormap]]
+                lut = np.stack([
+                    np.interp(x, positions,
+                              [c[i] for _, c in COLORMAPS[self.colormap]])
+                    for i in range(3)
+                ],
+                               axis=1)
+            self.luts[precision] = np.round(lut).astype(np.uint8)
+        return self.luts[precision]
+
+    def apply(self, tile, metadata):
+        """8 bit gray or RGB array of an integer `tile`"""
+        if tile.dtype.itemsize == 1:
+            precision = 8
+        else:
+            precision = min(metadata.fileInfo.pixelPrecision or 16, 16)
+        if tile.ndim == 3:
+            tile = tile[..., :3]
+            if self.colormap is not None:
+                # 彩色图像按亮度做伪彩色
+                rgb = tile.astype(np.uint32)
+                tile = (2 * rgb[..., 0] + 5 * rgb[..., 1] + rgb[..., 2]) >> 3
+        # 超出位深的值取最后一项
+        return np.take(self.lut(precision), tile, axis=0, mode='clip')
+
+
+class ClippingOverlay:
+    """Saturation, black crush and zebra masks of the image tiles, drawn
+    as transparent layers over the view.
+
+    A layer is a TiledImageItem over the pyramid of the image converted by
+    `render`, so the masks are computed only for the tiles on screen and
+    cached per level like the image. Coarse levels average 2x2 cells: when
+    zoomed out, a mask pixel marks a cell whose mean is clipped. Zebra
+    stripes cover the values above `zebra` of the black to white range.
+    """
+
+    layers = ('saturated', 'crushed', 'zebra')
+    # ARGB32 颜色，按 alpha 预乘之前的值
+    colors = {
+        'saturated': 0xC0FF0000,
+        'crushed': 0xC00060FF,
+        'zebra': 0xA0FFFFFF
+    }
+    stripe = 8
+
+    def __init__(self, metadata, dtype, zebra=0.95):
+        self.black, self.white = clippingLevels(metadata, dtype)
+        self.zebra = zebra
+        # 转换后的掩码保留到下一个分块，QPixmap.fromImage 之前不能释放
+        self.buffer = None
+
+    def mask(self, layer, tile):
+        if layer == 'crushed':
+            low = tile <= self.black
+            return low.all(axis=2) if tile.ndim == 3 else low
+        threshold = self.white if layer == 'saturated' else (
+            self.black + self.zebra * (self.white - self.black))
+        high = tile >= threshold
+        if tile.ndim == 3:
+            high = high.any(axis=2)
+        if layer == 'zebra':
+            # 分块边长是条纹周期的整数倍，相邻分块的条纹连续
+            rows, cols = np.ogrid[:tile.shape[0], :tile.shape[1]]
+            high &= (rows + cols) // self.stripe % 2 == 0
+        return high
+
+    def render(self, layer, tile):
+        if tile.ndim == 3 and tile.shape[2] > 3:
+            tile = tile[..., :3]
+        self.buffer = np.where(self.mask(layer, tile),
+                               np.uint32(self.colors[layer]), np.uint32(0))
+        height, width = self.buffer.shape
+        return QImage(self.buffer.data, width, height, self.buffer.strides[0],
+                      QImage.Format.Format_ARGB32)
+
+
+class ImagePyramid:
+    """Power-of-two resolution levels of an image, built lazily.
+
+    Level 0 is the given array. Level ``n`` averages every 2x2 cell sampled
+    with a stride of ``2**n``, so a Bayer mosaic is reduced one CFA cell at a
+    time and no level is computed before a tile needs it. For a RawFile
+    only the tiles are computed, never whole levels. `scale` is the
+    size of one level 0 pixel in full resolution pixels, for arrays that are
+    already downsampled such as a binned color preview.
+
+    Level ``n`` is also level ``m < n`` sampled with a stride of
+    ``2**(n - m)``, so once a level is stored the coarser ones are views of
+    it. Images read on demand (RawFile, spilled np.memmap) keep only a
+    `buildProxy` level in memory, finer tiles are reduced from the file.
+    """
+
+    tile_size = 512
+    chunk_rows = 256
+
+    def __init__(self, image, scale=1):
+        self.image = image
+        self.scale = scale
+        self.lazy = isinstance(
+            image, (RawFile, DifferenceImage, PlaneView, PlaneMosaic, np.memmap))
+        self.rows, self.cols = image.shape[:2]
+        self.height, self.width = self.rows * scale, self.cols * scale
+        self.levels = {0: image}
+        # 最粗一级正好放进一个分块
+        self.num_levels = 1
+        while (max(self.rows, self.cols) >>
+               (self.num_levels - 1)) > self.tile_size and min(
+                   self.rows, self.cols) >> self.num_levels > 0:
+            self.num_levels += 1
+
+    def storedBelow(self, n):
+        """Finest stored level the level `n` is a view of, or None"""
+        stored = [m for m in self.levels if 0 < m < n]
+        return max(stored) if stored else None
+
+    def level(self, n):
+        if n not in self.levels:
+            m = self.storedBelow(n)
+            if m is None:
+                self.levels[n] = self.reduce(n)
+            else:
+                step = 2**(n - m)
+                self.levels[n] = self.levels[m][::step, ::step][:self.rows >>
+                                                                n, :self.cols
+                                                                >> n]
+        return self.levels[n]
+
+    def levelBytes(self, n):
+        return ((self.rows >> n) * (self.cols >> n) *
+                math.prod(self.image.shape[2:]) * self.image.dtype.itemsize)
+
+    def buildProxy(self, max_bytes):
+        """Store the finest level of at most `max_bytes`, the coarser levels
+        become views of it. Returns the level, None if no level fits."""
+        for n in range(1, self.num_levels):
+            if self.levelBytes(n) <= max_bytes:
+                if n not in self.levels or not self.levels[n].flags.owndata:
+                    self.levels[n] = self.reduce(n)
+                return n
+        return None
+
+    def nbytes(self):
+        """Bytes of the levels held in memory, views and mappings excluded"""
+        return sum(
+            level.nbytes for n, level in self.levels.items()
+            if n > 0 and level.flags.owndata and not isinstance(
+                level, np.memmap))
+
+    def levelForScale(self, scale):
+        """Coarsest level that still has at least `scale` pixels per pixel"""
+        scale *= self.scale
+        if scale >= 1.0:
+            return 0
+        n = int(math.floor(math.log2(1.0 / scale)))
+        return min(n, self.num_levels - 1)
+
+    def span(self, n):
+        """Size of a level `n` tile in full resolution pixels"""
+        return self.tile_size * 2**n * self.scale
+
+    def reduce(self, n, top=0, left=0, height=None, width=None):
+        """Level `n`, or the region of it starting at (`top`, `left`)"""
+        step = 2**n
+        height = min(self.rows // step - top, height or self.rows)
+        width = min(self.cols // step - left, width or self.cols)
+        src = self.image
+        acc_type = np.uint32 if np.issubdtype(src.dtype,
+                                              np.integer) else np.float64
+        out = np.empty((height, width) + src.shape[2:], dtype=src.dtype)
+        y0, x0 = top * step, left * step
+        cols = slice(x0, x0 + width * step, step)
+        cols_next = slice(x0 + 1, x0 + width * step + 1, step)
+        # 按行分块处理，限制临时内存
+        for first in range(0, height, self.chunk_rows):
+            last = min(first + self.chunk_rows, height)
+            rows = slice(y0 + first * step, y0 + last * step, step)
+            rows_next = slice(y0 + first * step + 1, y0 + last * step + 1,
+                              step)
+            acc = src[rows, cols].astype(acc_type)
+            acc += src[rows_next, cols]
+            acc += src[rows, cols_next]
+            acc += src[rows_next, cols_next]
+            if acc_type is np.uint32:
+                acc >>= 2
+            else:
+                acc /= 4
+            out[first:last] = acc
+        return out
+
+    def tilesInRect(self, n, rect):
+        """Tile indices of level `n` covering `rect` in full resolution"""
+        span = self.span(n)
+        rect = rect.intersected(QRectF(0, 0, self.width, self.height))
+        if rect.isEmpty():
+            return []
+        return [(tx, ty)
+                for ty in range(int(rect.top() // span),
+                                int(math.ceil(rect.bottom() / span)))
+                for tx in range(int(rect.left() // span),
+                                int(math.ceil(rect.right() / span)))]
+
+    def tile(self, n, tx, ty):
+        size = self.tile_size
+        if n > 0 and n not in self.levels and self.lazy and self.storedBelow(
+                n) is None:
+            # 映射的文件和差值图不保存整层，只计算这个分块需要的行列
+            return self.reduce(n, ty * size, tx * size, size, size)
+        return self.level(n)[ty * size:(ty + 1) * size,
+                             tx * size:(tx + 1) * size]
+
+
+def pixmapBytes(pixmap):
+    return pixmap.width() * pixmap.height() * pixmap.depth() // 8
+
+
+class TiledImageItem(QGraphicsItem):
+    """Scene item drawing an ImagePyramid as lazily converted tiles.
+
+    The item works in full resolution pixel coordinates. Only the tiles that
+    intersect the exposed area at the current level of detail are converted
+    to QPixmap, and converted tiles are kept in a byte bounded LRU cache.
+
+    A `progressive` pyramid is refined from coarse to fine: each paint
+    converts tiles for at most `refine_budget` seconds, starting with the
+    coarsest level and every other level down to the one on screen, and
+    draws the tiles of the previous pyramid underneath until the new one
+    covers the view.
+    """
+
+    refine_budget = 0.03
+
+    def __init__(self,
+                 pyramid,
+                 convert,
+                 max_cache_bytes=256 * 1024 * 1024,
+                 preloaded=None,
+                 tiles=None,
+                 progressive=False):
+        super().__init__()
+        self.pyramid = pyramid
+        self.convert = convert
+        self.max_cache_bytes = max_cache_bytes
+        # 可以传入已有的分块缓存，例如浏览目录时缓存中的图像
+        self.tiles = tiles if tiles is not None else collections.OrderedDict()
+        self.cache_bytes = sum(pixmapBytes(p) for p in self.tiles.values())
+        # 后台线程已经转换好的 QImage 分块
+        self.preloaded = dict(preloaded or {})
+        self.failed = False
+        self.refining = progressive
+        # 逐步细化时垫在下面的上一个金字塔和它的分块
+        self.backdrop = None
+        # 当前金字塔是否已经画出像素
+        self.drawn = False
+        self.setFlag(
+            QGraphicsItem.GraphicsItemFlag.ItemUsesExtendedStyleOption)
+
+    def boundingRect(self):
+        return QRectF(0, 0, self.pyramid.width, self.pyramid.height)
+
+    def setPyramid(self,
+                   pyramid,
+                   convert,
+                   preloaded=None,
+                   tiles=None,
+                   progressive=False):
+        """Show another pyramid in place, keeping the view transform. A
+        `progressive` one replaces the current tiles as it is refined."""
+        self.prepareGeometryChange()
+        if progressive and self.tiles:
+            self.backdrop = (self.pyramid, self.tiles)
+        elif not progressive:
+            self.backdrop = None
+        self.refining = progressive
+        self.pyramid = pyramid
+        self.convert = convert
+        self.tiles = tiles if tiles is not None else collections.OrderedDict()
+        self.preloaded = dict(preloaded or {})
+        self.cache_bytes = sum(pixmapBytes(p) for p in self.tiles.values())
+        self.failed = False
+        self.drawn = False
+        self.update()
+
+    def tilePixmap(self, n, tx, ty):
+        key = (n, tx, ty)
+        if key in self.tiles:
+            profiler.hit('tiles', True)
+            self.tiles.move_to_end(key)
+            return self.tiles[key]
+        profiler.hit('tiles', key in self.preloaded)
+        if key in self.preloaded:
+            qimage = self.preloaded.pop(key)
+        elif self.failed:
+            return None
+        else:
+            with profiler.span('convert tile', level=n):
+                # 8 位等格式的 QImage 直接引用 tile 的内存，转成 QPixmap 前不能释放
+                tile = self.pyramid.tile(n, tx, ty)
+                qimage = self.convert(tile)
+        if qimage is None:
+            self.failed = True
+            return None
+        with profiler.span('QPixmap.fromImage', level=n):
+            pixmap = QPixmap.fromImage(qimage)
+        self.tiles[key] = pixmap
+        self.cache_bytes += pixmapBytes(pixmap)
+        while self.cache_bytes > self.max_cache_bytes and len(self.tiles) > 1:
+            _, old = self.tiles.popitem(last=False)
+            self.cache_bytes -= pixmapBytes(old)
+        return pixmap
+
+    def paint(self, painter, option, widget=None):
+        lod = option.levelOfDetailFromTransform(painter.worldTransform())
+        n = self.pyramid.levelForScale(lod)
+        rect = option.exposedRect
+        if self.refining and not all(
+            (n, tx, ty) in self.tiles or (n, tx, ty) in self.preloaded
+                for tx, ty in self.pyramid.tilesInRect(n, rect)):
+            self.refine(painter, n, rect)
+        else:
+            self.refining = False
+            self.backdrop = None
+            self.drawLevel(painter, n, rect)
+
+    def refine(self, painter, n, rect):
+        """Draw what is ready from coarse to fine, convert more tiles within
+        the time budget and schedule the next paint"""
+        if self.backdrop is not None:
+            self.drawBackdrop(painter, rect)
+        top = self.pyramid.num_levels - 1
+        deadline = time.perf_counter() + self.refine_budget
+        complete = True
+        for m in list(range(top, n, -2)) + [n]:
+            complete = self.drawLevel(painter, m, rect, deadline)
+        if complete:
+            self.refining = False
+            self.backdrop = None
+        else:
+            QTimer.singleShot(0, self.update)
+
+    def drawBackdrop(self, painter, rect):
+        """Cached tiles of the previous pyramid, coarse first, stretched
+        over the current one when the sizes differ"""
+        pyramid, tiles = self.backdrop
+        sx = self.pyramid.width / pyramid.width
+        sy = self.pyramid.height / pyramid.height
+        painter.save()
+        painter.scale(sx, sy)
+        shown = QRectF(rect.x() / sx, rect.y() / sy, rect.width() / sx,
+                       rect.height() / sy)
+        for (n, tx, ty), pixmap in sorted(tiles.items(),
+                                          key=lambda item: -item[0][0]):
+            step = 2**n * pyramid.scale
+            span = pyramid.span(n)
+            target = QRectF(tx * span, ty * span, pixmap.width() * step,
+                            pixmap.height() * step)
+            if target.intersects(shown):
+                painter.drawPixmap(target, pixmap, QRectF(pixmap.rect()))
+        painter.restore()
+
+    def drawLevel(self, painter, n, rect, deadline=None):
+        """Draw the level `n` tiles of `rect`. After the `deadline` only the
+        tiles already converted are drawn, returns whether all were."""
+        step = 2**n * self.pyramid.scale
+        span = self.pyramid.span(n)
+        complete = True
+        for tx, ty in self.pyramid.tilesInRect(n, rect):
+            key = (n, tx, ty)
+            if deadline is not None and key not in self.tiles \
+                    and key not in self.preloaded \
+                    and time.perf_counter() > deadline:
+                complete = False
+                continue
+            pixmap = self.tilePixmap(n, tx, ty)
+            if pixmap is None or pixmap.isNull():
+                continue
+            target = QRectF(tx * span, ty * span, pixmap.width() * step,
+                            pixmap.height() * step)
+            painter.drawPixmap(target, pixmap, QRectF(pixmap.rect()))
+            self.drawn = True
+        return complete
+
+
+def arrayBytes(image):
+    """Bytes of an image held in memory, 0 when it is read on demand from
+    a file mapping"""
+    if image is None or isinstance(image, (RawFile, np.memmap)):
+        return 0
+    return image.nbytes
+
+
+class CachedImage:
+    """A decoded image with its pyramid and converted display tiles"""
+
+    def __init__(self, image, metadata, pyramid=None):
+        self.image = image
+        self.metadata = metadata
+        self.pyramid = pyramid if pyramid is not None else ImagePyramid(image)
+        self.tiles = collections.OrderedDict()
+
+    def nbytes(self):
+        pixmaps = sum(pixmapBytes(p) for p in self.tiles.values())
+        return arrayBytes(self.image) + self.pyramid.nbytes() + pixmaps
+
+
+class ImageCache:
+    """LRU of CachedImage entries bounded by a memory budget in bytes"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry, keep=None):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        self.evict(keep)
+
+    def discard(self, key):
+        self.entries.pop(key, None)
+
+    def nbytes(self):
+        return sum(entry.nbytes() for entry in self.entries.values())
+
+    def evict(self, keep=None):
+        """Drop least recently used entries, never the one shown (`keep`)"""
+        for key in list(self.entries):
+            if self.nbytes() <= self.max_bytes:
+                break
+            if key != keep:
+                del self.entries[key]
+
+
+PREVIEW_CACHE_VERSION = 1
+
+
+def decoderVersion():
+    import importlib.metadata
+    try:
+        return importlib.metadata.version('cxx-image-io')
+    except importlib.metadata.PackageNotFoundError:
+        return 'unknown'
+
+
+def defaultCacheDir():
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA',
+                              pathlib.Path.home() / 'AppData' / 'Local')
+    elif sys.platform == 'darwin':
+        base = pathlib.Path.home() / 'Library' / 'Caches'
+    else:
+        base = os.environ.get('XDG_CACHE_HOME', pathlib.Path.home() / '.cache')
+    return pathlib.Path(base) / 'display-image'
+
+
+class CachedPreview:
+    """Pyramid levels, histogram and metadata of an image read back from
+    the PreviewCache, the arrays memory mapped"""
+
+    def __init__(self, info, levels, histogram):
+        self.info = info
+        self.metadata = deserializeMetadata(info['metadata'])
+        self.levels = levels
+        self.histogram = histogram
+
+    def pyramid(self):
+        """Pyramid over the largest cached level, in full resolution
+        coordinates, with the coarser levels already filled in"""
+        first = min(self.levels)
+        pyramid = ImagePyramid(self.levels[first], 2**first)
+        for n, level in self.levels.items():
+            pyramid.levels[n - first] = level
+        return pyramid
+
+
+class PreviewCache:
+    """On-disk cache of display proxies keyed by file identity.
+
+    An entry is a directory named after a hash of the resolved path, file
+    size, mtime, PREVIEW_CACHE_VERSION and the cxx_image_io version. It
+    holds the pyramid levels of at most `max_proxy_pixels` pixels and the
+    exact histogram as .npy files, and the serialized metadata in
+    index.json. Entries are evicted least recently used first once the
+    directory grows past `max_bytes`.
+    """
+
+    max_proxy_pixels = 2**23
+
+    def __init__(self, root=None, max_bytes=2 * 1024 * 1024 * 1024):
+        self.root = pathlib.Path(root) if root else defaultCacheDir()
+        self.max_bytes = max_bytes
+
+    def key(self, image_path):
+        stat = os.stat(image_path)
+        identity = '|'.join([
+            str(pathlib.Path(image_path).resolve()),
+            str(stat.st_size),
+            str(stat.st_mtime_ns),
+            str(PREVIEW_CACHE_VERSION),
+            decoderVersion()
+        ])
+        return hashlib.sha1(identity.encode()).hexdigest()
+
+    def load(self, image_path):
+        entry = self.root / self.key(image_path)
+        try:
+            with open(entry / 'index.json') as f:
+                info = json.load(f)
+            levels = {
+                n: np.load(entry / 'level{}.npy'.format(n), mmap_mode='r')
+                for n in info['levels']
+            }
+            counts = np.load(entry / 'histogram.npy', mmap_mode='r')
+        except (OSError, ValueError, KeyError):
+            return None
+        # 目录的修改时间记录最近一次使用
+        os.utime(entry)
+        return CachedPreview(info, levels, dict(zip(info['channels'],
+                                                    counts)))
+
+    def store(self, image_path, pyramid, metadata, histogram):
+        levels = [
+            n for n in range(1, pyramid.num_levels)
+            if (pyramid.rows >> n) * (pyramid.cols >> n) <=
+            self.max_proxy_pixels
+        ]
+        if not levels:
+            return
+        self.root.mkdir(parents=True, exist_ok=True)
+        entry = self.root / self.key(image_path)
+        # 先写到临时目录再改名，中断或并发写入都不会留下半个条目
+        staging = pathlib.Path(tempfile.mkdtemp(dir=self.root, prefix='.'))
+        try:
+            for n in levels:
+                np.save(staging / 'level{}.npy'.format(n), pyramid.level(n))
+            np.save(staging / 'histogram.npy',
+                    np.stack(list(histogram.values())))
+            with open(staging / 'index.json', 'w') as f:
+                json.dump(
+                    {
+                        'path': str(pathlib.Path(image_path).resolve()),
+                        'levels': levels,
+                        'channels': list(histogram),
+                        'metadata': serializeMetadata(metadata)
+                    }, f)
+            os.replace(staging, entry)
+        except OSError:
+            shutil.rmtree(staging, ignore_errors=True)
+            return
+        self.evict(keep=entry)
+
+    def entries(self):
+        """(directory, bytes, last use, source path), most recent first"""
+        if not self.root.is_dir():
+            return []
+        result = []
+        for entry in self.root.iterdir():
+            if not entry.is_dir() or entry.name.startswith('.'):
+                continue
+            try:
+                with open(entry / 'index.json') as f:
+                    path = json.load(f).get('path')
+                size = sum(f.stat().st_size for f in entry.iterdir())
+                result.append((entry, size, entry.stat().st_mtime, path))
+            except (OSError, ValueError):
+                continue
+        return sorted(result, key=lambda e: e[2], reverse=True)
+
+    def evict(self, keep=None):
+        entries = self.entries()
+        total = sum(size for _, size, _, _ in entries)
+        for entry, size, _, _ in reversed(entries):
+            if total <= self.max_bytes:
+                break
+            if entry != keep:
+                shutil.rmtree(entry, ignore_errors=True)
+                total -= size
+
+    def clear(self):
+        if self.root.is_dir():
+            for entry in self.root.iterdir():
+                if entry.is_dir():
+                    shutil.rmtree(entry, ignore_errors=True)
+
+
+JPEG_SOI = b'\xff\xd8\xff'
+JPEG_EOI = b'\xff\xd9'
+# 帧头 SOF0-SOF15，不含 DHT (C4)、JPG (C8) 和 DAC (CC)
+JPEG_SOF = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def jpegFrame(data, start):
+    """(width, height, offset of the frame header) of the JPEG stream
+    starting at `start`, None if the markers do not parse"""
+    pos = start + 2
+    try:
+        while True:
+            if data[pos] != 0xFF:
+                return None
+            marker = data[pos + 1]
+            if marker == 0xFF:
+                # 填充字节
+                pos += 1
+                continue
+            if marker in JPEG_SOF:
+                height, width = struct.unpack('>HH', data[pos + 5:pos + 9])
+                return (width, height, pos) if width and height else None
+            if marker in (0xD9, 0xDA):
+                return None
+            pos += 2 + struct.unpack('>H', data[pos + 2:pos + 4])[0]
+    except (IndexError, struct.error):
+        return None
+
+
+TIFF_BYTE_ORDER = {b'II*\x00': '<', b'MM\x00*': '>'}
+# IFD 项的类型 BYTE、SHORT 和 LONG
+TIFF_TYPES = {1: 'B', 3: 'H', 4: 'I'}
+
+
+def tiffDirectory(data, max_ifds=64):
+    """Tags of the largest full resolution image of a TIFF or DNG, following
+    the IFD chain and the SubIFDs, as tuples of values. None if the IFDs do
+    not parse or hold no such image"""
+    order = TIFF_BYTE_ORDER.get(bytes(data[:4]))
+    if order is None:
+        return None
+    best = None
+    try:
+        pending = [struct.unpack(order + 'I', data[4:8])[0]]
+        seen = set()
+        while pending and len(seen) < max_ifds:
+            offset = pending.pop()
+            if not offset or offset in seen:
+                continue
+            seen.add(offset)
+            count = struct.unpack(order + 'H', data[offset:offset + 2])[0]
+            tags = {}
+            for entry in range(offset + 2, offset + 2 + 12 * count, 12):
+                tag, kind, n = struct.unpack(order + 'HHI',
+                                             data[entry:entry + 8])
+                if kind not in TIFF_TYPES:
+                    continue
+                fmt = order + TIFF_TYPES[kind] * min(n, max_ifds)
+                pos = entry + 8
+                if struct.calcsize(fmt) > 4:
+                    pos = struct.unpack(order + 'I', data[pos:pos + 4])[0]
+                values = struct.unpack(fmt, data[pos:pos + struct.calcsize(fmt)])
+                if tag == 0x014A:
+                    # SubIFDs，DNG 的 raw 图像通常在这里
+                    pending.extend(values)
+                elif values:
+                    tags[tag] = values
+            next_ifd = offset + 2 + 12 * count
+            pending.append(
+                struct.unpack(order + 'I', data[next_ifd:next_ifd + 4])[0])
+            # NewSubfileType 为 0 的是全分辨率图像，其余是缩略图
+            width, height = tags.get(0x0100, (0,))[0], tags.get(0x0101, (0,))[0]
+            if tags.get(0x00FE, (0,))[0] == 0 and width and height and (
+                    best is None
+                    or width * height > best[0x0100][0] * best[0x0101][0]):
+                best = tags
+    except struct.error:
+        return None
+    return best
+
+
+def tiffFrame(data, max_ifds=64):
+    """(width, height) of the largest full resolution image of a TIFF or DNG,
+    None if the IFDs do not parse"""
+    tags = tiffDirectory(data, max_ifds)
+    if tags is None:
+        return None
+    return tags[0x0100][0], tags[0x0101][0]
+
+
+def libRawSize(image_path):
+    """(width, height) that read_image reports for a camera raw, read by
+    LibRaw without unpacking the pixels, None when LibRaw cannot open it"""
+    processor = LibRaw()
+    if processor.open_file(str(image_path)) != LibRaw_errors.LIBRAW_SUCCESS:
+        return None
+    sizes = processor.imgdata.sizes
+    if not sizes.raw_width or not sizes.raw_height:
+        return None
+    return sizes.raw_width, sizes.raw_height
+
+
+def embeddedPreview(image_path,
+                    max_pixels=2**23,
+                    scan_bytes=64 * 1024 * 1024,
+                    max_candidates=16):
+    """Largest JPEG embedded in the first `scan_bytes` of the file, such as
+    the preview of a camera raw or DNG or the EXIF thumbnail of a JPEG, as
+    an RGB uint8 array. Also returns the (width, height) of the file when
+    its JPEG, TIFF or DNG header gives it. (None, None) when there is no
+    usable preview."""
+    with open(image_path, 'rb') as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # 空文件
+            return None, None
+    with data:
+        size = None
+        if data[:3] == JPEG_SOI:
+            frame = jpegFrame(data, 0)
+            if frame is not None:
+                size = frame[:2]
+        else:
+            size = tiffFrame(data)
+        limit = min(len(data), scan_bytes)
+        best = None
+        pos = data.find(JPEG_SOI, 1, limit)
+        for _ in range(max_candidates):
+            if pos < 0:
+                break
+            frame = jpegFrame(data, pos)
+            if frame is not None:
+                pixels = frame[0] * frame[1]
+                if pixels <= max_pixels and (best is None or
+                                             pixels > best[0]):
+                    best = (pixels, pos, frame[2])
+            pos = data.find(JPEG_SOI, pos + 3, limit)
+        if best is None:
+            return None, size
+        # 熵编码数据中的 0xFF 后面总是跟 0x00，第一个 EOI 就是结尾
+        end = data.find(JPEG_EOI, best[2])
+        if end < 0:
+            return None, size
+        qimage = QImage.fromData(data[best[1]:end + 2], 'JPG')
+    if qimage.isNull():
+        return None, size
+    qimage = qimage.convertToFormat(QImage.Format.Format_RGB888)
+    width, height = qimage.width(), qimage.height()
+    bits = qimage.constBits()
+    bits.setsize(qimage.sizeInBytes())
+    rows = np.frombuffer(bits, np.uint8).reshape(height,
+                                                  qimage.bytesPerLine())
+    return rows[:, :width * 3].reshape(height, width, 3).copy(), size
+
+
+class ImageLoader(QThread):
+    """Decode an image and prepare its first tiles off the GUI thread.
+
+    Results are emitted stage by stage so the window can fill in the
+    metadata before the pixels are ready. PLAIN and MIPI RAW files with a
+    sidecar are memory mapped as a RawFile, anything else is decoded in the
+    shared decodePool; a decode already submitted by the prefetcher can be
+    passed as `future`. Cancelling drops a decode that has not started yet and
+    ignores the result of one that has.
+
+    With a `preview_cache`, a cached preview is emitted before decoding
+    starts so it can be painted at once, and a missing entry is written
+    once the image is decoded. Otherwise the JPEG preview embedded in the
+    file, if any, is emitted while the decode runs. Every result carries
+    the image path, so that a receiver that moved on to another image can
+    drop results still queued from this loader.
+    """
+
+    progress = pyqtSignal(int, str)
+    cached = pyqtSignal(object, object)
+    embedded = pyqtSignal(object, object)
+    decoded = pyqtSignal(object, object, object)
+    converted = pyqtSignal(object, object, object)
+    failed = pyqtSignal(str)
+
+    def __init__(self,
+                 image_path,
+                 metadata_path=None,
+                 viewport=None,
+                 parent=None,
+                 future=None,
+                 preview_cache=None,
+                 memory_budget=None):
+        super().__init__(parent)
+        self.image_path = image_path
+        self.metadata_path = metadata_path
+        self.viewport = viewport
+        self.future = future
+        self.preview_cache = preview_cache
+        self.memory_budget = memory_budget
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def decode(self, preview=None):
+        with profiler.span('openRawFile'):
+            raw = openRawFile(self.image_path, self.metadata_path)
+        if raw is not None:
+            return raw, raw.metadata
+        prefetched = self.future is not None
+        if not prefetched:
+            self.future = submitDecode(self.image_path, self.metadata_path,
+                                       self.memory_budget)
+        if preview is None:
+            self.showEmbedded()
+        with profiler.span('read_image', prefetched=prefetched):
+            return self.waitForDecode()
+
+    def showEmbedded(self):
+        """Emit a pyramid over the embedded JPEG preview, in full resolution
+        coordinates when the size of the image is known from its header"""
+        with profiler.span('embeddedPreview'):
+            try:
+                thumbnail, size = embeddedPreview(self.image_path)
+            except OSError:
+                return
+        if thumbnail is None or self.cancelled or self.future.done():
+            return
+        if self.image_path.suffix.lower(
+        ) in LibRawImageReader.SUPPORTED_RAW_EXT:
+            # read_image 返回带边缘的 raw，尺寸以 LibRaw 为准而不是 TIFF 头
+            with profiler.span('libRawSize'):
+                size = libRawSize(self.image_path)
+        # 尺寸未知时按预览本身的大小显示，解码后 setImage 按相对位置换算视图
+        scale = size[0] / thumbnail.shape[1] if size is not None else 1
+        self.embedded.emit(self.image_path, ImagePyramid(thumbnail, scale))
+
+    def waitForDecode(self):
+        retried = False
+        while True:
+            try:
+                self.future.result(timeout=0.1)
+                return decodedResult(self.future)
+            except concurrent.futures.TimeoutError:
+                if self.cancelled:
+                    self.future.cancel()
+                    return None, None
+            except concurrent.futures.process.BrokenProcessPool:
+                if retried:
+                    raise
+                # 其他文件让解码进程崩溃时，排队的任务一起失败，重新提交一次
+                retried = True
+                self.future = submitDecode(self.image_path,
+                                           self.metadata_path,
+                                           self.memory_budget)
+
+    def run(self):
+        try:
+            preview = None
+            if self.preview_cache is not None:
+                with profiler.span('PreviewCache.load'):
+                    preview = self.preview_cache.load(self.image_path)
+                profiler.hit('previews', preview is not None)
+                if preview is not None:
+                    self.cached.emit(self.image_path, preview)
+            self.progress.emit(0, "Decoding {}".format(self.image_path.name))
+            image, metadata = self.decode(preview)
+            if self.cancelled:
+                return
+            self.decoded.emit(self.image_path, image, metadata)
+
+            self.progress.emit(60, "Converting")
+            pyramid = ImagePyramid(image)
+            if preview is not None:
+                pyramid.levels.update(preview.levels)
+            converter = ImageConverter()
+            tiles = {}
+            if self.viewport is not None:
+                # 视图初始以 100% 显示原图左上角，预先转换这部分分块
+                rect = QRectF(0, 0, self.viewport.width(),
+                              self.viewport.height())
+                for tx, ty in pyramid.tilesInRect(0, rect):
+                    if self.cancelled:
+                        return
+                    with profiler.span('convert tile', level=0):
+                        tile = pyramid.tile(0, tx, ty)
+                        qimage = converter.convert(tile, metadata)
+                        tiles[(0, tx, ty)] = qimage.copy()
+            if self.cancelled:
+                return
+            self.progress.emit(100, "Done")
+            self.converted.emit(self.image_path, pyramid, tiles)
+            if pyramid.lazy and self.memory_budget is not None:
+                # 原图不在内存中时，缩小的层级常驻内存，缩放时不再读文件
+                with profiler.span('buildProxy'):
+                    pyramid.buildProxy(self.memory_budget // 8)
+            if self.preview_cache is not None and preview is None:
+                with profiler.span('PreviewCache.store'):
+                    self.preview_cache.store(
+                        self.image_path, pyramid, metadata,
+                        HistogramEngine(image, metadata).compute())
+        except (Exception, SystemExit) as e:
+            # read_image 出错时会调用 sys.exit
+            if not self.cancelled:
+                self.failed.emit(str(e) or "Unable to read {}".format(
+                    self.image_path))
+
+
+class BackgroundTask(QThread):
+    """Run a function off the GUI thread and emit its result"""
+
+    done = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+    def __init__(self, function, *args, parent=None):
+        super().__init__(parent)
+        self.function = function
+        self.args = args
+
+    def run(self):
+        try:
+            self.done.emit(self.function(*self.args))
+        except Exception as e:
+            self.failed.emit(str(e))
+
+
+class FrameSequence:
+    """Frames of a burst, one PLAIN or MIPI RAW file per frame, all described
+    by one sidecar: `metadata_path` or the sidecar of the first frame.
+
+    `read` copies frame `i` subsampled by `step` into a preallocated array,
+    reading only the strided rows from the file mapping. By default the
+    step reduces the frames to about `preview_size` pixels, rounded so that
+    the subsampled frame is still a Bayer mosaic of the same order.
+    """
+
+    preview_size = 2048
+
+    def __init__(self, paths, metadata_path=None, step=None):
+        self.paths = list(paths)
+        first = openRawFile(self.paths[0], metadata_path)
+        if first is None:
+            raise ValueError(
+                "Playback needs PLAIN or MIPI RAW frames with a sidecar: "
+                "{}".format(self.paths[0]))
+        self.metadata = first.metadata
+        self.fileFormat = first.fileFormat
+        self.dtype = first.dtype
+        height, width = first.shape
+        pixelType = self.metadata.fileInfo.pixelType
+        period = 4 if pixelType in QUADBAYER_TYPES else (
+            2 if pixelType in BAYER_TYPES else 1)
+        if not step:
+            step = -(-max(height, width) // self.preview_size)
+        self.step = step + (1 - step) % period
+        self.size = (height, width)
+        self.shape = (len(range(0, height, self.step)),
+                      len(range(0, width, self.step)))
+
+    def __len__(self):
+        return len(self.paths)
+
+    def open(self, i):
+        return RawFile(self.paths[i], self.metadata, self.fileFormat)
+
+    def read(self, i, out):
+        frame = self.open(i)
+        if frame.shape != self.size:
+            raise ValueError("{} is not a {}x{} frame".format(
+                frame.path, self.size[1], self.size[0]))
+        if self.fileFormat == FileFormat.PLAIN:
+            # 直接从文件映射拷贝到缓冲区，不经过临时数组
+            np.copyto(out, frame.pixels[::self.step, ::self.step])
+        else:
+            np.copyto(out, frame[::self.step, ::self.step])
+
+
+class FrameRing:
+    """Bounded ring of preallocated frame buffers between the decoders and
+    the display.
+
+    A decoder `acquire`s a free slot with the index of the next frame to
+    read, fills it and `publish`es it. The display `take`s the newest frame
+    due at the current time: older ready frames are released without being
+    shown, and when the decoders are behind the next frame to read jumps to
+    the due one, so frames are dropped instead of lagging. `seek` discards
+    everything decoded and restarts from another frame. No buffer is
+    allocated after construction.
+    """
+
+    def __init__(self, slots, shape, dtype):
+        self.buffers = [np.empty(shape, dtype=dtype) for _ in range(slots)]
+        self.free = collections.deque(range(slots))
+        self.ready = {}
+        self.next_index = 0
+        # seek 之后丢弃之前开始解码的帧
+        self.generation = 0
+        self.decoded = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """(slot, index, generation) to decode, None once closed"""
+        with self.condition:
+            while not self.free and not self.closed:
+                self.condition.wait()
+            if self.closed:
+                return None
+            index = self.next_index
+            self.next_index += 1
+            return self.free.popleft(), index, self.generation
+
+    def publish(self, slot, index, generation):
+        with self.condition:
+            self.decoded += 1
+            if generation == self.generation and index not in self.ready:
+                self.ready[index] = slot
+            else:
+                self.free.append(slot)
+            self.condition.notify_all()
+
+    def release(self, slot):
+        with self.condition:
+            self.free.append(slot)
+            self.condition.notify_all()
+
+    def take(self, due):
+        """(index, slot) of the newest frame not after `due`, or None"""
+        with self.condition:
+            self.next_index = max(self.next_index, due)
+            late = [index for index in self.ready if index <= due]
+            if not late:
+                return None
+            index = max(late)
+            for old in late:
+                if old != index:
+                    self.free.append(self.ready.pop(old))
+            slot = self.ready.pop(index)
+            self.condition.notify_all()
+            return index, slot
+
+    def seek(self, index):
+        with self.condition:
+            self.generation += 1
+            self.free.extend(self.ready.values())
+            self.ready.clear()
+            self.next_index = index
+            self.condition.notify_all()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class SequenceDecoder(QThread):
+    """Fill the slots of a FrameRing with frames of a FrameSequence, frame
+    indices wrap around so the sequence plays in a loop"""
+
+    failed = pyqtSignal(str)
+
+    def __init__(self, sequence, ring, parent=None):
+        super().__init__(parent)
+        self.sequence = sequence
+        self.ring = ring
+
+    def run(self):
+        while True:
+            job = self.ring.acquire()
+            if job is None:
+                return
+            slot, index, generation = job
+            try:
+                with profiler.span('read frame', index=index):
+                    self.sequence.read(index % len(self.sequence),
+                                       self.ring.buffers[slot])
+            except Exception as e:
+                self.ring.release(slot)
+                self.failed.emit(str(e))
+                return
+            self.ring.publish(slot, index, generation)
 
 
 class ImageViewer(QGraphicsView):
+    # Shift+拖动选择的区域 (top, left, bottom, right)，Shift+单击清除为 None
+    roiSelected = pyqtSignal(object)
+    # 鼠标悬停或单击的像素 (x, y)
+    pixelHovered = pyqtSignal(int, int)
+    # 缩放或平移之后发出，用于同步对比视图
+    viewChanged = pyqtSignal()
+    # 新图像或预览的像素第一次画出后发出
+    pixelsShown = pyqtSignal()
 
-    def __init__(self, image, metadata, pixelStatus, zoomStatus):
+    def __init__(self,
+                 image,
+                 metadata,
+                 pixelStatus,
+                 zoomStatus,
+                 pyramid=None,
+                 tiles=None,
+                 tile_cache=None):
         super().__init__()
+        with profiler.span('ImageViewer.__init__'):
+            self.initViewer(image, metadata, pixelStatus, zoomStatus, pyramid,
+                            tiles, tile_cache)
+
+    def initViewer(self, image, metadata, pixelStatus, zoomStatus, pyramid,
+                   tiles, tile_cache):
         self.image = image
         self.metadata = metadata
         self.pixelStatus = pixelStatus
         self.zoomStatus = zoomStatus
         self.scale_percentage = 100
-        qimage = self.convertNumpyArrayToQImage(self.image, self.metadata)
-        self.pix_map_image = QPixmap.fromImage(qimage)
+        self.converter = ImageConverter()
+        self.pyramid = pyramid if pyramid is not None else ImagePyramid(
+            self.image)
+        self.display_metadata = self.metadata
+        # 显示通道平面拼图时，读数映射回原图
+        self.mosaic = None
+        # 饱和、欠曝和斑马纹图层，每层一个分块图元
+        self.overlay = None
+        self.overlay_items = {}
+        # 色阶、gamma 和伪彩色，None 表示直接转换
+        self.tone = None
+        self.tone_tile = None
+        # 最近几帧的绘制时间，HUD 显示
+        self.frame_times = collections.deque(maxlen=30)
+        self.hud = False
+        self.pixels_shown = False
+        # 打开图像后各阶段画出的时间，HUD 显示
+        self.load_times = []
+
+        # 创建场景
+        self.scene = QGraphicsScene(self)
+        self.setScene(self.scene)
+
+        # 加载图片，按可见分块转换
+        with profiler.span('TiledImageItem'):
+            self.image_item = self.createImageItem(tiles, tile_cache)
+            self.scene.addItem(self.image_item)
+
+        # 设置抗锯齿和插值模式
+        self.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+        self.setTransformationAnchor(
+            QGraphicsView.ViewportAnchor.AnchorUnderMouse)  # 以鼠标位置为缩放中心
+        self.setResizeAnchor(QGraphicsView.ViewportAnchor.AnchorUnderMouse)
+
+        # 缩放参数
+        self.scale_factor = 1.0  # 当前缩放比例
+        self.max_zoom = 10.0
+        self.min_zoom = 0.1
+
+        self.rubberBand = QRubberBand(QRubberBand.Shape.Rectangle, self)
+        self.roi_origin = None
+
+        # 悬停读数合并到每个刷新周期最多一次
+        self.hover_pos = None
+        self.hover_timer = QTimer(self)
+        self.hover_timer.setSingleShot(True)
+        self.hover_timer.timeout.connect(self.inspectHover)
+        self.horizontalScrollBar().valueChanged.connect(self.viewChanged)
+        self.verticalScrollBar().valueChanged.connect(self.viewChanged)
+
+    def createImageItem(self, tiles, tile_cache):
+        return TiledImageItem(self.pyramid,
+                              self.convertTile,
+                              preloaded=tiles,
+                              tiles=tile_cache)
+
+    def convertNumpyArrayToQImage(self, img, metadata):
+        try:
+            return self.converter.convert(img, metadata)
+        except ValueError as e:
+            QMessageBox.critical(None, "Error", str(e))
+
+    def convertTile(self, tile):
+        if self.tone is not None and np.issubdtype(tile.dtype, np.integer):
+            # 查找表的结果保留到下一个分块，和转换器的缓冲区一样
+            self.tone_tile = self.tone.apply(tile, self.display_metadata)
+            return self.convertNumpyArrayToQImage(
+                self.tone_tile,
+                displayMetadata(
+                    PixelType.RGB if self.tone_tile.ndim == 3 else
+                    PixelType.GRAYSCALE, PixelRepresentation.UINT8, 8))
+        return self.convertNumpyArrayToQImage(tile, self.display_metadata)
+
+    def setTone(self, tone):
+        """Map the display through a ToneMapping, only the tiles on screen
+        are converted again"""
+        if tone is not None and tone.isIdentity():
+            tone = None
+        if tone is self.tone:
+            return
+        self.tone = tone
+        self.image_item.setPyramid(self.image_item.pyramid, self.convertTile)
+
+    def setDisplay(self, pyramid=None, metadata=None):
+        """Show a derived rendering such as a color preview, or the raw
+        image when called without arguments. Pixel readout stays on the raw
+        image and the zoom and pan are kept."""
+        if pyramid is None:
+            pyramid, metadata = self.pyramid, self.metadata
+        self.display_metadata = metadata
+        self.mosaic = pyramid.image if isinstance(pyramid.image,
+                                                  PlaneMosaic) else None
+        self.image_item.setPyramid(pyramid, self.convertTile)
+        self.updateOverlay()
+
+    def setImage(self,
+                 image,
+                 pyramid,
+                 tiles=None,
+                 tile_cache=None,
+                 metadata=None):
+        """Replace a preview by the decoded image, or the image by a new
+        version of the file, keeping the zoom and pan. The new image is
+        refined over the old one from coarse to fine, and an image of
+        another size keeps the same field of view and relative center."""
+        bounds = self.image_item.boundingRect()
+        center = self.mapToScene(self.viewport().rect().center())
+        self.image = image
+        if metadata is not None:
+            self.metadata = metadata
+        self.pyramid = pyramid
+        self.display_metadata = self.metadata
+        self.mosaic = None
+        self.pixels_shown = False
+        if self.tone is not None:
+            # 预先转换和缓存的分块没有经过查找表
+            tiles, tile_cache = None, None
+        self.image_item.setPyramid(pyramid,
+                                   self.convertTile,
+                                   tiles,
+                                   tile_cache,
+                                   progressive=True)
+        self.updateOverlay()
+        if self.image_item.boundingRect().size() != bounds.size():
+            ratio = bounds.width() / pyramid.width
+            self.scene.setSceneRect(self.image_item.boundingRect())
+            self.scale_factor *= ratio
+            self.scale(ratio, ratio)
+            self.centerOn(center.x() / bounds.width() * pyramid.width,
+                          center.y() / bounds.height() * pyramid.height)
+            self.zoomStatus.setText("Zoom factor: {:.1f}%".format(
+                self.scale_factor * 100))
+
+    def setOverlay(self, overlay, layers):
+        """Draw the `layers` of a ClippingOverlay over the image. Hiding
+        and showing a layer keeps its masks, another overlay drops them."""
+        if overlay is not self.overlay:
+            self.overlay = overlay
+            self.updateOverlay()
+        for layer in layers:
+            if layer not in self.overlay_items:
+                item = TiledImageItem(self.overlayPyramid(),
+                                      self.overlayConverter(layer),
+                                      max_cache_bytes=64 * 1024 * 1024)
+                item.setZValue(1)
+                self.scene.addItem(item)
+                self.overlay_items[layer] = item
+        for layer, item in self.overlay_items.items():
+            item.setVisible(layer in layers)
+
+    def updateOverlay(self):
+        # 图像或显示方式改变后，掩码按新的分块重新计算
+        for layer, item in self.overlay_items.items():
+            item.setPyramid(self.overlayPyramid(),
+                            self.overlayConverter(layer))
+
+    def overlayPyramid(self):
+        """Native values under the scene: the plane mosaic when shown, else
+        the image, also under a color preview"""
+        return self.image_item.pyramid if self.mosaic is not None else (
+            self.pyramid)
+
+    def overlayConverter(self, layer):
+        overlay = self.overlay
+        return lambda tile: overlay.render(layer, tile)
+
+    def setHudVisible(self, visible):
+        """Overlay frame time and cache hit rates on the view"""
+        self.hud = visible
+        # 滚动时整幅重绘，否则覆盖层会随内容一起被平移
+        self.setViewportUpdateMode(
+            QGraphicsView.ViewportUpdateMode.FullViewportUpdate if visible else
+            QGraphicsView.ViewportUpdateMode.MinimalViewportUpdate)
+        self.viewport().update()
+
+    def hudText(self):
+        lines = []
+        if self.frame_times:
+            lines.append("Frame {:.1f} ms, mean {:.1f} ms".format(
+                self.frame_times[-1] * 1e3,
+                sum(self.frame_times) / len(self.frame_times) * 1e3))
+        if self.load_times:
+            lines.append(", ".join("{} {:.0f} ms".format(stage.capitalize(), ms)
+                                   for stage, ms in self.load_times))
+        for cache in ('tiles', 'images', 'previews'):
+            hits, lookups = profiler.hitRate(cache)
+            if lookups:
+                lines.append("{} cache {:.0f}% ({}/{})".format(
+                    cache.capitalize(), hits * 100 / lookups, hits, lookups))
+        return "\n".join(lines)
+
+    def paintEvent(self, event):
+        start = time.perf_counter()
+        with profiler.span('ImageViewer.paintEvent'):
+            super().paintEvent(event)
+        self.frame_times.append(time.perf_counter() - start)
+        if not self.pixels_shown and self.image_item.drawn:
+            self.pixels_shown = True
+            self.pixelsShown.emit()
+
+    def drawForeground(self, painter, rect):
+        if not self.hud:
+            return
+        text = self.hudText()
+        if not text:
+            return
+        painter.save()
+        painter.resetTransform()  # 视口坐标
+        bounds = painter.boundingRect(QRectF(0, 0, 400, 200),
+                                      Qt.AlignmentFlag.AlignLeft, text)
+        bounds.translate(8, 8)
+        painter.fillRect(bounds.adjusted(-4, -4, 4, 4), QColor(0, 0, 0, 160))
+        painter.setPen(QColor(255, 255, 255))
+        painter.drawText(bounds, Qt.AlignmentFlag.AlignLeft, text)
+        painter.restore()
+
+    def wheelEvent(self, event):
+        with profiler.span('ImageViewer.wheelEvent'):
+            self.zoom(event)
+        self.viewChanged.emit()
+
+    def zoom(self, event):
+        """鼠标滚轮事件：允许从 `1.0x` 开始缩小"""
+        zoom_in_factor = 1.2
+        zoom_out_factor = 1 / zoom_in_factor
+
+        if event.angleDelta().y() > 0:  # 滚轮向上，放大
+            new_scale = self.scale_factor * zoom_in_factor
+            if new_scale <= self.max_zoom:  # 限制最大缩放
+                self.scale_factor = new_scale
+                self.scale(zoom_in_factor, zoom_in_factor)
+
+        elif event.angleDelta().y() < 0:  # 滚轮向下，缩小
+            new_scale = self.scale_factor * zoom_out_factor
+            if new_scale >= self.min_zoom:  # 限制最小缩放
+                self.scale_factor = new_scale
+                self.scale(zoom_out_factor, zoom_out_factor)
+
+        # **如果缩放比例变回 `1.0x`，恢复原图**
+        if self.scale_factor == 1.0:
+            self.resetTransform()  # **重置所有缩放**
+
+        scale_percentage = self.scale_factor * 100
+        zoom_status = "Zoom factor: {:.1f}%".format(scale_percentage)
+        self.zoomStatus.setText(zoom_status)
+
+    def update_coordinates(self, event):
+        self.showPixel(event.pos())
+
+    def inspectHover(self):
+        if self.hover_pos is not None:
+            self.showPixel(self.hover_pos)
+
+    def showPixel(self, pos):
+        scene_pos = self.mapToScene(pos)  # 转换为场景坐标
+        item_pos = self.image_item.mapFromScene(scene_pos)  # 转换为图像坐标
+
+        pix_x = int(item_pos.x())
+        pix_y = int(item_pos.y())
+
+        if self.image is None:
+            # 还在显示缓存的预览，原图尚未解码
+            self.pixelStatus.setText("Loading full resolution...")
+            return
+        source = self.sourcePixel(pix_x, pix_y)
+        if source is not None:
+            pix_x, pix_y = source
+            pixel_value = self.image[pix_y, pix_x]
+            pixel_status = "Position：x = {}, y = {}, value = {}".format(
+                pix_x, pix_y, pixel_value)
+            channel = cfaChannel(self.metadata.fileInfo.pixelType, pix_y,
+                                 pix_x)
+            if channel is not None:
+                pixel_status += " ({})".format(channel)
+            self.pixelStatus.setText(pixel_status)
+            self.pixelHovered.emit(pix_x, pix_y)
+
+    def sourcePixel(self, x, y):
+        """Pixel (x, y) of the image under the scene position (x, y), None
+        outside of it. The plane mosaic is mapped back to the mosaic."""
+        mosaic = self.mosaic
+        if mosaic is not None:
+            if not (0 <= y < mosaic.shape[0] and 0 <= x < mosaic.shape[1]):
+                return None
+            channel, y, x = mosaic.source(y, x)
+            dy, dx = BAYER_OFFSETS[self.metadata.fileInfo.pixelType][channel]
+            x, y = dx + 2 * x, dy + 2 * y
+        if 0 <= x < self.image.shape[1] and 0 <= y < self.image.shape[0]:
+            return x, y
+        return None
+
+    def sourceRect(self, rect):
+        """(top, left, bottom, right) in the image of a scene rectangle,
+        None when it covers less than 2 x 2 pixels"""
+        rect = rect.intersected(self.image_item.boundingRect())
+        if rect.width() < 2 or rect.height() < 2:
+            return None
+        top, left = int(rect.top()), int(rect.left())
+        bottom, right = int(math.ceil(rect.bottom())), int(
+            math.ceil(rect.right()))
+        if self.mosaic is not None:
+            # 区域限制在起点所在的通道平面内
+            _, _, plane_bottom, plane_right = self.mosaic.quadrant(top, left)
+            bottom, right = min(bottom, plane_bottom), min(right, plane_right)
+        first = self.sourcePixel(left, top)
+        last = self.sourcePixel(right - 1, bottom - 1)
+        if first is None or last is None:
+            return None
+        return first[1], first[0], last[1] + 1, last[0] + 1
+
+    def mousePressEvent(self, event):
+        if event.modifiers() & Qt.KeyboardModifier.ShiftModifier:
+            self.roi_origin = event.pos()
+            self.rubberBand.setGeometry(QRect(self.roi_origin, QSize()))
+            self.rubberBand.show()
+            return
+        self.update_coordinates(event)
+
+    def mouseMoveEvent(self, event):
+        if self.roi_origin is not None:
+            self.rubberBand.setGeometry(
+                QRect(self.roi_origin, event.pos()).normalized())
+            return
+        self.hover_pos = event.pos()
+        if not self.hover_timer.isActive():
+            screen = self.screen()
+            rate = screen.refreshRate() if screen is not None else 60
+            self.hover_timer.start(int(1000 / (rate or 60)))
+        super().mouseMoveEvent(event)
+
+    def mouseReleaseEvent(self, event):
+        if self.roi_origin is None:
+            super().mouseReleaseEvent(event)
+            return
+        self.rubberBand.hide()
+        rect = self.mapToScene(QRect(self.roi_origin,
+                                     event.pos()).normalized()).boundingRect()
+        self.roi_origin = None
+        self.roiSelected.emit(self.sourceRect(rect))
+
+
+class PlaneViewer(ImageViewer):
+    """ImageViewer of one Bayer plane, `pyramid` built over the plane and
+    `image` the full mosaic. The pixel readout and the regions refer to
+    the pixels of the mosaic, at `offset` (dy, dx) in each 2x2 cell."""
+
+    def __init__(self, image, metadata, pixelStatus, zoomStatus, pyramid,
+                 offset):
+        self.offset = offset
+        super().__init__(image, metadata, pixelStatus, zoomStatus, pyramid)
+
+    def sourcePixel(self, x, y):
+        if x < 0 or y < 0:
+            return None
+        dy, dx = self.offset
+        return super().sourcePixel(dx + 2 * x, dy + 2 * y)
+
+
+class DifferenceViewer(ImageViewer):
+    """ImageViewer of a DifferenceImage.
+
+    Tiles are mapped to 8 bits around mid gray: a difference relative to the
+    full scale of the images, or a ratio in stops (log2), times `gain`,
+    saturates at black and white. The pixel readout shows the real value.
+    """
+
+    def __init__(self, difference, metadata, pixelStatus, zoomStatus,
+                 gain=8):
+        self.full_scale = float(2**(metadata.fileInfo.pixelPrecision or 8) -
+                                1)
+        self.gain = gain
+        pixelType = PixelType.RGB if difference.ndim == 3 else (
+            PixelType.GRAYSCALE)
+        super().__init__(
+            difference,
+            displayMetadata(pixelType, PixelRepresentation.UINT8, 8),
+            pixelStatus, zoomStatus)
+
+    def setGain(self, gain):
+        self.gain = gain
+        # 重新转换所有分块
+        self.image_item.setPyramid(self.pyramid, self.convertTile)
+
+    def convertTile(self, tile):
+        if tile.ndim == 3 and tile.shape[2] > 3:
+            tile = tile[..., :3]
+        if self.image.mode == 'difference':
+            values = tile / self.full_scale
+        else:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                values = np.log2(tile)
+        values = np.nan_to_num(values * self.gain, nan=0.0)
+        out = (np.clip(values, -1, 1) * 127 + 128).astype(np.uint8)
+        # out 是局部数组，返回的 QImage 必须拥有自己的像素
+        qimage = self.convertNumpyArrayToQImage(out, self.display_metadata)
+        return qimage.copy() if qimage is not None else None
+
+
+class ViewSync:
+    """Lock the zoom and the visible area of several ImageViewers.
+
+    The view that changed is followed by the others: same field of view and
+    same center relative to the image size, so images of different
+    resolution, e.g. a RAW mosaic and a binned output, stay aligned.
+    """
+
+    def __init__(self):
+        self.viewers = []
+        self.syncing = False
+
+    def add(self, viewer, align=True):
+        others = [v for v in self.viewers if not sip.isdeleted(v)]
+        self.viewers = others + [viewer]
+        viewer.viewChanged.connect(lambda: self.follow(viewer))
+        if align and others:
+            self.follow(others[0])
+
+    def remove(self, viewer):
+        self.viewers = [v for v in self.viewers if v is not viewer]
+
+    def follow(self, source):
+        if self.syncing or sip.isdeleted(source):
+            return
+        self.syncing = True
+        try:
+            center = source.mapToScene(source.viewport().rect().center())
+            fx = center.x() / source.pyramid.width
+            fy = center.y() / source.pyramid.height
+            for viewer in self.viewers:
+                if viewer is source or sip.isdeleted(viewer):
+                    continue
+                ratio = source.pyramid.width / viewer.pyramid.width
+                viewer.scale_factor = source.scale_factor * ratio
+                viewer.setTransform(source.transform().scale(ratio, ratio))
+                viewer.centerOn(fx * viewer.pyramid.width,
+                                fy * viewer.pyramid.height)
+        finally:
+            self.syncing = False
+
+
+class FrameItem(QGraphicsItem):
+    """Scene item drawing one QImage stretched over the full resolution
+    frame, for frames that change too often to be cut into cached tiles"""
+
+    def __init__(self, width, height):
+        super().__init__()
+        self.width, self.height = width, height
+        self.qimage = None
+        self.drawn = False
+
+    def boundingRect(self):
+        return QRectF(0, 0, self.width, self.height)
+
+    def setImage(self, qimage):
+        self.qimage = qimage
+        self.update()
+
+    def paint(self, painter, option, widget=None):
+        if self.qimage is not None:
+            painter.drawImage(self.boundingRect(), self.qimage,
+                              QRectF(self.qimage.rect()))
+            self.drawn = True
+
+
+class SequenceViewer(ImageViewer):
+    """ImageViewer of the frames of a FrameSequence.
+
+    Frames are converted with the viewer's ImageConverter, whose buffers are
+    reused from one frame to the next, and drawn without going through a
+    QPixmap. The pixel readout reads the shown frame at full resolution.
+    """
+
+    def __init__(self, sequence, pixelStatus, zoomStatus):
+        self.sequence = sequence
+        first = sequence.open(0)
+        super().__init__(first, sequence.metadata, pixelStatus, zoomStatus)
+
+    def createImageItem(self, tiles, tile_cache):
+        return FrameItem(self.pyramid.width, self.pyramid.height)
+
+    def fit(self):
+        """Zoom out to show the whole frame"""
+        self.fitInView(self.image_item, Qt.AspectRatioMode.KeepAspectRatio)
+        self.scale_factor = self.transform().m11()
+        self.zoomStatus.setText("Zoom factor: {:.1f}%".format(
+            self.scale_factor * 100))
+
+    def showFrame(self, buffer, index):
+        """Show a frame read into `buffer`, which must stay untouched until
+        the next frame is shown"""
+        qimage = self.convertNumpyArrayToQImage(buffer, self.metadata)
+        if qimage is None:
+            return False
+        self.image = self.sequence.open(index)
+        self.image_item.setImage(qimage)
+        return True
+
+
+class ImageDisplayer(QWidget):
+    prefetched = pyqtSignal(object, object)
+    # 窗口第一次绘制完成后发出，用于延后加载非必需的部分
+    firstPaint = pyqtSignal()
+    # 打开的图像第一次画出像素后发出：阶段名和打开后经过的毫秒数
+    firstPixels = pyqtSignal(str, float)
+    image = None
+    metadata = None
+    image_path = None
+    metadata_path = None
+    frame = None
+    histPlot = None
+    histLabel = None
+    painted = False
+    hud = False
+    # 统计面板：积分图、Shift+拖动的区域及其直方图给出的极值、悬停的像素
+    statsEngine = None
+    statsRect = None
+    statsExtrema = None
+    hoverPos = None
+    # 最近一次绘制的直方图，Auto 色阶使用
+    histCounts = None
+    tabWidget = None
+    imageArea = None
+    image_viewer = None
+    loader = None
+    # 监视模式下重新加载时保留当前视图，只替换图像
+    keepView = False
+    watcher = None
+    watch_debounce_ms = 250
+    watch_time = None
+    # 正在显示的阶段：embedded preview、cached preview 或 full resolution
+    stage = None
+    open_time = None
+
+    def __init__(self,
+                 image_path,
+                 metadata_path=None,
+                 demosaic=None,
+                 cache_bytes=1024 * 1024 * 1024,
+                 preview_cache=None,
+                 hud=False,
+                 compare_paths=None,
+                 compare_layout='side',
+                 watch=None,
+                 memory_budget=None,
+                 image_cache=None):
+        super().__init__()
+        # 可以是单个文件，也可以是目录或通配符展开后的文件列表
+        self.image_paths = list(image_path) if isinstance(
+            image_path, (list, tuple)) else [image_path]
+        self.index = 0
+        self.image_path = self.image_paths[0]
+        self.metadata_path = metadata_path
+        self.demosaic = demosaic
+        self.colorPreviews = {}
+        self.tasks = []
+        # 单实例模式下各标签页共用一个缓存
+        self.cache = image_cache if image_cache is not None else ImageCache(
+            cache_bytes)
+        self.preview_cache = preview_cache
+        # 超过预算四分之一的解码结果写入临时文件并映射，见 spillArgs
+        self.memory_budget = memory_budget
+        # 正在显示磁盘缓存预览的文件
+        self.proxy_path = None
+        self.prefetching = {}
+        self.prefetched.connect(self.onPrefetched)
+        self.hud = hud
+        # 对比模式：其余图像 B, C... 与当前图像 A 锁定缩放和平移
+        self.compare_paths = list(compare_paths or [])
+        self.compare_layout = compare_layout
+        self.compareImages = [None] * len(self.compare_paths)
+        self.compareViewers = [None] * len(self.compare_paths)
+        self.compareLoaders = []
+        self.viewSync = ViewSync()
+        self.tone = ToneMapping()
+        # 通道平面模式：各平面的标签页和整幅图的平面统计
+        self.planeViewers = []
+        self.planeStats = None
+        # 当前图像的裁剪图层和整幅图的裁剪像素计数
+        self.clipping = None
+        self.clippingTotals = None
+        # 打开图像后各阶段第一次画出像素的时间 (阶段, 毫秒)
+        self.stageTimes = []
+        self.initUI()
+        if watch is not None:
+            self.initWatcher(watch)
+
+    def paintEvent(self, event):
+        with profiler.span('ImageDisplayer.paintEvent'):
+            super().paintEvent(event)
+        if not self.painted:
+            self.painted = True
+            QTimer.singleShot(0, self.firstPaint.emit)
+
+    def toggleHud(self):
+        self.hud = not self.hud
+        for viewer in [self.image_viewer] + self.viewSync.viewers:
+            if viewer is not None and not sip.isdeleted(viewer):
+                viewer.setHudVisible(self.hud)
+
+    def memoryReport(self):
+        """Where the memory of the window goes, one line per holder"""
+
+        def mb(nbytes):
+            return '{:.1f} MB'.format(nbytes / 2**20)
+
+        def imageLine(name, image):
+            if image is None:
+                return '{}: none'.format(name)
+            held = arrayBytes(image)
+            where = 'in memory ' + mb(held) if held else 'mapped from file'
+            if isinstance(image, DifferenceImage):
+                where = 'computed per tile'
+            return '{}: {} {}, {}'.format(name,
+                                          'x'.join(map(str, image.shape)),
+                                          image.dtype, where)
+
+        rss = currentRss()
+        lines = ['Resident memory: {}'.format(
+            mb(rss) if rss is not None else 'unknown')]
+        lines.append(imageLine('Image', self.image))
+        viewer = self.image_viewer
+        if viewer is not None and not sip.isdeleted(viewer):
+            pyramid = viewer.pyramid
+            stored = sorted(n for n, level in pyramid.levels.items()
+                            if n > 0 and level.flags.owndata)
+            lines.append('Pyramid levels {}: {}'.format(
+                stored or '-', mb(pyramid.nbytes())))
+            item = viewer.image_item
+            if isinstance(item, TiledImageItem):
+                lines.append('Tile pixmaps: {} tiles, {} of {}'.format(
+                    len(item.tiles), mb(item.cache_bytes),
+                    mb(item.max_cache_bytes)))
+        lines.append('Image cache: {} images, {} of {}'.format(
+            len(self.cache.entries), mb(self.cache.nbytes()),
+            mb(self.cache.max_bytes)))
+        lines.append('Color previews: {}'.format(
+            mb(
+                sum(
+                    arrayBytes(pyramid.image) + pyramid.nbytes()
+                    for pyramid, _ in self.colorPreviews.values()))))
+        if self.statsEngine is not None:
+            tables = [
+                table for pair in self.statsEngine.tables.values()
+                for table in pair
+            ]
+            mapped = sum(t.nbytes for t in tables if isinstance(t, np.memmap))
+            lines.append('Statistics tables: {} in memory, {} mapped'.format(
+                mb(sum(t.nbytes for t in tables) - mapped), mb(mapped)))
+        for path, entry in zip(self.compare_paths, self.compareImages):
+            lines.append(
+                imageLine('Compare {}'.format(path.name),
+                          entry[0] if entry is not None else None))
+        if self.memory_budget is not None:
+            lines.append('Memory budget: {}'.format(mb(self.memory_budget)))
+        return '\n'.join(lines)
+
+    def showMemoryReport(self):
+        QMessageBox.information(self, "Memory", self.memoryReport())
+
+    def runInBackground(self, function, *args, done=None, failed=None):
+        task = BackgroundTask(function, *args, parent=self)
+        if done is not None:
+            task.done.connect(done)
+        task.failed.connect(failed or self.onTaskFailed)
+        task.finished.connect(lambda: self.tasks.remove(task))
+        self.tasks.append(task)
+        task.start()
+        return task
+
+    def onTaskFailed(self, message):
+        QMessageBox.critical(self, "Error", message)
+
+    def onDisplayModeChanged(self, index):
+        mode = self.modeBox.itemData(index)
+        if self.image_viewer is None:
+            return
+        self.removePlaneTabs()
+        self.planeStatsLabel.setVisible(mode in ('planes', 'plane-tabs'))
+        if mode in ('planes', 'plane-tabs'):
+            self.showPlaneStatistics()
+        if mode is None:
+            self.image_viewer.setDisplay()
+        elif mode == 'planes':
+            if mode not in self.colorPreviews:
+                mosaic = PlaneMosaic(
+                    bayerPlanes(self.image, self.metadata.fileInfo.pixelType))
+                self.colorPreviews[mode] = (ImagePyramid(mosaic),
+                                            self.metadata)
+            self.image_viewer.setDisplay(*self.colorPreviews[mode])
+        elif mode == 'plane-tabs':
+            self.image_viewer.setDisplay()
+            self.showPlaneTabs()
+        elif mode in self.colorPreviews:
+            self.image_viewer.setDisplay(*self.colorPreviews[mode])
+        else:
+            self.modeBox.setEnabled(False)
+            self.pixelStatus.setText("Demosaicing...")
 
-        # 创建场景
-        self.scene = QGraphicsScene(self)
-        self.setScene(self.scene)
+            def demosaic(image, metadata):
+                with profiler.span('demosaic', mode=mode):
+                    rgb, scale = BayerDemosaic(metadata).preview(image, mode)
+                return ImagePyramid(rgb, scale), displayMetadata(
+                    PixelType.RGB, PixelRepresentation.UINT8, 8)
 
-        # 加载图片
-        self.image_item = QGraphicsPixmapItem(self.pix_map_image)
-        self.scene.addItem(self.image_item)
+            image = self.image
 
-        # 设置抗锯齿和插值模式
-        self.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
-        self.setTransformationAnchor(
-            QGraphicsView.ViewportAnchor.AnchorUnderMouse)  # 以鼠标位置为缩放中心
-        self.setResizeAnchor(QGraphicsView.ViewportAnchor.AnchorUnderMouse)
+            def show(result):
+                if self.image is not image:
+                    return
+                self.colorPreviews[mode] = result
+                self.modeBox.setEnabled(True)
+                self.pixelStatus.setText("Click pixel to display value")
+                if self.modeBox.currentData() == mode:
+                    self.image_viewer.setDisplay(*result)
 
-        # 缩放参数
-        self.scale_factor = 1.0  # 当前缩放比例
-        self.zoom_history = [1.0]  # **存储缩放比例的历史**
-        self.zoom_images = [self.pix_map_image]  # **存储不同缩放比例的图像**
-        self.max_zoom = 10.0
-        self.min_zoom = 0.1
+            self.runInBackground(demosaic,
+                                 self.image,
+                                 self.metadata,
+                                 done=show)
 
-    def convertNumpyArrayToQImage(self, img, metadata):
-        if metadata.fileInfo.pixelRepresentation == PixelRepresentation.UINT8:
-            image = np.array(img)
-            if metadata.fileInfo.pixelType in [
-                    PixelType.BAYER_RGGB, PixelType.BAYER_BGGR,
-                    PixelType.BAYER_GRBG, PixelType.BAYER_GBRG
-            ] or metadata.fileInfo.pixelType == PixelType.GRAYSCALE:
-                return QImage(image.data, image.shape[1], image.shape[0],
-                              QImage.Format.Format_Grayscale8)
-            elif metadata.fileInfo.pixelType == PixelType.RGB:
-                return QImage(image.data, image.shape[1], image.shape[0],
-                              QImage.Format.Format_RGB888)
-            elif metadata.fileInfo.pixelType == PixelType.RGBA:
-                return QImage(image.data, image.shape[1], image.shape[0],
-                              QImage.Format.Format_RGBA8888)
-            else:
-                QMessageBox.critical(
-                    None, "Error",
-                    "Unsupported pixel type  on 8 bits: {} ".format(
-                        metadata.fileInfo.pixelType))
+    def showPlaneTabs(self):
+        """One tab per Bayer plane after the image tab, zoom and pan locked
+        with the image"""
+        pixelType = self.metadata.fileInfo.pixelType
+        planes = bayerPlanes(self.image, pixelType)
+        if self.image_viewer not in self.viewSync.viewers:
+            self.viewSync.add(self.image_viewer)
+        for position, channel in enumerate(
+                itertools.chain(*PlaneMosaic.layout)):
+            viewer = PlaneViewer(self.image, self.metadata, self.pixelStatus,
+                                 self.zoomStatus,
+                                 ImagePyramid(planes[channel]),
+                                 BAYER_OFFSETS[pixelType][channel])
+            viewer.setTone(self.tone)
+            viewer.setHudVisible(self.hud)
+            viewer.roiSelected.connect(self.showHistogram)
+            viewer.roiSelected.connect(self.onRoiSelected)
+            viewer.pixelHovered.connect(self.onPixelHovered)
+            self.tabWidget.insertTab(
+                self.tabWidget.indexOf(self.tabImage) + 1 + position, viewer,
+                "{} plane".format(channel))
+            self.viewSync.add(viewer)
+            self.planeViewers.append(viewer)
+        self.applyOverlays()
 
-        elif (metadata.fileInfo.pixelRepresentation ==
-              PixelRepresentation.UINT16):
-            factor = 1
-            if metadata.fileInfo.pixelPrecision:
-                factor = int(65535.0 /
-                             (2**metadata.fileInfo.pixelPrecision - 1))
-            image = np.array(img * factor)
-            if metadata.fileInfo.pixelType in [
-                    PixelType.BAYER_RGGB, PixelType.BAYER_BGGR,
-                    PixelType.BAYER_GRBG, PixelType.BAYER_GBRG
-            ] or metadata.fileInfo.pixelType == PixelType.GRAYSCALE:
-                return QImage(image.data, image.shape[1], image.shape[0],
-                              QImage.Format.Format_Grayscale16)
-            elif metadata.fileInfo.pixelType == PixelType.RGBA:
-                return QImage(image.data, image.shape[1], image.shape[0],
-                              QImage.Format.Format_RGBA64)
-            else:
-                QMessageBox.critical(
-                    None, "Error",
-                    "Unsupported pixel type  on 16 bits: {} ".format(
-                        metadata.fileInfo.pixelType))
+    def removePlaneTabs(self):
+        for viewer in self.planeViewers:
+            self.viewSync.remove(viewer)
+            self.tabWidget.removeTab(self.tabWidget.indexOf(viewer))
+            viewer.deleteLater()
+        self.planeViewers = []
+
+    def showPlaneStatistics(self):
+        """Mean, noise and clipping of each Bayer plane over the whole
+        image, computed once per image in the background"""
+        image = self.image
+        if self.planeStats is not None and self.planeStats[0] is image:
+            self.planeStatsLabel.setText(self.planeStats[1])
+            return
+        self.planeStatsLabel.setText("Planes: computing...")
+
+        def compute():
+            with profiler.span('planeStatistics'):
+                return planeStatistics(image, self.metadata)
+
+        def show(stats):
+            if self.image is not image:
+                return
+            lines = [
+                "Planes, full image",
+                "{:<4}{:>10}{:>10}{:>10}{:>9}".format('', 'n', 'mean',
+                                                       'std', 'clipped')
+            ]
+            for channel in itertools.chain(*PlaneMosaic.layout):
+                moments = stats[channel]
+                if moments is None:
+                    continue
+                lines.append("{:<4}{:>10}{:>10.4g}{:>10.4g}{:>8.3f}%".format(
+                    channel, moments[0], moments[1], moments[2],
+                    moments[3] * 100))
+            self.planeStats = (image, "\n".join(lines))
+            self.planeStatsLabel.setText(self.planeStats[1])
 
+        self.runInBackground(compute, done=show)
+
+    def openIndex(self, index):
+        """Show image `index` of the browsed files, from the cache if
+        possible, and prefetch its neighbours"""
+        if not 0 <= index < len(self.image_paths):
+            return
+        self.releaseLoader()
+        self.index = index
+        self.image_path = self.image_paths[index]
+        self.colorPreviews = {}
+        self.proxy_path = None
+        self.open_time = time.perf_counter()
+        self.stageTimes = []
+        self.stage = None
+        self.modeBox.blockSignals(True)
+        self.modeBox.setCurrentIndex(0)
+        self.modeBox.blockSignals(False)
+        self.removePlaneTabs()
+        self.planeStatsLabel.hide()
+        self.modeBox.setEnabled(False)
+        self.cache.evict(keep=self.image_path)
+        self.tabWidget.setTabText(0, self.tabTitle())
+        self.prevButton.setEnabled(index > 0)
+        self.nextButton.setEnabled(index < len(self.image_paths) - 1)
+        if self.compare_paths:
+            self.compareTitle.setText("A: {}".format(self.image_path))
+            if not self.compareLoaders:
+                self.loadCompareImages()
+        entry = self.cache.get(self.image_path)
+        profiler.hit('images', entry is not None)
+        if entry is not None:
+            self.image, self.metadata = entry.image, entry.metadata
+            self.showMetadata()
+            self.onImageConverted(self.image_path, entry.pyramid, {})
         else:
-            QMessageBox.critical(
-                None, "Error", "Unsupported pixel representation: {} ".format(
-                    metadata.fileInfo.pixelRepresentation))
+            self.loadImage()
+        self.prefetchNeighbours()
 
-    def wheelEvent(self, event):
-        """鼠标滚轮事件：允许从 `1.0x` 开始缩小，并记录历史"""
-        zoom_in_factor = 1.2
-        zoom_out_factor = 1 / zoom_in_factor
+    def showPrevious(self):
+        self.openIndex(self.index - 1)
 
-        if event.angleDelta().y() > 0:  # 滚轮向上，放大
-            new_scale = self.scale_factor * zoom_in_factor
-            if new_scale <= self.max_zoom:  # 限制最大缩放
-                self.scale_factor = new_scale
-                self.zoom_history.append(self.scale_factor)  # **记录历史缩放比例**
-                self.scale(zoom_in_factor, zoom_in_factor)
+    def showNext(self):
+        self.openIndex(self.index + 1)
 
-        elif event.angleDelta().y() < 0:  # 滚轮向下，缩小
-            new_scale = self.scale_factor * zoom_out_factor
-            if new_scale >= self.min_zoom:  # 限制最小缩放
-                self.scale_factor = new_scale
-                self.zoom_history.append(self.scale_factor)  # **记录历史缩放比例**
-                self.scale(zoom_out_factor, zoom_out_factor)
+    def tabTitle(self):
+        if len(self.image_paths) == 1:
+            return str(self.image_path)
+        return "{} ({}/{})".format(self.image_path, self.index + 1,
+                                   len(self.image_paths))
 
-        # **如果缩放比例变回 `1.0x`，恢复原图**
-        if self.scale_factor == 1.0:
-            self.resetTransform()  # **重置所有缩放**
-            self.image_item.setPixmap(self.pix_map_image)  # **恢复原图**
-            self.zoom_history = [1.0]  # **重置缩放历史**
+    def prefetchNeighbours(self):
+        for index in (self.index + 1, self.index - 1):
+            if not 0 <= index < len(self.image_paths):
+                continue
+            path = self.image_paths[index]
+            if path in self.cache or path in self.prefetching:
+                continue
+            try:
+                if openRawFile(path, self.metadataFor(path)) is not None:
+                    # 文件映射打开很快，不需要预先解码
+                    continue
+            except Exception:
+                # 错误留到真正打开时再报告
+                continue
+            try:
+                future = submitDecode(path, self.metadataFor(path),
+                                      self.memory_budget)
+            except concurrent.futures.process.BrokenProcessPool:
+                # 新的进程池也无法启动，不预取，打开时再报告
+                return
+            self.prefetching[path] = future
+            future.add_done_callback(
+                lambda f, path=path: self.prefetched.emit(path, f))
 
-        scale_percentage = self.scale_factor * 100
-        zoom_status = "Zoom factor: {:.1f}%".format(scale_percentage)
-        self.zoomStatus.setText(zoom_status)
+    def onPrefetched(self, path, future):
+        self.prefetching.pop(path, None)
+        if future.cancelled() or future.exception() is not None \
+                or path in self.cache:
+            return
+        self.cache.put(path,
+                       CachedImage(*decodedResult(future)),
+                       keep=self.image_path)
 
-    def update_coordinates(self, event):
-        scene_pos = self.mapToScene(event.pos())  # 转换为场景坐标
-        item_pos = self.image_item.mapFromScene(scene_pos)  # 转换为图像坐标
+    def metadataFor(self, path):
+        # -m 只对单个文件有效，目录浏览时使用各自的 sidecar
+        return self.metadata_path if len(self.image_paths) == 1 else None
 
-        pix_x = int(item_pos.x())
-        pix_y = int(item_pos.y())
+    def releaseLoader(self):
+        """Cancel the current loader and disconnect it, results it already
+        queued are dropped by the slots as they name another path"""
+        if self.loader is None:
+            return
+        if self.loader.isRunning():
+            self.loader.cancel()
+        for signal in (self.loader.progress, self.loader.cached,
+                       self.loader.embedded, self.loader.decoded,
+                       self.loader.converted, self.loader.failed):
+            try:
+                signal.disconnect()
+            except TypeError:
+                # 没有连接
+                pass
 
-        if pix_x >= 0 and pix_x < self.image.shape[
-                1] and pix_y >= 0 and pix_y < self.image.shape[0]:
-            pixel_value = self.image[pix_y, pix_x]
-            pixel_status = "Position：x = {}, y = {}, value = {}".format(
-                pix_x, pix_y, pixel_value)
-            self.pixelStatus.setText(pixel_status)
+    def loadImage(self):
+        """Start decoding in the background, the window stays responsive"""
+        self.loader = ImageLoader(self.image_path,
+                                  self.metadataFor(self.image_path),
+                                  self.imageArea.viewport().size(), self,
+                                  self.prefetching.get(self.image_path),
+                                  self.preview_cache, self.memory_budget)
+        self.loader.progress.connect(self.onLoadProgress)
+        self.loader.cached.connect(self.onCachedPreview)
+        self.loader.embedded.connect(self.onEmbeddedPreview)
+        self.loader.decoded.connect(self.onImageDecoded)
+        self.loader.converted.connect(self.onImageConverted)
+        self.loader.failed.connect(self.onLoadFailed)
+        self.progressBar.setValue(0)
+        self.progressBar.show()
+        self.cancelButton.show()
+        self.loader.start()
 
-    def mousePressEvent(self, event):
-        self.update_coordinates(event)
+    def reloadImage(self):
+        """Decode the shown file again after it changed on disk, keeping
+        the zoom and pan"""
+        self.releaseLoader()
+        self.cache.discard(self.image_path)
+        self.colorPreviews = {}
+        self.keepView = True
+        self.open_time = time.perf_counter()
+        self.stageTimes = []
+        self.stage = None
+        self.loadImage()
 
+    def initWatcher(self, pattern):
+        """Watch the -i file, directory or glob pattern for new and
+        rewritten images"""
+        self.watch_pattern = pattern
+        path = pathlib.Path(pattern)
+        if not path.exists():
+            # 通配符：监视第一个含通配符部分之前的目录
+            parts = itertools.takewhile(lambda part: not glob.has_magic(part),
+                                        path.parts)
+            path = pathlib.Path(*parts)
+        self.watch_dirs = {path if path.is_dir() else path.parent}
+        self.watch_dirs.update(p.parent for p in self.image_paths)
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.addPaths([str(d) for d in self.watch_dirs])
+        self.watcher.addPath(str(self.image_path))
+        self.watcher.fileChanged.connect(self.onWatchedChanged)
+        self.watcher.directoryChanged.connect(self.onWatchedChanged)
+        self.watch_state = self.scanWatched()
+        self.watch_pending = self.watch_state
+        self.watchTimer = QTimer(self)
+        self.watchTimer.setSingleShot(True)
+        self.watchTimer.setInterval(self.watch_debounce_ms)
+        self.watchTimer.timeout.connect(self.checkWatched)
 
-class ImageDisplayer(QWidget):
-    image = None
-    metadata = None
-    image_path = None
-    frame = None
-    tabWidget = None
-    imageArea = None
+    def scanWatched(self):
+        """(size, mtime) of each watched image"""
+        state = {}
+        for path in collectImagePaths(self.watch_pattern):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            state[path] = (stat.st_size, stat.st_mtime_ns)
+        return state
 
-    def __init__(self, image, metadata, image_path):
-        super().__init__()
+    def onWatchedChanged(self, path):
+        if self.watch_time is None:
+            self.watch_time = time.perf_counter()
+        # 每次变化都重新计时，写入停止后才检查
+        self.watchTimer.start()
+
+    def checkWatched(self):
+        """Reload once the watched files have not changed for one debounce
+        period, so that files still being written are not decoded"""
+        state = self.scanWatched()
+        if state != self.watch_pending:
+            self.watch_pending = state
+            self.watchTimer.start()
+            return
+        if str(self.image_path) not in self.watcher.files() \
+                and self.image_path.exists():
+            # 文件被替换后监视会失效
+            self.watcher.addPath(str(self.image_path))
+        if not state or state == self.watch_state:
+            self.watch_time = None
+            return
+        added = [path for path in state if path not in self.watch_state]
+        changed = [
+            path for path in state
+            if path in self.watch_state and state[path] != self.watch_state[path]
+        ]
+        self.watch_state = state
+        for path in changed + added:
+            self.cache.discard(path)
+            future = self.prefetching.pop(path, None)
+            if future is not None:
+                future.cancel()
+        self.image_paths = sorted(state)
+        if self.image_path in state:
+            self.index = self.image_paths.index(self.image_path)
+        else:
+            self.index = min(self.index, len(self.image_paths) - 1)
+        browsing = len(self.image_paths) > 1
+        self.prevButton.setVisible(browsing)
+        self.nextButton.setVisible(browsing)
+        self.prevButton.setEnabled(self.index > 0)
+        self.nextButton.setEnabled(self.index < len(self.image_paths) - 1)
+        self.tabWidget.setTabText(0, self.tabTitle())
+        if added:
+            # 新拍摄的图像：显示最新的一张，保持缩放和位置
+            newest = max(added, key=lambda path: state[path][1])
+            self.keepView = self.image_viewer is not None
+            self.openIndex(self.image_paths.index(newest))
+        elif self.image_path in changed:
+            self.reloadImage()
+        else:
+            self.watch_time = None
+
+    def cancelLoad(self):
+        if self.loader is not None and self.loader.isRunning():
+            self.loader.cancel()
+            self.pixelStatus.setText("Loading cancelled")
+        self.progressBar.hide()
+        self.cancelButton.hide()
+
+    def onLoadProgress(self, value, text):
+        self.progressBar.setValue(value)
+        self.progressBar.setFormat("{} %p%".format(text))
+
+    def onCachedPreview(self, path, preview):
+        """Paint the preview from the disk cache while the image decodes"""
+        if path != self.image_path:
+            return
+        self.image = None
+        self.statsEngine = None
+        self.metadata = preview.metadata
+        self.proxy_path = self.image_path
+        self.stage = 'cached preview'
+        self.showMetadata()
+        self.showImage(preview.pyramid())
+        self.plotHistogram(preview.histogram, "Full image")
+        self.pixelStatus.setText("Loading full resolution...")
+
+    def onEmbeddedPreview(self, path, pyramid):
+        """Paint the JPEG preview embedded in the file while it decodes"""
+        if path != self.image_path:
+            return
+        self.image = None
+        self.statsEngine = None
+        self.metadata = None
+        self.proxy_path = self.image_path
+        self.stage = 'embedded preview'
+        self.clearMetadata()
+        self.showImage(pyramid,
+                       metadata=displayMetadata(PixelType.RGB,
+                                                PixelRepresentation.UINT8, 8))
+        self.pixelStatus.setText("Loading full resolution...")
+
+    def onPixelsShown(self):
+        """Time from opening the image to the first pixels of each stage"""
+        if self.stage is None or self.open_time is None or any(
+                stage == self.stage for stage, _ in self.stageTimes):
+            return
+        ms = (time.perf_counter() - self.open_time) * 1e3
+        profiler.mark(self.stage)
+        self.stageTimes.append((self.stage, ms))
+        self.image_viewer.load_times = self.stageTimes
+        if len(self.stageTimes) == 1:
+            self.firstPixels.emit(self.stage, ms)
+
+    def onImageDecoded(self, path, image, metadata):
+        if path != self.image_path:
+            return
         self.image = image
         self.metadata = metadata
-        self.image_path = image_path
-        self.initUI()
-        self.showImage()
         self.showMetadata()
 
+    def onImageConverted(self, path, pyramid, tiles):
+        if path != self.image_path or self.image is not pyramid.image:
+            # 已经切换到其他图像，或者同一文件重新加载后的旧结果
+            return
+        entry = self.cache.get(self.image_path)
+        if entry is None or entry.image is not self.image:
+            entry = CachedImage(self.image, self.metadata, pyramid)
+            self.cache.put(self.image_path, entry, keep=self.image_path)
+        previewed = self.proxy_path == self.image_path
+        # 直方图已经来自缓存
+        from_cache = previewed and self.stage == 'cached preview'
+        self.proxy_path = None
+        self.stage = 'full resolution'
+        if previewed:
+            # 只替换预览，保持缩放和位置
+            self.image_viewer.setImage(self.image, entry.pyramid, tiles,
+                                       entry.tiles, self.metadata)
+        else:
+            self.showImage(entry.pyramid, tiles, entry.tiles)
+        self.applyOverlays()
+        self.progressBar.hide()
+        self.cancelButton.hide()
+        self.pixelStatus.setText("Click pixel to display value")
+        if self.metadata.fileInfo.pixelType in BAYER_TYPES:
+            self.modeBox.setEnabled(True)
+            if self.demosaic in BayerDemosaic.modes:
+                self.modeBox.setCurrentIndex(
+                    self.modeBox.findData(self.demosaic))
+        # 先让图像绘制出来，再构建直方图和积分图
+        if not from_cache:
+            QTimer.singleShot(0, self.showHistogram)
+        QTimer.singleShot(0, self.buildStatistics)
+        if self.compare_paths:
+            self.showDifference()
+        if self.keepView:
+            self.keepView = False
+            if self.modeBox.currentData() is not None:
+                # 重新计算彩色预览
+                self.onDisplayModeChanged(self.modeBox.currentIndex())
+            if self.watch_time is not None:
+                profiler.mark('reload')
+                self.pixelStatus.setText(
+                    "Reloaded {} ms after the file changed".format(
+                        int((time.perf_counter() - self.watch_time) * 1e3)))
+                self.watch_time = None
+
+    def onLoadFailed(self, message):
+        self.keepView = False
+        self.progressBar.hide()
+        self.cancelButton.hide()
+        self.pixelStatus.setText("Failed to load image")
+        QMessageBox.critical(
+            self, "Error",
+            "Exception caught in display image, check the error log: {}.".
+            format(message))
+
+    def closeEvent(self, event):
+        if self.loader is not None and self.loader.isRunning():
+            self.loader.cancel()
+            self.loader.wait()
+        for future in self.prefetching.values():
+            future.cancel()
+        if self.statsEngine is not None:
+            self.statsEngine.cancel()
+        for loader in self.compareLoaders:
+            loader.cancel()
+            loader.wait()
+        for task in list(self.tasks):
+            task.wait()
+        super().closeEvent(event)
+
     def initImageViewUI(self):
         self.tabWidget = QTabWidget(self)
         self.tabImage = QWidget(self.tabWidget)
         self.tabWidget.addTab(self.tabImage, str(self.image_path))
         self.imageArea = QScrollArea(self.tabImage)
         vbox = QVBoxLayout(self.tabImage)
-        vbox.addWidget(self.imageArea)
+        if self.compare_paths:
+            self.initCompareUI(vbox)
+        else:
+            vbox.addWidget(self.imageArea)
         self.imageArea.setAlignment(Qt.AlignmentFlag.AlignCenter)
 
         hbox = QHBoxLayout()
-        self.pixelStatus = QLabel("Click pixel to display value", self)
+        self.pixelStatus = QLabel("Loading image...", self)
         self.zoomStatus = QLabel("Zoom factor: 100%", self)
+        self.progressBar = QProgressBar(self)
+        self.progressBar.setRange(0, 100)
+        self.progressBar.hide()
+        self.cancelButton = QPushButton("Cancel", self)
+        self.cancelButton.clicked.connect(self.cancelLoad)
+        self.cancelButton.hide()
+        self.modeBox = QComboBox(self)
+        self.modeBox.addItem("Raw", None)
+        self.modeBox.addItem("Color (binned)", 'binned')
+        self.modeBox.addItem("Color (bilinear)", 'bilinear')
+        self.modeBox.addItem("Planes (2x2)", 'planes')
+        self.modeBox.addItem("Planes (tabs)", 'plane-tabs')
+        self.modeBox.setEnabled(False)
+        self.modeBox.currentIndexChanged.connect(self.onDisplayModeChanged)
+        self.prevButton = QPushButton("Previous", self)
+        self.prevButton.clicked.connect(self.showPrevious)
+        self.nextButton = QPushButton("Next", self)
+        self.nextButton.clicked.connect(self.showNext)
+        QShortcut(QKeySequence(Qt.Key.Key_PageUp), self,
+                  self.showPrevious)
+        QShortcut(QKeySequence(Qt.Key.Key_PageDown), self, self.showNext)
+        QShortcut(QKeySequence(Qt.Key.Key_F12), self, self.toggleHud)
+        QShortcut(QKeySequence("Ctrl+M"), self, self.showMemoryReport)
+        if len(self.image_paths) == 1:
+            self.prevButton.hide()
+            self.nextButton.hide()
+        hbox.addWidget(self.prevButton)
+        hbox.addWidget(self.nextButton)
         hbox.addWidget(self.pixelStatus)
         hbox.addWidget(self.zoomStatus)
+        hbox.addWidget(self.progressBar)
+        hbox.addWidget(self.cancelButton)
+        hbox.addWidget(self.modeBox)
+        if self.compare_paths:
+            hbox.addWidget(self.diffBox)
+            hbox.addWidget(self.gainBox)
         vbox.addLayout(hbox)
 
+    def initCompareUI(self, vbox):
+        """Panes side by side, or tabs, for the compared images and the
+        difference view"""
+        side = self.compare_layout == 'side'
+        self.compareTitle = QLabel(self.tabImage)
+        if side:
+            self.compareSplitter = QSplitter(Qt.Orientation.Horizontal,
+                                             self.tabImage)
+            pane = QWidget(self.compareSplitter)
+            layout = QVBoxLayout(pane)
+            layout.setContentsMargins(0, 0, 0, 0)
+            layout.addWidget(self.compareTitle)
+            layout.addWidget(self.imageArea)
+            self.compareSplitter.addWidget(pane)
+            vbox.addWidget(self.compareSplitter)
+        else:
+            vbox.addWidget(self.compareTitle)
+            vbox.addWidget(self.imageArea)
+        self.comparePanes = [
+            self.addComparePane("{}: {}".format(chr(ord('B') + i), path))
+            for i, path in enumerate(self.compare_paths)
+        ]
+        self.diffPane = self.addComparePane("A - B")
+        self.setPaneVisible(self.diffPane, False)
+
+        self.diffBox = QComboBox(self)
+        self.diffBox.addItem("No difference", None)
+        self.diffBox.addItem("Difference A - B", 'difference')
+        self.diffBox.addItem("Ratio A / B", 'ratio')
+        self.diffBox.currentIndexChanged.connect(self.showDifference)
+        self.gainBox = QSpinBox(self)
+        self.gainBox.setRange(1, 1024)
+        self.gainBox.setValue(8)
+        self.gainBox.setPrefix("Gain x")
+        self.gainBox.setToolTip(
+            "Differences of 1/gain of the full scale, or ratios of 1/gain "
+            "stop, are shown black or white")
+        self.gainBox.valueChanged.connect(self.onGainChanged)
+
+    def addComparePane(self, title):
+        pane = QWidget(self)
+        layout = QVBoxLayout(pane)
+        layout.setContentsMargins(0, 0, 0, 0)
+        if self.compare_layout == 'side':
+            layout.addWidget(QLabel(title, pane))
+            self.compareSplitter.addWidget(pane)
+        else:
+            self.tabWidget.addTab(pane, title)
+        pane.content = QLabel("Loading...", pane)
+        pane.content.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        layout.addWidget(pane.content)
+        return pane
+
+    def setPaneContent(self, pane, widget):
+        pane.layout().replaceWidget(pane.content, widget)
+        pane.content.hide()
+        pane.content.deleteLater()
+        pane.content = widget
+
+    def setPaneVisible(self, pane, visible):
+        if self.compare_layout == 'side':
+            pane.setVisible(visible)
+            # 所有图像等宽
+            count = self.compareSplitter.count()
+            self.compareSplitter.setSizes(
+                [max(self.compareSplitter.width() // count, 1)] * count)
+        else:
+            self.tabWidget.setTabVisible(self.tabWidget.indexOf(pane),
+                                         visible)
+
+    def loadCompareImages(self):
+        for i, path in enumerate(self.compare_paths):
+            loader = ImageLoader(path,
+                                 parent=self,
+                                 preview_cache=self.preview_cache,
+                                 memory_budget=self.memory_budget)
+            loader.decoded.connect(lambda path, image, metadata, i=i: self.
+                                   onCompareDecoded(i, image, metadata))
+            loader.converted.connect(lambda path, pyramid, tiles, i=i: self.
+                                     onCompareConverted(i, pyramid))
+            loader.failed.connect(self.onTaskFailed)
+            self.compareLoaders.append(loader)
+            loader.start()
+
+    def onCompareDecoded(self, i, image, metadata):
+        self.compareImages[i] = (image, metadata)
+
+    def onCompareConverted(self, i, pyramid):
+        image, metadata = self.compareImages[i]
+        viewer = ImageViewer(image, metadata, self.pixelStatus,
+                             self.zoomStatus, pyramid)
+        viewer.setHudVisible(self.hud)
+        viewer.setTone(self.tone)
+        self.compareViewers[i] = viewer
+        self.setPaneContent(self.comparePanes[i], viewer)
+        self.viewSync.add(viewer)
+        if i == 0:
+            self.showDifference()
+
+    def showDifference(self):
+        """Difference or ratio view of A and B, computed per visible
+        tile"""
+        mode = self.diffBox.currentData()
+        if mode is None or self.image is None \
+                or self.compareImages[0] is None:
+            self.setPaneVisible(self.diffPane, False)
+            return
+        try:
+            difference = DifferenceImage(self.image, self.compareImages[0][0],
+                                         mode)
+        except ValueError as e:
+            self.diffBox.setCurrentIndex(0)
+            QMessageBox.critical(self, "Error", str(e))
+            return
+        viewer = DifferenceViewer(difference, self.metadata,
+                                  self.pixelStatus, self.zoomStatus,
+                                  self.gainBox.value())
+        viewer.setHudVisible(self.hud)
+        self.viewSync.remove(self.diffPane.content)
+        self.setPaneContent(self.diffPane, viewer)
+        self.setPaneVisible(self.diffPane, True)
+        self.viewSync.add(viewer)
+
+    def onGainChanged(self, gain):
+        if isinstance(self.diffPane.content, DifferenceViewer):
+            self.diffPane.content.setGain(gain)
 
     def initFileInfoUI(self, tabFileInfo):
 
@@ -377,49 +4044,289 @@ class ImageDisplayer(QWidget):
         grouplayout = QVBoxLayout(groupbox)
         tabWidgetMeta = QTabWidget(groupbox)
 
-        tabFileInfo = QWidget(tabWidgetMeta)
-        tabExif = QWidget(tabWidgetMeta)
-        tabCalibrationData = QWidget(tabWidgetMeta)
-        tabCameraControl = QWidget(tabWidgetMeta)
-        tabLibRawParams = QWidget(tabWidgetMeta)
-
-        tabWidgetMeta.addTab(tabFileInfo, "FileInfo")
-        tabWidgetMeta.addTab(tabExif, "Exif")
-        tabWidgetMeta.addTab(tabCalibrationData, "CalibrationData")
-        tabWidgetMeta.addTab(tabCameraControl, "CameraControl")
-        tabWidgetMeta.addTab(tabLibRawParams, "LibRawParams")
-
-        self.initFileInfoUI(tabFileInfo)
-        self.initExifUI(tabExif)
-        self.initCalibrationDataUI(tabCalibrationData)
-        self.initCameraControlUI(tabCameraControl)
-        self.initLibRawParamsUI(tabLibRawParams)
+        # 只构建第一个页签，其余页签第一次切换过去时再构建
+        self.metadataTabs = []
+        for title, init, show in (
+            ("FileInfo", self.initFileInfoUI, self.showFileInfo),
+            ("Exif", self.initExifUI, self.showExif),
+            ("CalibrationData", self.initCalibrationDataUI,
+             self.showCalibrationData),
+            ("CameraControl", self.initCameraControlUI,
+             self.showCameraControls),
+            ("LibRawParams", self.initLibRawParamsUI, self.showLibRawParams),
+        ):
+            tab = QWidget(tabWidgetMeta)
+            tabWidgetMeta.addTab(tab, title)
+            self.metadataTabs.append([tab, init, show, False])
+        tabWidgetMeta.currentChanged.connect(self.buildMetadataTab)
+        self.buildMetadataTab(0)
 
         grouplayout.addWidget(tabWidgetMeta)
         groupbox.setLayout(grouplayout)
 
-        imv = pg.ImageView()
-        imv.ui.roiBtn.hide()
-        imv.ui.menuBtn.hide()
-        fileInfo = self.metadata.fileInfo.serialize()
-        imv.setImage(self.image,
-                     xvals=np.linspace(0., fileInfo['pixelPrecision'],
-                                       self.image.shape[0]))
-
-        hist = pg.HistogramLUTWidget(orientation='horizontal')
-        hist.setImageItem(imv.getImageItem())
-
-        groupboxHist = QGroupBox("Histogram", self.frame)
-        grouplayoutHist = QVBoxLayout(groupboxHist)
-        grouplayoutHist.addWidget(hist)
+        self.groupboxHist = QGroupBox("Histogram", self.frame)
+        self.grouplayoutHist = QVBoxLayout(self.groupboxHist)
 
         framelayout.addWidget(groupbox)
-        framelayout.addWidget(groupboxHist)
+        framelayout.addWidget(self.groupboxHist)
+        framelayout.addWidget(self.initLevelsUI())
+        framelayout.addWidget(self.initClippingUI())
+        framelayout.addWidget(self.initStatisticsUI())
         self.frame.setLayout(framelayout)
 
+    def initLevelsUI(self):
+        """Black point, white point, gamma and false color of the main
+        view"""
+        groupbox = QGroupBox("Levels", self.frame)
+        grid = QGridLayout(groupbox)
+        self.blackBox = QSpinBox(groupbox)
+        self.whiteBox = QSpinBox(groupbox)
+        for box, value in ((self.blackBox, 0), (self.whiteBox, 255)):
+            box.setRange(0, 255)
+            box.setValue(value)
+            box.valueChanged.connect(self.onLevelsChanged)
+        self.gammaBox = QDoubleSpinBox(groupbox)
+        self.gammaBox.setRange(0.1, 10.0)
+        self.gammaBox.setSingleStep(0.05)
+        self.gammaBox.setValue(1.0)
+        self.gammaBox.valueChanged.connect(self.onLevelsChanged)
+        self.colormapBox = QComboBox(groupbox)
+        self.colormapBox.addItem("Gray", None)
+        for name in COLORMAPS:
+            self.colormapBox.addItem(name.capitalize(), name)
+        self.colormapBox.currentIndexChanged.connect(self.onLevelsChanged)
+        autoButton = QPushButton("Auto", groupbox)
+        autoButton.setToolTip("Black and white points at the 0.1% and "
+                              "99.9% percentiles of the histogram")
+        autoButton.clicked.connect(self.autoLevels)
+        resetButton = QPushButton("Reset", groupbox)
+        resetButton.clicked.connect(self.resetLevels)
+        grid.addWidget(QLabel("Black", groupbox), 0, 0)
+        grid.addWidget(self.blackBox, 0, 1)
+        grid.addWidget(QLabel("White", groupbox), 0, 2)
+        grid.addWidget(self.whiteBox, 0, 3)
+        grid.addWidget(QLabel("Gamma", groupbox), 1, 0)
+        grid.addWidget(self.gammaBox, 1, 1)
+        grid.addWidget(self.colormapBox, 1, 2, 1, 2)
+        grid.addWidget(autoButton, 2, 0, 1, 2)
+        grid.addWidget(resetButton, 2, 2, 1, 2)
+        return groupbox
+
+    def initClippingUI(self):
+        """Saturation, black crush and zebra layers over the image"""
+        groupbox = QGroupBox("Clipping", self.frame)
+        grid = QGridLayout(groupbox)
+        self.overlayBoxes = {}
+        for column, (layer, title, tip) in enumerate((
+            ('saturated', "Saturated", "Values at or above the white level"),
+            ('crushed', "Crushed", "Values at or below the black level"),
+            ('zebra', "Zebra", "Stripes over the values above the "
+             "threshold, in % of the black to white range"),
+        )):
+            box = QCheckBox(title, groupbox)
+            box.setToolTip(tip)
+            box.toggled.connect(self.applyOverlays)
+            grid.addWidget(box, 0, column)
+            self.overlayBoxes[layer] = box
+        self.zebraBox = QSpinBox(groupbox)
+        self.zebraBox.setRange(50, 100)
+        self.zebraBox.setValue(95)
+        self.zebraBox.setSuffix(" %")
+        self.zebraBox.valueChanged.connect(self.applyOverlays)
+        grid.addWidget(QLabel("Zebra above", groupbox), 1, 0)
+        grid.addWidget(self.zebraBox, 1, 1)
+        self.clippingLabel = QLabel(groupbox)
+        self.clippingLabel.hide()
+        grid.addWidget(self.clippingLabel, 2, 0, 1, 3)
+        return groupbox
+
+    def applyOverlays(self):
+        """Show the checked clipping layers on the image and plane views"""
+        if self.image is None or self.image_viewer is None:
+            return
+        layers = [
+            layer for layer, box in self.overlayBoxes.items()
+            if box.isChecked()
+        ]
+        zebra = self.zebraBox.value() / 100
+        if self.clipping is None or self.clipping[0] is not self.image \
+                or self.clipping[1].zebra != zebra:
+            self.clipping = (self.image,
+                             ClippingOverlay(self.metadata, self.image.dtype,
+                                             zebra))
+        for viewer in [self.image_viewer] + self.planeViewers:
+            if not sip.isdeleted(viewer):
+                viewer.setOverlay(self.clipping[1], layers)
+        self.clippingLabel.setVisible(bool(layers))
+        if layers:
+            self.showClippingCounts()
+
+    def showClippingCounts(self):
+        """Saturated and crushed pixels of the whole image, counted once per
+        image in the background"""
+        image = self.image
+        if self.clippingTotals is not None and self.clippingTotals[0] is image:
+            self.clippingLabel.setText(self.clippingTotals[1])
+            return
+        overlay = self.clipping[1]
+        self.clippingLabel.setText("Counting clipped pixels...")
+
+        def compute():
+            with profiler.span('clippingCounts'):
+                return clippingCounts(image, overlay.black, overlay.white)
+
+        def show(counts):
+            if self.image is not image:
+                return
+            saturated, crushed, total = counts
+            self.clippingTotals = (
+                image, "Saturated {} ({:.3f}%), crushed {} ({:.3f}%)".format(
+                    saturated, 100 * saturated / total, crushed,
+                    100 * crushed / total))
+            self.clippingLabel.setText(self.clippingTotals[1])
+
+        self.runInBackground(compute, done=show)
+
+    def levelsScale(self):
+        """Full scale of the shown image in native values"""
+        if self.metadata is None:
+            return 255
+        fileInfo = self.metadata.fileInfo
+        precision = fileInfo.pixelPrecision or (
+            8 if fileInfo.pixelRepresentation == PixelRepresentation.UINT8
+            else 16)
+        return 2**min(precision, 16) - 1
+
+    def updateLevelsRange(self):
+        """Spin box ranges in native values of the shown image, keeping
+        the levels relative to the full scale"""
+        full = self.levelsScale()
+        for box, value in ((self.blackBox, self.tone.black),
+                           (self.whiteBox, self.tone.white)):
+            box.blockSignals(True)
+            box.setRange(0, full)
+            box.setValue(round(value * full))
+            box.blockSignals(False)
+        self.updateLevelLines()
+
+    def onLevelsChanged(self):
+        full = self.levelsScale()
+        black, white = self.blackBox.value(), self.whiteBox.value()
+        self.tone = ToneMapping(black / full,
+                                max(white, black + 1) / full,
+                                self.gammaBox.value(),
+                                self.colormapBox.currentData())
+        for viewer in ([self.image_viewer] + self.compareViewers +
+                       self.planeViewers):
+            if viewer is not None and not sip.isdeleted(viewer):
+                viewer.setTone(self.tone)
+        self.updateLevelLines()
+
+    def setLevels(self, black, white):
+        for box, value in ((self.blackBox, black), (self.whiteBox, white)):
+            box.blockSignals(True)
+            box.setValue(int(round(value)))
+            box.blockSignals(False)
+        self.onLevelsChanged()
+
+    def autoLevels(self):
+        if self.histCounts is None:
+            return
+        total = np.cumsum(sum(
+            np.asarray(values, dtype=np.int64)
+            for values in self.histCounts.values()))
+        if not total[-1]:
+            return
+        black, white = np.searchsorted(total,
+                                       [total[-1] * 0.001, total[-1] * 0.999])
+        # 直方图的分级和原始值一一对应，浮点图像除外
+        scale = self.levelsScale() / max(len(total) - 1, 1)
+        self.setLevels(black * scale, max(white, black + 1) * scale)
+
+    def resetLevels(self):
+        self.gammaBox.blockSignals(True)
+        self.gammaBox.setValue(1.0)
+        self.gammaBox.blockSignals(False)
+        self.colormapBox.blockSignals(True)
+        self.colormapBox.setCurrentIndex(0)
+        self.colormapBox.blockSignals(False)
+        self.setLevels(0, self.levelsScale())
+
+    def updateLevelLines(self):
+        if self.histPlot is None:
+            return
+        for line, box in ((self.blackLine, self.blackBox),
+                          (self.whiteLine, self.whiteBox)):
+            line.blockSignals(True)
+            line.setValue(box.value())
+            line.blockSignals(False)
+
+    def onLevelLineMoved(self):
+        self.setLevels(max(self.blackLine.value(), 0),
+                       min(self.whiteLine.value(), self.levelsScale()))
+
+    def initStatisticsUI(self):
+        groupbox = QGroupBox("Statistics", self.frame)
+        grouplayout = QVBoxLayout(groupbox)
+        hbox = QHBoxLayout()
+        hbox.addWidget(QLabel("Window", groupbox))
+        self.windowBox = QSpinBox(groupbox)
+        self.windowBox.setRange(1, 255)
+        self.windowBox.setSingleStep(2)
+        self.windowBox.setValue(5)
+        self.windowBox.setSuffix(" px")
+        self.windowBox.valueChanged.connect(self.showStatistics)
+        hbox.addWidget(self.windowBox)
+        hbox.addStretch()
+        grouplayout.addLayout(hbox)
+        self.statsLabel = QLabel("Hover the image for statistics", groupbox)
+        self.statsLabel.setFont(
+            QFontDatabase.systemFont(QFontDatabase.SystemFont.FixedFont))
+        grouplayout.addWidget(self.statsLabel)
+        self.planeStatsLabel = QLabel(groupbox)
+        self.planeStatsLabel.setFont(self.statsLabel.font())
+        self.planeStatsLabel.hide()
+        grouplayout.addWidget(self.planeStatsLabel)
+        return groupbox
+
+    def buildMetadataTab(self, index):
+        entry = self.metadataTabs[index]
+        tab, init, show, built = entry
+        if built:
+            return
+        init(tab)
+        entry[3] = True
+        if self.metadata is not None:
+            show()
+
+    def initHistogramUI(self):
+        """Histogram plot, built on first use to keep pyqtgraph out of
+        startup"""
+        if self.histPlot is not None:
+            return
+        with profiler.span('import pyqtgraph'):
+            import pyqtgraph as pg  # 延迟导入，加快启动
+        self.histPlot = pg.PlotWidget(self.groupboxHist)
+        self.histPlot.addLegend()
+        # 拖动黑点和白点
+        self.blackLine = pg.InfiniteLine(angle=90,
+                                         movable=True,
+                                         pen=(200, 200, 200))
+        self.whiteLine = pg.InfiniteLine(angle=90,
+                                         movable=True,
+                                         pen=(255, 255, 255))
+        for line in (self.blackLine, self.whiteLine):
+            line.sigPositionChanged.connect(self.onLevelLineMoved)
+        self.histLabel = QLabel("Shift+drag on the image to select a region",
+                                self.groupboxHist)
+        self.grouplayoutHist.addWidget(self.histPlot)
+        self.grouplayoutHist.addWidget(self.histLabel)
+
     def initUI(self):
-        self.initImageViewUI()
-        self.initMetadataUI()
+        with profiler.span('ImageDisplayer.initImageViewUI'):
+            self.initImageViewUI()
+        with profiler.span('ImageDisplayer.initMetadataUI'):
+            self.initMetadataUI()
 
         hbox = QHBoxLayout()
 
@@ -434,14 +4341,168 @@ class ImageDisplayer(QWidget):
         self.setLayout(vbox)
         self.setWindowTitle('Image Displayer')
 
-    def showImage(self):
-        self.image_viewer = ImageViewer(self.image, self.metadata,
-                                        self.pixelStatus, self.zoomStatus)
+    def showHistogram(self, rect=None):
+        """Plot a subsampled histogram at once, then the exact one computed
+        in the background, over the whole image or the region `rect`"""
+        if self.image is None:
+            return
+        engine = HistogramEngine(self.image, self.metadata)
+        if rect is None:
+            region = "Full image"
+            step = engine.quickStep()
+            if step > 1:
+                with profiler.span('histogram subsampled', step=step):
+                    counts = engine.compute(step=step)
+                self.plotHistogram(counts,
+                                   "{}, subsampled 1/{}".format(region, step))
+        else:
+            top, left, bottom, right = rect
+            region = "Region x = {}, y = {}, {} x {}".format(
+                left, top, right - left, bottom - top)
+        image = self.image
+
+        def compute():
+            with profiler.span('histogram exact'):
+                return engine.compute(rect)
+
+        def show(counts):
+            if self.image is not image:
+                return
+            self.plotHistogram(counts, region)
+            if rect is not None and rect == self.statsRect:
+                self.statsExtrema = IntegralStats.histogramExtrema(
+                    counts, engine.bins, engine.integer)
+                self.showStatistics()
+
+        self.runInBackground(compute, done=show)
+
+    def buildStatistics(self):
+        """Integral images of the shown image, built in the background"""
+        if self.statsEngine is not None:
+            self.statsEngine.cancel()
+        engine = IntegralStats(self.image, self.metadata)
+        self.statsEngine = engine
+        self.statsRect = None
+        self.statsExtrema = None
+
+        def done(_):
+            if self.statsEngine is engine:
+                self.showStatistics()
+
+        self.runInBackground(engine.build, done=done)
+
+    def onPixelHovered(self, x, y):
+        self.hoverPos = (x, y)
+        if self.statsRect is None:
+            self.showStatistics()
+
+    def onRoiSelected(self, rect):
+        self.statsRect = rect
+        self.statsExtrema = None
+        self.showStatistics()
+
+    def showStatistics(self):
+        """Mean, std, min and max per channel over the selected region, or
+        the window around the hovered pixel"""
+        engine = self.statsEngine
+        if engine is None or engine.image is not self.image:
+            return
+        if self.statsRect is not None:
+            rect = top, left, bottom, right = self.statsRect
+            title = "Region x = {}, y = {}, {} x {}".format(
+                left, top, right - left, bottom - top)
+            # 区域的极值来自后台计算的直方图
+            extrema = self.statsExtrema
+        elif self.hoverPos is not None:
+            x, y = self.hoverPos
+            half = self.windowBox.value() // 2
+            rect = top, left, bottom, right = (max(y - half, 0),
+                                               max(x - half, 0), y + half + 1,
+                                               x + half + 1)
+            title = "Window {0} x {0} at x = {1}, y = {2}".format(
+                2 * half + 1, x, y)
+            extrema = engine.extrema(rect)
+        else:
+            return
+        if not engine.tables and (bottom - top) * (right - left) > 2**16:
+            self.statsLabel.setText(
+                "{}\nBuilding integral images...".format(title))
+            return
+        lines = [
+            title, "{:<4}{:>9}{:>10}{:>10}{:>8}{:>8}".format(
+                '', 'n', 'mean', 'std', 'min', 'max')
+        ]
+        for channel, moments in engine.stats(rect).items():
+            if moments is None:
+                continue
+            low, high = (extrema or {}).get(channel) or ('...', '...')
+            lines.append("{:<4}{:>9}{:>10.4g}{:>10.4g}{:>8}{:>8}".format(
+                channel, moments[0], moments[1], moments[2],
+                self.formatValue(low), self.formatValue(high)))
+        self.statsLabel.setText("\n".join(lines))
+
+    @staticmethod
+    def formatValue(value):
+        if isinstance(value, (float, np.floating)):
+            return "{:.4g}".format(value)
+        return str(value)
+
+    def plotHistogram(self, counts, text):
+        self.initHistogramUI()
+        with profiler.span('pyqtgraph plot'):
+            self.histPlot.clear()
+            for channel, values in counts.items():
+                self.histPlot.plot(np.arange(len(values) + 1),
+                                   values,
+                                   stepMode='center',
+                                   pen=HISTOGRAM_PENS.get(channel, 'w'),
+                                   name=channel)
+            self.histPlot.addItem(self.blackLine, ignoreBounds=True)
+            self.histPlot.addItem(self.whiteLine, ignoreBounds=True)
+        self.histCounts = counts
+        self.histLabel.setText(text)
+        self.updateLevelLines()
+
+    def showImage(self,
+                  pyramid=None,
+                  tiles=None,
+                  tile_cache=None,
+                  metadata=None):
+        """Show the image, or a preview with its own `metadata`"""
+        if metadata is None:
+            metadata = self.metadata
+        self.updateLevelsRange()
+        if self.keepView and self.image_viewer is not None:
+            self.image_viewer.setImage(self.image, pyramid, tiles, tile_cache,
+                                       metadata)
+            return
+        self.image_viewer = ImageViewer(self.image, metadata,
+                                        self.pixelStatus, self.zoomStatus,
+                                        pyramid, tiles, tile_cache)
+        self.image_viewer.pixelsShown.connect(self.onPixelsShown)
+        self.image_viewer.setTone(self.tone)
+        self.image_viewer.roiSelected.connect(self.showHistogram)
+        self.image_viewer.roiSelected.connect(self.onRoiSelected)
+        self.image_viewer.pixelHovered.connect(self.onPixelHovered)
+        self.image_viewer.setHudVisible(self.hud)
         self.imageArea.setWidget(self.image_viewer)
         self.imageArea.setWidgetResizable(True)
+        if self.compare_paths:
+            self.viewSync.add(self.image_viewer)
         self.tabWidget.setCurrentIndex(0)
 
+    def clearMetadata(self):
+        for name, widget in vars(self).items():
+            if name.startswith('lab') and name.endswith('Value'):
+                widget.clear()
+
     def showMetadata(self):
+        self.clearMetadata()
+        for tab, init, show, built in self.metadataTabs:
+            if built:
+                show()
+
+    def showFileInfo(self):
         fileInfo = self.metadata.fileInfo.serialize()
         if 'fileFormat' in fileInfo:
             self.labfileFormatValue.setText(fileInfo['fileFormat'])
@@ -468,6 +4529,7 @@ class ImageDisplayer(QWidget):
         if 'sizeAlignment' in fileInfo:
             self.labsizeAlignmentValue.setText(str(fileInfo['sizeAlignment']))
 
+    def showExif(self):
         exifMetadata = self.metadata.exifMetadata.serialize()
         if 'imageWidth' in exifMetadata:
             self.labimageWidthValue.setText(str(exifMetadata['imageWidth']))
@@ -509,6 +4571,7 @@ class ImageDisplayer(QWidget):
             self.labfocalLengthIn35mmFilmValue.setText(
                 str(exifMetadata['focalLengthIn35mmFilm']))
 
+    def showCalibrationData(self):
         calibrationData = self.metadata.calibrationData.serialize()
         if 'blackLevel' in calibrationData:
             self.labblackLevelValue.setText(str(calibrationData['blackLevel']))
@@ -519,12 +4582,14 @@ class ImageDisplayer(QWidget):
                 str(calibrationData['colorMatrix']))
             self.labcolorMatrixValue.setWordWrap(True)
 
+    def showCameraControls(self):
         cameraControls = self.metadata.cameraControls.serialize()
         if 'whiteBalance' in cameraControls:
             self.labwhiteBalanceValue.setText(
                 str(cameraControls['whiteBalance']))
             self.labwhiteBalanceValue.setWordWrap(True)
 
+    def showLibRawParams(self):
         if hasattr(self.metadata, "libRawParameters") and self.metadata.libRawParameters:
             libRawParams = self.metadata.libRawParameters.__dict__
             if 'rawWidth' in libRawParams:
@@ -544,6 +4609,903 @@ class ImageDisplayer(QWidget):
                     libRawParams['leftMargin']))
 
 
+class SequencePlayer(QWidget):
+    """Play a burst of RAW frames at a target frame rate.
+
+    SequenceDecoder threads fill a FrameRing ahead of the display. Each tick
+    of the timer shows the newest frame due at the current time, so when
+    the disk or the decoders are too slow frames are dropped and the
+    playback keeps its pace. The slider scrubs, `Space` pauses and the
+    arrow keys step frame by frame. The status line shows the sustained
+    shown and decoded frame rates over the last second.
+    """
+
+    def __init__(self,
+                 image_paths,
+                 metadata_path=None,
+                 fps=30.0,
+                 step=None,
+                 ring_frames=8,
+                 decoders=2,
+                 hud=False):
+        super().__init__()
+        self.sequence = FrameSequence(image_paths, metadata_path, step)
+        self.fps = fps
+        # 每个解码线程一个槽，另外至少一帧在显示、一帧等待显示
+        self.ring = FrameRing(max(ring_frames, decoders + 2),
+                              self.sequence.shape, self.sequence.dtype)
+        self.current = None
+        self.last_index = None
+        self.position = 0
+        self.playing = True
+        # 播放时钟 (开始时间, 开始帧)，seek 之后等到那一帧显示时才开始
+        self.clock = None
+        self.play_time = 0.0
+        self.shown = 0
+        self.dropped = 0
+        self.samples = collections.deque()
+        self.rate_time = 0.0
+        self.hud = hud
+        self.initUI()
+        self.decoders = []
+        for _ in range(decoders):
+            decoder = SequenceDecoder(self.sequence, self.ring, self)
+            decoder.failed.connect(self.onDecodeFailed)
+            self.decoders.append(decoder)
+            decoder.start()
+        self.timer = QTimer(self)
+        self.timer.setTimerType(Qt.TimerType.PreciseTimer)
+        self.timer.timeout.connect(self.tick)
+        self.timer.start(self.tickInterval())
+
+    def initUI(self):
+        self.pixelStatus = QLabel("Click pixel to display value", self)
+        self.zoomStatus = QLabel("Zoom factor: 100%", self)
+        self.viewer = SequenceViewer(self.sequence, self.pixelStatus,
+                                     self.zoomStatus)
+        self.viewer.setHudVisible(self.hud)
+        self.playButton = QPushButton("Pause", self)
+        self.playButton.setFocusPolicy(Qt.FocusPolicy.NoFocus)
+        self.playButton.clicked.connect(self.togglePlay)
+        self.slider = QSlider(Qt.Orientation.Horizontal, self)
+        self.slider.setFocusPolicy(Qt.FocusPolicy.NoFocus)
+        self.slider.setRange(0, len(self.sequence) - 1)
+        self.slider.valueChanged.connect(self.seek)
+        self.slider.sliderReleased.connect(self.onSliderReleased)
+        self.fpsBox = QDoubleSpinBox(self)
+        self.fpsBox.setRange(0.1, 1000)
+        self.fpsBox.setValue(self.fps)
+        self.fpsBox.setSuffix(" fps")
+        self.fpsBox.valueChanged.connect(self.onFpsChanged)
+        self.rateStatus = QLabel(self)
+        QShortcut(QKeySequence(Qt.Key.Key_Space), self, self.togglePlay)
+        QShortcut(QKeySequence(Qt.Key.Key_Left), self,
+                  lambda: self.stepFrame(-1))
+        QShortcut(QKeySequence(Qt.Key.Key_Right), self,
+                  lambda: self.stepFrame(1))
+        QShortcut(QKeySequence(Qt.Key.Key_F12), self, self.toggleHud)
+
+        hboxPlay = QHBoxLayout()
+        hboxPlay.addWidget(self.playButton)
+        hboxPlay.addWidget(self.slider)
+        hboxStatus = QHBoxLayout()
+        hboxStatus.addWidget(self.pixelStatus)
+        hboxStatus.addWidget(self.zoomStatus)
+        hboxStatus.addStretch()
+        hboxStatus.addWidget(self.rateStatus)
+        hboxStatus.addWidget(self.fpsBox)
+        vbox = QVBoxLayout(self)
+        vbox.addWidget(self.viewer)
+        vbox.addLayout(hboxPlay)
+        vbox.addLayout(hboxStatus)
+        self.setWindowTitle('Image Displayer - {} frames, 1/{}'.format(
+            len(self.sequence), self.sequence.step))
+
+    def tickInterval(self):
+        # 每帧至少检查两次，减少显示时刻的抖动
+        return max(1, int(500 / self.fps))
+
+    def clockRunning(self):
+        return self.playing and not self.slider.isSliderDown()
+
+    def dueIndex(self):
+        if not self.clockRunning() or self.clock is None:
+            return self.position
+        start, index = self.clock
+        return index + int((time.perf_counter() - start) * self.fps)
+
+    def startClock(self):
+        self.stopClock()
+        self.clock = (time.perf_counter(), self.position)
+
+    def stopClock(self):
+        if self.clock is not None:
+            self.play_time += time.perf_counter() - self.clock[0]
+            self.clock = None
+
+    def tick(self):
+        frame = self.ring.take(self.dueIndex())
+        if frame is not None:
+            self.showFrame(*frame)
+        self.updateRate()
+
+    def showFrame(self, index, slot):
+        with profiler.span('show frame', index=index):
+            shown = self.viewer.showFrame(self.ring.buffers[slot],
+                                          index % len(self.sequence))
+        if not shown:
+            self.ring.release(slot)
+            self.setPlaying(False)
+            return
+        # 上一帧的缓冲区不再被显示，交还给解码线程
+        if self.current is not None:
+            self.ring.release(self.current)
+        else:
+            self.viewer.fit()
+        self.current = slot
+        if self.clockRunning():
+            if self.clock is None:
+                self.clock = (time.perf_counter(), index)
+            elif self.last_index is not None and index > self.last_index:
+                self.dropped += index - self.last_index - 1
+            self.shown += 1
+        self.last_index = index
+        self.position = index
+        self.slider.blockSignals(True)
+        self.slider.setValue(index % len(self.sequence))
+        self.slider.blockSignals(False)
+
+    def updateRate(self):
+        now = time.perf_counter()
+        self.samples.append((now, self.shown, self.ring.decoded))
+        while now - self.samples[0][0] > 1.0:
+            self.samples.popleft()
+        if now - self.rate_time < 0.25:
+            return
+        self.rate_time = now
+        start, shown, decoded = self.samples[0]
+        if now <= start:
+            return
+        decodeRate = (self.ring.decoded - decoded) / (now - start)
+        self.rateStatus.setText(
+            "Frame {}/{}  {:.1f} fps shown, {:.1f} frames/s ({:.0f} MB/s) "
+            "decoded, {} dropped".format(
+                self.position % len(self.sequence) + 1, len(self.sequence),
+                (self.shown - shown) / (now - start), decodeRate,
+                decodeRate * self.ring.buffers[0].nbytes / 2**20,
+                self.dropped))
+
+    def setPlaying(self, playing):
+        self.stopClock()
+        self.playing = playing
+        if playing:
+            self.startClock()
+        self.playButton.setText("Pause" if playing else "Play")
+
+    def togglePlay(self):
+        self.setPlaying(not self.playing)
+
+    def seek(self, index):
+        """Show frame `index` next, dropping the frames decoded ahead"""
+        self.stopClock()
+        self.position = index
+        self.last_index = None
+        self.ring.seek(index)
+
+    def onSliderReleased(self):
+        if self.playing:
+            self.startClock()
+
+    def stepFrame(self, delta):
+        self.setPlaying(False)
+        if delta > 0:
+            # 后面的帧多半已经解码好了
+            self.position += delta
+        else:
+            self.seek((self.position + delta) % len(self.sequence))
+
+    def onFpsChanged(self, fps):
+        self.fps = fps
+        if self.clockRunning():
+            self.startClock()
+        self.timer.setInterval(self.tickInterval())
+
+    def toggleHud(self):
+        self.hud = not self.hud
+        self.viewer.setHudVisible(self.hud)
+
+    def onDecodeFailed(self, message):
+        self.setPlaying(False)
+        QMessageBox.critical(self, "Error", message)
+
+    def summary(self):
+        """Frames shown while playing, over the time spent playing"""
+        elapsed = self.play_time
+        if self.clock is not None:
+            elapsed += time.perf_counter() - self.clock[0]
+        return ("Played {} frames in {:.1f} s: {:.1f} fps shown of {:g} fps, "
+                "{} dropped, {} frames decoded".format(
+                    self.shown, elapsed, self.shown / elapsed if elapsed else 0,
+                    self.fps, self.dropped, self.ring.decoded))
+
+    def closeEvent(self, event):
+        if not self.ring.closed:
+            self.timer.stop()
+            self.ring.close()
+            for decoder in self.decoders:
+                decoder.wait()
+            if self.shown:
+                print(self.summary())
+        super().closeEvent(event)
+
+
+def instanceName():
+    """Local socket of the resident process, one per user"""
+    return 'display-image-{}'.format(getpass.getuser())
+
+
+def instanceLock(timeout=10000):
+    """Locked QLockFile serialising the --single-instance launches, held
+    from looking for the resident process until listening in its place, so
+    that two launches at once do not both become resident"""
+    from PyQt6.QtCore import QDir, QLockFile
+    lock = QLockFile(
+        os.path.join(QDir.tempPath(), instanceName() + '.lock'))
+    if not lock.tryLock(timeout):
+        raise RuntimeError(
+            'Another display-image is starting, {} is locked'.format(
+                lock.fileName()))
+    return lock
+
+
+def connectToInstance(timeout=500):
+    """QLocalSocket connected to the resident process, None when no process
+    is listening"""
+    from PyQt6.QtNetwork import QLocalSocket
+    socket = QLocalSocket()
+    socket.connectToServer(instanceName())
+    if not socket.waitForConnected(timeout):
+        return None
+    return socket
+
+
+def parseInstanceRequest(line):
+    """(argv, cwd) of a request sent by forwardToInstance, ValueError when
+    it is malformed"""
+    try:
+        request = json.loads(line)
+        argv, cwd = request['argv'], request['cwd']
+    except (ValueError, KeyError, TypeError) as e:
+        # 包括不是 JSON 或不是 UTF-8 的数据
+        raise ValueError('Malformed request: {}'.format(e)) from e
+    if not isinstance(cwd, str) or not isinstance(argv, list) or not all(
+            isinstance(arg, str) for arg in argv):
+        raise ValueError('Malformed request: argv must be a list of strings '
+                         'and cwd a string')
+    return argv, cwd
+
+
+def forwardToInstance(argv):
+    """Send a command line to the resident process.
+
+    Returns its reply, an empty string once the tab is opened or the error
+    message, or None when no process is listening.
+    """
+    socket = connectToInstance()
+    if socket is None:
+        return None
+    request = {'argv': argv, 'cwd': os.getcwd()}
+    socket.write(json.dumps(request).encode() + b'\n')
+    reply = bytearray()
+    while b'\n' not in reply and socket.waitForReadyRead(10000):
+        reply.extend(socket.readAll().data())
+    socket.disconnectFromServer()
+    if b'\n' not in reply:
+        return 'No reply from the running display-image'
+    return reply.split(b'\n')[0].decode()
+
+
+class InstanceWindow(QTabWidget):
+    """Window of the resident process of ``--single-instance``, one tab per
+    command line.
+
+    Later invocations send their command line to the local socket named by
+    instanceName() and exit, the image opens in a new tab. The decode
+    processes, the preview cache and one ImageCache are shared by the tabs,
+    so an image already viewed shows at once. Raises RuntimeError when
+    another process already listens on the socket.
+    """
+
+    # 一行请求的上限，防止没有换行的连接一直占用内存
+    max_request_bytes = 1024 * 1024
+
+    def __init__(self, preview_cache, cache_bytes):
+        super().__init__()
+        from PyQt6.QtNetwork import QLocalServer
+        self.preview_cache = preview_cache
+        self.cache = ImageCache(cache_bytes)
+        self.setWindowTitle('Image Displayer')
+        self.setDocumentMode(True)
+        self.setTabsClosable(True)
+        self.tabCloseRequested.connect(self.closeTab)
+        self.server = QLocalServer(self)
+        self.server.newConnection.connect(self.onNewConnection)
+        if not self.server.listen(instanceName()):
+            socket = connectToInstance(2000)
+            if socket is not None:
+                # 常驻进程还在，不能抢走它的套接字
+                socket.abort()
+                raise RuntimeError(
+                    'Another display-image is listening on {}'.format(
+                        instanceName()))
+            # 上次异常退出留下的套接字文件
+            QLocalServer.removeServer(instanceName())
+            if not self.server.listen(instanceName()):
+                raise RuntimeError('Unable to listen on {}: {}'.format(
+                    instanceName(), self.server.errorString()))
+
+    def addDisplayer(self, displayer, args):
+        index = self.addTab(displayer, pathlib.Path(args.image).name)
+        self.setTabToolTip(index, args.image)
+        self.setCurrentIndex(index)
+        if isinstance(displayer, ImageDisplayer):
+            displayer.openIndex(0)
+
+    def onNewConnection(self):
+        socket = self.server.nextPendingConnection()
+        received = bytearray()
+
+        def onReadyRead():
+            received.extend(socket.readAll().data())
+            if b'\n' not in received:
+                if len(received) > self.max_request_bytes:
+                    socket.abort()
+                return
+            try:
+                argv, cwd = parseInstanceRequest(received.split(b'\n')[0])
+            except ValueError as e:
+                reply = str(e)
+            else:
+                reply = self.openCommandLine(argv, cwd)
+            socket.write(reply.encode() + b'\n')
+            socket.disconnectFromServer()
+
+        socket.readyRead.connect(onReadyRead)
+        socket.disconnected.connect(socket.deleteLater)
+
+    def openCommandLine(self, argv, cwd):
+        """Open a tab for a forwarded command line, returns the error message
+        or an empty string"""
+        try:
+            args = parse_command_line(argv)
+            # 相对路径相对于发送命令的进程
+            args.image = os.path.join(cwd, args.image)
+            if args.metadata:
+                args.metadata = os.path.join(cwd, args.metadata)
+            args.compare = [os.path.join(cwd, path) for path in args.compare]
+            displayer = createDisplayer(args, checkedPaths(args),
+                                        self.preview_cache, self.cache)
+        except (Exception, SystemExit) as e:
+            return str(e) or 'Invalid command line {}'.format(' '.join(argv))
+        self.addDisplayer(displayer, args)
+        self.showNormal()
+        self.raise_()
+        self.activateWindow()
+        return ''
+
+    def closeTab(self, index):
+        displayer = self.widget(index)
+        self.removeTab(index)
+        displayer.close()
+        displayer.deleteLater()
+        if self.count() == 0:
+            self.close()
+
+    def closeEvent(self, event):
+        self.server.close()
+        for index in range(self.count()):
+            self.widget(index).close()
+        super().closeEvent(event)
+
+
+def resizeImage(img, height, width):
+    """Bilinear resize, used to reach the exact preview size from the
+    pyramid level just above it"""
+    if img.shape[:2] == (height, width):
+        return img
+
+    def axis(size, target):
+        position = np.clip((np.arange(target) + 0.5) * size / target - 0.5, 0,
+                           size - 1)
+        first = np.floor(position).astype(np.intp)
+        last = np.minimum(first + 1, size - 1)
+        return first, last, (position - first).astype(np.float32)
+
+    y0, y1, wy = axis(img.shape[0], height)
+    x0, x1, wx = axis(img.shape[1], width)
+    shape = (-1, 1) + (1, ) * (img.ndim - 2)
+    wy, wx = wy.reshape(shape), wx.reshape((1, -1) + shape[2:])
+    top = img[y0].astype(np.float32)
+    bottom = img[y1].astype(np.float32)
+    rows = top + (bottom - top) * wy
+    out = rows[:, x0] + (rows[:, x1] - rows[:, x0]) * wx
+    return np.round(out).astype(img.dtype)
+
+
+def bayerPreview(image, metadata, mode, size):
+    """8 bit RGB preview of a Bayer mosaic no larger than `size`.
+
+    Each CFA plane is reduced through its own pyramid before demosaicing,
+    so large mosaics are never demosaiced at full resolution.
+    """
+    offsets = BAYER_OFFSETS[metadata.fileInfo.pixelType]
+    rows, cols = image.shape[0] // 2, image.shape[1] // 2
+    # binned 本身就缩小一半
+    target = size if mode == 'binned' else size // 2
+    n = 0
+    while max(rows, cols) >> (n + 1) >= target:
+        n += 1
+    if n == 0:
+        return BayerDemosaic(metadata).preview(image, mode)[0]
+    planes = {
+        channel: ImagePyramid(np.asarray(image[dy::2, dx::2])).level(n)
+        for channel, (dy, dx) in offsets.items()
+    }
+    height, width = planes['R'].shape
+    mosaic = np.empty((height * 2, width * 2), dtype=planes['R'].dtype)
+    for channel, (dy, dx) in offsets.items():
+        mosaic[dy::2, dx::2] = planes[channel]
+    return BayerDemosaic(metadata).preview(mosaic, mode)[0]
+
+
+def renderPreview(image_path, output_dir, options):
+    """Decode one image and write its preview and sidecars, for the batch
+    worker processes. Returns the written paths."""
+    image_path = pathlib.Path(image_path)
+    try:
+        image = openRawFile(image_path)
+        if image is not None:
+            metadata = image.metadata
+        else:
+            image, metadata = read_image(image_path)
+    except SystemExit as e:
+        # read_image 出错时会调用 sys.exit
+        raise RuntimeError(str(e)) from None
+    fileInfo = metadata.fileInfo
+    size = options.size
+    if fileInfo.pixelType in BAYER_TYPES and options.demosaic in (
+            BayerDemosaic.modes):
+        preview = bayerPreview(image, metadata, options.demosaic, size)
+        pixelType = PixelType.RGB
+    else:
+        pyramid = ImagePyramid(image)
+        n = 0
+        while max(pyramid.rows, pyramid.cols) >> (n + 1) >= size:
+            n += 1
+        preview = ImageConverter().toUint8(pyramid.level(n), metadata)
+        pixelType = fileInfo.pixelType
+        if pixelType in BAYER_TYPES:
+            pixelType = PixelType.GRAYSCALE
+        elif pixelType == PixelType.RGBA:
+            # JPEG 不支持透明通道
+            preview, pixelType = preview[..., :3], PixelType.RGB
+    scale = min(1.0, size / max(preview.shape[:2]))
+    preview = resizeImage(preview, max(1, round(preview.shape[0] * scale)),
+                          max(1, round(preview.shape[1] * scale)))
+
+    output_dir = pathlib.Path(output_dir)
+    written = []
+    preview_metadata = displayMetadata(pixelType, PixelRepresentation.UINT8,
+                                       8)
+    preview_metadata.fileInfo.width = preview.shape[1]
+    preview_metadata.fileInfo.height = preview.shape[0]
+    preview_metadata.fileInfo.imageLayout = ImageLayout.INTERLEAVED if (
+        preview.ndim == 3) else ImageLayout.PLANAR
+    writeOptions = ImageWriter.Options(preview_metadata)
+    writeOptions.jpegQuality = options.quality
+    output = output_dir / '{}.{}'.format(image_path.name, options.format)
+    write_image(output, np.ascontiguousarray(preview), writeOptions)
+    written.append(output)
+    if options.histogram:
+        engine = HistogramEngine(image, metadata)
+        output = output_dir / '{}.histogram.json'.format(image_path.name)
+        with open(output, 'w') as f:
+            json.dump(
+                {
+                    'bins': engine.bins,
+                    'channels': {
+                        channel: counts.tolist()
+                        for channel, counts in engine.compute().items()
+                    }
+                }, f)
+        written.append(output)
+    if options.metadata:
+        output = output_dir / '{}.metadata.json'.format(image_path.name)
+        with open(output, 'w') as f:
+            json.dump(serializeMetadata(metadata), f, indent=4)
+        written.append(output)
+    return written
+
+
+def parse_batch_command_line(argv):
+    parser = argparse.ArgumentParser(
+        description='Render previews of many images without a window.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('inputs',
+                        nargs='+',
+                        help='Image files, directories or glob patterns.')
+    parser.add_argument('-o',
+                        '--output',
+                        required=True,
+                        help='Directory receiving the previews, named after '
+                        'the input file, e.g. shot.plain16.jpg.')
+    parser.add_argument('--size',
+                        type=int,
+                        default=512,
+                        help='Longest edge of the previews in pixels.')
+    parser.add_argument('--format', choices=['jpg', 'png'], default='jpg')
+    parser.add_argument('--quality',
+                        type=int,
+                        default=90,
+                        help='JPEG quality.')
+    parser.add_argument('--demosaic',
+                        choices=['raw', 'binned', 'bilinear'],
+                        default='binned',
+                        help='Rendering of Bayer images.')
+    parser.add_argument('--histogram',
+                        action='store_true',
+                        help='Also write the exact per-channel histogram as '
+                        '<name>.histogram.json.')
+    parser.add_argument('--metadata',
+                        action='store_true',
+                        help='Also write the image metadata as '
+                        '<name>.metadata.json.')
+    parser.add_argument('-j',
+                        '--workers',
+                        type=int,
+                        default=os.cpu_count(),
+                        help='Number of worker processes.')
+    return parser.parse_args(argv)
+
+
+def batch_main():
+    """Entry point of display-image-batch. No QApplication is created, the
+    previews are rendered with numpy and written by cxx_image_io."""
+    args = parse_batch_command_line(sys.argv[1:])
+    image_paths = [p for pattern in args.inputs
+                   for p in collectImagePaths(pattern)]
+    if not image_paths:
+        sys.exit('No image found in {}'.format(' '.join(args.inputs)))
+    output_dir = pathlib.Path(args.output)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    start = time.perf_counter()
+    failed = 0
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=args.workers,
+            mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = {
+            pool.submit(renderPreview, path, output_dir, args): path
+            for path in image_paths
+        }
+        for done, future in enumerate(
+                concurrent.futures.as_completed(futures), 1):
+            try:
+                future.result()
+            except Exception as e:
+                failed += 1
+                print('{}: {}'.format(futures[future], e), file=sys.stderr)
+            if done % 100 == 0 or done == len(futures):
+                elapsed = time.perf_counter() - start
+                print('{}/{} files, {:.1f} files/s'.format(
+                    done, len(futures), done / elapsed))
+    elapsed = time.perf_counter() - start
+    print('Rendered {} files in {:.1f} s ({:.1f} files/s), {} failed'.format(
+        len(image_paths) - failed, elapsed,
+        len(image_paths) / elapsed, failed))
+    sys.exit(1 if failed else 0)
+
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# 颜色类型 0、2、6；调色板 (3) 和灰度加 alpha (4) 按 read_image 解码
+PNG_LAYOUTS = {
+    0: (PixelType.GRAYSCALE, ImageLayout.PLANAR),
+    2: (PixelType.RGB, ImageLayout.INTERLEAVED),
+    6: (PixelType.RGBA, ImageLayout.INTERLEAVED),
+}
+BMP_LAYOUTS = {
+    8: (PixelType.GRAYSCALE, ImageLayout.PLANAR),
+    24: (PixelType.RGB, ImageLayout.INTERLEAVED),
+    32: (PixelType.RGBA, ImageLayout.INTERLEAVED),
+}
+# TIFF 的 CFAPattern，0、1、2 分别是 R、G、B
+CFA_PIXEL_TYPES = {
+    (0, 1, 1, 2): PixelType.BAYER_RGGB,
+    (1, 0, 2, 1): PixelType.BAYER_GRBG,
+    (2, 1, 1, 0): PixelType.BAYER_BGGR,
+    (1, 2, 0, 1): PixelType.BAYER_GBRG,
+}
+HEADER_EXT = {'.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.dng'}
+
+
+def headerFileInfo(data):
+    """(width, height, pixelType, imageLayout, pixelPrecision) that read_image
+    reports for a JPEG, PNG, BMP, TIFF or DNG, parsed from its header. None
+    for the files and layouts not listed here"""
+    if data[:8] == PNG_SIGNATURE and data[12:16] == b'IHDR':
+        width, height, depth, color = struct.unpack('>IIBB', data[16:26])
+        if color not in PNG_LAYOUTS or depth not in (8, 16):
+            return None
+        return (width, height) + PNG_LAYOUTS[color] + (depth,)
+    if data[:3] == JPEG_SOI:
+        frame = jpegFrame(data, 0)
+        if frame is None:
+            return None
+        width, height, pos = frame
+        # EXIF 方向不影响 read_image 返回的尺寸
+        layout = {1: (PixelType.GRAYSCALE, ImageLayout.PLANAR),
+                  3: (PixelType.RGB, ImageLayout.INTERLEAVED)}.get(data[pos + 9])
+        if layout is None or data[pos + 4] != 8:
+            return None
+        return (width, height) + layout + (8,)
+    if data[:2] == b'BM':
+        width, height = struct.unpack('<ii', data[18:26])
+        bits, compression = struct.unpack('<HI', data[28:34])
+        if compression != 0 or bits not in BMP_LAYOUTS:
+            return None
+        return (width, abs(height)) + BMP_LAYOUTS[bits] + (8,)
+    tags = tiffDirectory(data)
+    if tags is None:
+        return None
+
+    def tag(key, default=None):
+        return tags.get(key, (default,))[0]
+
+    # 只接受 cxx_image_io 读得出的基本布局：SamplesPerPixel 必须存在，
+    # 没有 SampleFormat，按像素交错存储
+    bits = set(tags.get(0x0102, (1,)))
+    if (0x0115 not in tags or 0x0153 in tags or tag(0x011C, 1) != 1
+            or len(bits) != 1 or not bits & {8, 16}):
+        return None
+    samples, photometric = tag(0x0115), tag(0x0106)
+    if samples == 1 and photometric == 1:
+        layout = (PixelType.GRAYSCALE, ImageLayout.PLANAR)
+    elif samples == 3 and photometric == 2:
+        layout = (PixelType.RGB, ImageLayout.INTERLEAVED)
+    elif (samples == 1 and photometric == 32803
+          and tags.get(0x828D, (2, 2)) == (2, 2)
+          and tags.get(0x828E) in CFA_PIXEL_TYPES):
+        layout = (CFA_PIXEL_TYPES[tags[0x828E]], ImageLayout.PLANAR)
+    else:
+        return None
+    return (tag(0x0100), tag(0x0101)) + layout + (bits.pop(),)
+
+
+def readHeader(image_path, metadata_path=None):
+    """Metadata that read_image reports for a JPEG, PNG, BMP, TIFF or DNG,
+    read from its headers without decoding the pixels. None for the layouts
+    headerFileInfo does not know or when the header readers of cxx_image_io
+    are not available"""
+    if image_path.suffix.lower() not in HEADER_EXT:
+        return None
+    try:
+        # 同 readSidecar，cxx_image_io 只公开解码整个文件的 read_image，
+        # EXIF 和 DNG 标定数据的读取器在内部模块 cxx_image 中
+        from cxx_image import io as cxx_io, parser
+    except ImportError:
+        return None
+    with open(image_path, 'rb') as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # 空文件
+            return None
+        with data:
+            info = headerFileInfo(data)
+    if info is None:
+        return None
+    metadata = parser.readMetadata(
+        str(image_path), str(metadata_path) if metadata_path else None)
+    reader = cxx_io.makeReader(str(image_path), metadata)
+    metadata = reader.readMetadata(metadata or ImageMetadata())
+    representation = reader.pixelRepresentation()
+    if representation != (PixelRepresentation.UINT16 if info[4] > 8
+                          else PixelRepresentation.UINT8):
+        return None
+    fileInfo = metadata.fileInfo
+    (fileInfo.width, fileInfo.height, fileInfo.pixelType,
+     fileInfo.imageLayout, fileInfo.pixelPrecision) = info
+    fileInfo.pixelRepresentation = representation
+    white = metadata.calibrationData.whiteLevel
+    if image_path.suffix.lower() == '.dng' and white and white > 1:
+        # cxx_image_io 的 DNG 解码器按白电平给出有效位数
+        fileInfo.pixelPrecision = (int(white) - 1).bit_length()
+    return metadata
+
+
+def readLibRawHeader(image_path):
+    """Metadata that read_image reports for a camera raw, read by LibRaw
+    without unpacking the pixels. None when LibRaw cannot open the file or
+    the conversion of cxx_image_io is not available"""
+    try:
+        # open_file 之后尺寸、CFA、黑白电平和 EXIF 已经可用；转换函数是
+        # cxx_image_io 的内部函数，找不到时由 read_image 解码整个文件
+        from cxx_image_io.utils.io_cxx_libraw import (
+            _convert_LibRawdata_to_Metadata)
+    except ImportError:
+        return None
+    processor = LibRaw()
+    if processor.open_file(str(image_path)) != LibRaw_errors.LIBRAW_SUCCESS:
+        return None
+    return _convert_LibRawdata_to_Metadata(processor)
+
+
+def readMetadata(image_path, metadata_path=None):
+    """Metadata of an image file, the same as read_image reports, read from
+    the headers without decoding the pixels where the format allows it.
+
+    PLAIN and MIPI RAW files are described by their sidecar, JPEG, PNG, BMP,
+    TIFF and DNG by their headers and camera raws by LibRaw without
+    unpacking. YUV, NV12 and CFA files, palette images and the other layouts
+    headerFileInfo does not know go through read_image.
+    """
+    image_path = pathlib.Path(image_path)
+    raw = openRawFile(image_path, metadata_path)
+    if raw is not None:
+        return raw.metadata
+    metadata = readHeader(image_path, metadata_path)
+    if metadata is not None:
+        return metadata
+    # 与 read_image 的选择一致：cxx 不支持的后缀先交给 LibRaw
+    if image_path.suffix.lower() not in CxxImageReader.SUPPORTED_EXT:
+        metadata = readLibRawHeader(image_path)
+        if metadata is not None:
+            return metadata
+    return read_image(image_path,
+                      pathlib.Path(metadata_path) if metadata_path else None)[1]
+
+
+def extractMetadata(image_path):
+    """JSON record of one file for display-image-metadata, with the error
+    instead of the metadata when it cannot be read"""
+    image_path = pathlib.Path(image_path)
+    record = {'path': str(image_path)}
+    try:
+        stat = image_path.stat()
+        record.update(size=stat.st_size, mtime=stat.st_mtime)
+        record['metadata'] = serializeMetadata(readMetadata(image_path))
+    except (Exception, SystemExit) as e:
+        # read_image 出错时会调用 sys.exit
+        record['error'] = str(e) or type(e).__name__
+    return record
+
+
+def flattenRecord(record, prefix=''):
+    """Dotted columns of a nested record, e.g. metadata.exifMetadata.make"""
+    columns = {}
+    for key, value in record.items():
+        if isinstance(value, dict):
+            columns.update(flattenRecord(value, prefix + key + '.'))
+        elif isinstance(value, (list, tuple)):
+            columns[prefix + key] = json.dumps(value)
+        else:
+            columns[prefix + key] = value
+    return columns
+
+
+def readRecords(path):
+    """Records of a JSONL index, the last one per file. A line cut by an
+    interruption is dropped from the file so that appending can resume."""
+    records = {}
+    if not path.exists():
+        return records
+    with open(path, 'rb+') as f:
+        data = f.read()
+        end = data.rfind(b'\n') + 1
+        if end < len(data):
+            f.truncate(end)
+    for line in data[:end].splitlines():
+        with contextlib.suppress(ValueError):
+            record = json.loads(line)
+            records[record['path']] = record
+    return records
+
+
+def writeCsv(path, records):
+    rows = [flattenRecord(record) for record in records]
+    columns = list(dict.fromkeys(key for row in rows for key in row))
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def parse_metadata_command_line(argv):
+    parser = argparse.ArgumentParser(
+        description='Extract the metadata of many images from their headers '
+        'and sidecars, decoding only the formats whose headers are not read.',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('inputs',
+                        nargs='+',
+                        help='Image files, directories or glob patterns.')
+    parser.add_argument('-o',
+                        '--output',
+                        required=True,
+                        help='JSONL file receiving one record per file. When '
+                        'it exists, files already recorded with the same '
+                        'size and modification time are skipped and the new '
+                        'records are appended.')
+    parser.add_argument('--csv',
+                        help='Also write all the records of the JSONL file '
+                        'as a CSV table with one dotted column per field, '
+                        'e.g. metadata.exifMetadata.isoSpeedRatings.')
+    parser.add_argument('-j',
+                        '--workers',
+                        type=int,
+                        default=os.cpu_count(),
+                        help='Number of worker processes.')
+    parser.add_argument('--chunk-size',
+                        type=int,
+                        default=64,
+                        help='Files sent to a worker at once.')
+    return parser.parse_args(argv)
+
+
+def metadata_main():
+    """Entry point of display-image-metadata. The records are appended to
+    the JSONL file as the workers return them, so an interrupted run is
+    resumed by running the same command again."""
+    args = parse_metadata_command_line(sys.argv[1:])
+    image_paths = [p for pattern in args.inputs
+                   for p in collectImagePaths(pattern)]
+    if not image_paths:
+        sys.exit('No image found in {}'.format(' '.join(args.inputs)))
+    output = pathlib.Path(args.output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    records = readRecords(output)
+
+    def recorded(path):
+        record = records.get(str(path))
+        if record is None or 'error' in record:
+            return False
+        stat = path.stat()
+        return (record['size'], record['mtime']) == (stat.st_size,
+                                                     stat.st_mtime)
+
+    pending = [path for path in image_paths if not recorded(path)]
+    print('{} files, {} already recorded'.format(
+        len(image_paths),
+        len(image_paths) - len(pending)))
+
+    start = time.perf_counter()
+    failed = 0
+    with open(output, 'a') as f, concurrent.futures.ProcessPoolExecutor(
+            max_workers=args.workers,
+            mp_context=multiprocessing.get_context('spawn')) as pool:
+        # 只读文件头的任务不到一毫秒，按块分发减少进程间通信
+        for done, record in enumerate(
+                pool.map(extractMetadata, pending,
+                         chunksize=args.chunk_size), 1):
+            f.write(json.dumps(record) + '\n')
+            f.flush()
+            records[record['path']] = record
+            if 'error' in record:
+                failed += 1
+                print('{}: {}'.format(record['path'], record['error']),
+                      file=sys.stderr)
+            if done % 1000 == 0:
+                elapsed = time.perf_counter() - start
+                print('{}/{} files, {:.1f} files/s'.format(
+                    done, len(pending), done / elapsed))
+    elapsed = time.perf_counter() - start
+    print('Extracted {} files in {:.1f} s ({:.1f} files/s), {} failed'.format(
+        len(pending) - failed, elapsed,
+        len(pending) / elapsed if elapsed > 0 else 0.0, failed))
+    if args.csv:
+        writeCsv(args.csv, records.values())
+    sys.exit(1 if failed else 0)
+
+
 def parse_command_line(argv):
     parser = argparse.ArgumentParser(
         description='Display image and metadata.',
@@ -552,43 +5514,250 @@ def parse_command_line(argv):
     required_args = parser.add_argument_group('required arguments')
     required_args.add_argument('-i',
                                '--image',
-                               required=True,
                                type=str,
-                               help='Path to image file')
+                               help='Path to image file, or a directory or '
+                               'glob pattern to browse with Page Up/Down')
 
     parser.add_argument('-m',
                         '--metadata',
                         type=str,
                         default=None,
                         help='Path to image metadata sidecar file.')
-    return parser.parse_args(argv)
+    parser.add_argument('--demosaic',
+                        choices=['raw', 'binned', 'bilinear'],
+                        default='raw',
+                        help='Initial display of Bayer images: raw mosaic, '
+                        'half resolution color or full resolution bilinear '
+                        'color.')
+    parser.add_argument('--cache-size',
+                        type=int,
+                        default=1024,
+                        help='Memory budget in MB for decoded images kept '
+                        'while browsing.')
+    parser.add_argument('--memory-budget',
+                        type=int,
+                        default=2048,
+                        metavar='MB',
+                        help='Decoded images over a quarter of this budget '
+                        'are kept in a temporary file and mapped, and only '
+                        'a reduced copy up to an eighth of it stays in '
+                        'memory.')
+    parser.add_argument('--memory-report',
+                        action='store_true',
+                        help='Print where the memory goes at exit, Ctrl+M '
+                        'shows it in the window.')
+    compare_args = parser.add_argument_group('compare')
+    compare_args.add_argument('--compare',
+                              type=str,
+                              nargs='+',
+                              default=[],
+                              metavar='IMAGE',
+                              help='Images shown next to the -i image with '
+                              'locked zoom and pan. The first one is B of '
+                              'the A - B difference and A / B ratio views.')
+    compare_args.add_argument('--compare-layout',
+                              choices=['side', 'tabs'],
+                              default='side',
+                              help='Show the compared images side by side '
+                              'or in tabs.')
+    parser.add_argument('--watch',
+                        action='store_true',
+                        help='Reload the image when the file is rewritten, '
+                        'and show new images added to the directory or '
+                        'matching the pattern, keeping the zoom and pan.')
+    parser.add_argument('--single-instance',
+                        action='store_true',
+                        help='Open the image in a new tab of the running '
+                        'display-image started with this option and exit, '
+                        'or start it. The caches and decode processes of the '
+                        'running process are reused.')
+    play_args = parser.add_argument_group('playback')
+    play_args.add_argument('--play',
+                           action='store_true',
+                           help='Play the -i files as the frames of a burst, '
+                           'PLAIN or MIPI RAW frames described by the -m '
+                           'sidecar or by the sidecar of the first frame.')
+    play_args.add_argument('--fps',
+                           type=float,
+                           default=30.0,
+                           help='Target frame rate, frames are dropped when '
+                           'decoding is slower.')
+    play_args.add_argument('--play-step',
+                           type=int,
+                           default=None,
+                           help='Subsampling of the played frames, by default '
+                           'about {} pixels wide, 1 for full '
+                           'resolution.'.format(FrameSequence.preview_size))
+    play_args.add_argument('--ring-frames',
+                           type=int,
+                           default=8,
+                           help='Frames decoded ahead of the display.')
+    cache_args = parser.add_argument_group('preview cache')
+    cache_args.add_argument('--preview-cache-dir',
+                            type=str,
+                            default=None,
+                            help='Directory of the on-disk preview cache, by '
+                            'default {}.'.format(defaultCacheDir()))
+    cache_args.add_argument('--preview-cache-size',
+                            type=int,
+                            default=2048,
+                            help='Size limit in MB of the preview cache.')
+    cache_args.add_argument('--no-preview-cache',
+                            action='store_true',
+                            help='Neither read nor write the preview cache.')
+    cache_args.add_argument('--cache-info',
+                            action='store_true',
+                            help='List the preview cache entries and exit.')
+    cache_args.add_argument('--clear-cache',
+                            action='store_true',
+                            help='Delete the preview cache and exit.')
+    profile_args = parser.add_argument_group('profiling')
+    profile_args.add_argument('--profile',
+                              type=str,
+                              default=None,
+                              metavar='TRACE',
+                              help='Record timing spans and memory deltas of '
+                              'each stage, write them at exit as a Chrome '
+                              'trace JSON (chrome://tracing, Perfetto) and '
+                              'print a summary.')
+    profile_args.add_argument('--hud',
+                              action='store_true',
+                              help='Show frame time and cache hit rates over '
+                              'the image, F12 toggles it.')
+    args = parser.parse_args(argv)
+    if not args.image and not (args.cache_info or args.clear_cache):
+        parser.error('the following arguments are required: -i/--image')
+    return args
+
+
+def applyDarkStylesheet(app):
+    # 样式表解析要 100 多毫秒，放到第一帧之后
+    with profiler.span('qdarkstyle'):
+        import qdarkstyle
+        app.setStyleSheet(qdarkstyle.load_stylesheet_pyqt6())
+
+
+def printCacheInfo(preview_cache):
+    entries = preview_cache.entries()
+    total = sum(size for _, size, _, _ in entries)
+    print('Preview cache {}: {} entries, {:.1f} MB of {:.0f} MB'.format(
+        preview_cache.root, len(entries), total / 2**20,
+        preview_cache.max_bytes / 2**20))
+    for _, size, last_use, path in entries:
+        print('{:>10.1f} MB  {}  {}'.format(
+            size / 2**20, time.strftime('%Y-%m-%d %H:%M',
+                                        time.localtime(last_use)), path))
+
+
+def checkedPaths(args):
+    """Image files, sidecar and compare images of the command line"""
+    with profiler.span('collectImagePaths'):
+        image_paths = collectImagePaths(args.image)
+    assert image_paths, 'Non-existing image path: {}'.format(args.image)
+    if args.metadata:
+        metadata_path = pathlib.Path(args.metadata)
+        assert metadata_path.exists(
+        ), 'Non-existing metadata path: {}'.format(str(metadata_path))
+    else:
+        metadata_path = None
+    compare_paths = [pathlib.Path(path) for path in args.compare]
+    for path in compare_paths:
+        assert path.exists(), 'Non-existing image path: {}'.format(path)
+    return image_paths, metadata_path, compare_paths
+
+
+def createDisplayer(args, paths, preview_cache, image_cache=None):
+    """SequencePlayer or ImageDisplayer of the command line"""
+    image_paths, metadata_path, compare_paths = paths
+    if args.play:
+        return SequencePlayer(image_paths,
+                              metadata_path,
+                              args.fps,
+                              args.play_step,
+                              args.ring_frames,
+                              hud=args.hud)
+    with profiler.span('ImageDisplayer.__init__'):
+        return ImageDisplayer(image_paths,
+                              metadata_path,
+                              args.demosaic,
+                              args.cache_size * 1024 * 1024,
+                              preview_cache,
+                              args.hud,
+                              compare_paths,
+                              args.compare_layout,
+                              args.image if args.watch else None,
+                              args.memory_budget * 1024 * 1024,
+                              image_cache=image_cache)
 
 
 def main():
     args = parse_command_line(sys.argv[1:])
+    if args.profile:
+        profiler.enabled = True
+    preview_cache = PreviewCache(args.preview_cache_dir,
+                                 args.preview_cache_size * 1024 * 1024)
+    if args.cache_info or args.clear_cache:
+        if args.clear_cache:
+            preview_cache.clear()
+        printCacheInfo(preview_cache)
+        return
+    if args.no_preview_cache:
+        preview_cache = None
 
     try:
-        image_path = pathlib.Path(args.image)
-        assert image_path.exists(), 'Non-existing image path: {}'.format(
-            str(image_path))
-        if args.metadata:
-            metadata_path = pathlib.Path(args.metadata)
-            assert metadata_path.exists(
-            ), 'Non-existing metadata path: {}'.format(str(metadata_path))
+        paths = checkedPaths(args)
+        lock = None
+        if args.single_instance:
+            lock = instanceLock()
+            with profiler.span('forwardToInstance'):
+                reply = forwardToInstance(sys.argv[1:])
+            if reply == '':
+                return
+            if reply is not None:
+                raise RuntimeError(reply)
+
+        with profiler.span('QApplication'):
+            app = QApplication(sys.argv)
+        window = None
+        if args.single_instance:
+            # 第一个实例常驻，之后的命令行在新标签页中打开
+            window = InstanceWindow(preview_cache,
+                                    args.cache_size * 1024 * 1024)
+            # 已经在监听，之后启动的实例会转发给这个进程
+            lock.unlock()
+        img_displayer = createDisplayer(
+            args, paths, preview_cache,
+            window.cache if window is not None else None)
+        top = window if window is not None else img_displayer
+        top.resize(1000, 800)
+        top.move(100, 100)
+        if args.play:
+            if window is not None:
+                window.addDisplayer(img_displayer, args)
+            top.show()
+            QTimer.singleShot(0, lambda: applyDarkStylesheet(app))
         else:
-            metadata_path = None
-        image, metadata = read_image(image_path, metadata_path)
-
-        app = QApplication(sys.argv)
-        dark_stylesheet = qdarkstyle.load_stylesheet_pyqt6()
-        app.setStyleSheet(dark_stylesheet)
-        img_displayer = ImageDisplayer(image, metadata, image_path)
-        img_displayer.resize(1000, 800)
-        img_displayer.move(100, 100)
-        img_displayer.show()
+            img_displayer.firstPaint.connect(
+                lambda: profiler.mark('first paint'))
+            img_displayer.firstPaint.connect(
+                lambda: applyDarkStylesheet(app))
+            with profiler.span('show'):
+                top.show()
+            with profiler.span('openIndex'):
+                if window is not None:
+                    window.addDisplayer(img_displayer, args)
+                else:
+                    img_displayer.openIndex(0)
+            if args.memory_report:
+                app.aboutToQuit.connect(
+                    lambda: print(img_displayer.memoryReport()))
     except Exception as e:
         sys.exit("Exception caught in display image, check the error log: {}.".
                  format(str(e)))
+    app.aboutToQuit.connect(top.close)
+    app.aboutToQuit.connect(shutdownDecodePool)
+    if args.profile:
+        app.aboutToQuit.connect(lambda: profiler.dump(args.profile))
     sys.exit(app.exec())
 
 
@@ -0,0 +1,100 @@
+import json
+import os
+import pathlib
+
+import numpy as np
+import pytest
+
+# 测试不打开窗口
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from cxx_image_io import (FileFormat, ImageLayout, ImageMetadata,  # noqa: E402
+                          ImageWriter, PixelRepresentation, PixelType,
+                          write_image)
+
+WIDTH, HEIGHT = 40, 30
+
+
+def writeSample(path, image, pixelType, imageLayout, precision,
+                fileFormat=None):
+    metadata = ImageMetadata()
+    metadata.fileInfo.pixelType = pixelType
+    metadata.fileInfo.imageLayout = imageLayout
+    metadata.fileInfo.pixelPrecision = precision
+    metadata.fileInfo.width = image.shape[1]
+    metadata.fileInfo.height = image.shape[0]
+    options = ImageWriter.Options(metadata)
+    if fileFormat is not None:
+        options.fileFormat = fileFormat
+    write_image(path, image, options)
+    return path
+
+
+def bayerMetadata(precision, pixelType=PixelType.BAYER_GRBG):
+    metadata = ImageMetadata()
+    metadata.fileInfo.pixelType = pixelType
+    metadata.fileInfo.imageLayout = ImageLayout.PLANAR
+    metadata.fileInfo.pixelPrecision = precision
+    metadata.fileInfo.pixelRepresentation = PixelRepresentation.UINT16
+    return metadata
+
+
+@pytest.fixture
+def bayer():
+    """10 bit Bayer image with odd sizes"""
+    rng = np.random.default_rng(1)
+    return rng.integers(0, 1024, (61, 83), dtype=np.uint16)
+
+
+
+
+def writeSidecar(path, fileFormat, precision, pixelType='bayer_grbg'):
+    with open(path.with_suffix('.json'), 'w') as f:
+        json.dump(
+            {
+                'fileInfo': {
+                    'fileFormat': fileFormat,
+                    'width': WIDTH,
+                    'height': HEIGHT,
+                    'pixelPrecision': precision,
+                    'pixelType': pixelType
+                }
+            }, f)
+
+
+@pytest.fixture(scope='session')
+def samples(tmp_path_factory):
+    """Small files of each format, keyed by extension"""
+    root = tmp_path_factory.mktemp('samples')
+    rng = np.random.default_rng(0)
+    raw10 = rng.integers(0, 1024, (HEIGHT, WIDTH), dtype=np.uint16)
+    # 文件名各不相同，每个 raw 文件有自己的 sidecar。宽度不是 4 的倍数的 8 位图像，检查行对齐
+    paths = {
+        'png':
+        writeSample(root / 'rgb.png',
+                    rng.integers(0, 256, (HEIGHT, WIDTH + 1, 3),
+                                 dtype=np.uint8), PixelType.RGB,
+                    ImageLayout.INTERLEAVED, 8),
+        'jpg':
+        writeSample(root / 'gray.jpg',
+                    rng.integers(0, 256, (HEIGHT, WIDTH + 1), dtype=np.uint8),
+                    PixelType.GRAYSCALE, ImageLayout.PLANAR, 8),
+        'tif':
+        writeSample(root / 'bayer.tif',
+                    rng.integers(0, 65536, (HEIGHT, WIDTH), dtype=np.uint16),
+                    PixelType.BAYER_RGGB, ImageLayout.PLANAR, 16),
+        'RAWMIPI10':
+        writeSample(root / 'mipi10.RAWMIPI10', raw10, PixelType.BAYER_GRBG,
+                    ImageLayout.PLANAR, 10, FileFormat.RAW10),
+        'RAWMIPI12':
+        writeSample(root / 'mipi12.RAWMIPI12', raw10 * 4,
+                    PixelType.BAYER_GRBG, ImageLayout.PLANAR, 12,
+                    FileFormat.RAW12),
+        'plain16':
+        writeSample(root / 'plain.plain16', raw10, PixelType.BAYER_GRBG,
+                    ImageLayout.PLANAR, 10, FileFormat.PLAIN),
+    }
+    writeSidecar(paths['RAWMIPI10'], 'raw10', 10)
+    writeSidecar(paths['RAWMIPI12'], 'raw12', 12)
+    writeSidecar(paths['plain16'], 'plain', 10)
+    return {key: pathlib.Path(path) for key, path in paths.items()}
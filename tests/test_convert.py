@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+from conftest import bayerMetadata
+from cxx_image_io import PixelType
+from PyQt6.QtGui import QImage
+
+import display
+
+
+@pytest.mark.parametrize('precision', [8, 10, 12, 14])
+def test_stretch_replicates_bits(precision):
+    values = np.arange(2**precision, dtype=np.uint16).reshape(-1, 2**4)
+    out = display.ImageConverter().stretch(values, precision, values.shape)
+    expected = values.astype(np.uint32) << (16 - precision)
+    filled = precision
+    while filled < 16:
+        expected |= expected >> filled
+        filled *= 2
+    np.testing.assert_array_equal(out, expected)
+    assert out.max() == 65535 and out.min() == 0
+
+
+def test_stretch_clips_to_precision():
+    values = np.array([[1023, 1024, 65535]], dtype=np.uint16)
+    out = display.ImageConverter().stretch(values, 10, values.shape)
+    np.testing.assert_array_equal(out, [[65535, 65535, 65535]])
+
+
+def test_convert_bayer_to_grayscale16(bayer):
+    converter = display.ImageConverter()
+    converter.chunk_values = 16 * bayer.shape[1]
+    qimage = converter.convert(bayer, bayerMetadata(10))
+    assert qimage.format() == QImage.Format.Format_Grayscale16
+    assert (qimage.width(), qimage.height()) == (83, 61)
+    expected = (bayer << 6) | (bayer >> 4)
+    assert qimage.pixelColor(7, 5).red() == expected[5, 7] >> 8
+
+
+@pytest.mark.parametrize('precision', [10, 16])
+def test_convert_rgb_to_rgbx64(precision):
+    rng = np.random.default_rng(3)
+    image = rng.integers(0, 2**precision, (21, 33, 3), dtype=np.uint16)
+    metadata = bayerMetadata(precision, PixelType.RGB)
+    converter = display.ImageConverter()
+    converter.chunk_values = 5 * 33 * 3
+    qimage = converter.convert(image, metadata)
+    assert qimage.format() == QImage.Format.Format_RGBX64
+    out = converter.buffer[:21 * 33 * 4].reshape(21, 33, 4)
+    expected = display.ImageConverter().stretch(image, precision, image.shape)
+    np.testing.assert_array_equal(out[..., :3], expected)
+    assert (out[..., 3] == 65535).all()
+    color = qimage.pixelColor(7, 5)
+    assert (color.red(), color.green(), color.blue()) == tuple(
+        expected[5, 7] >> 8)
@@ -0,0 +1,37 @@
+import os
+
+import numpy as np
+import pytest
+from cxx_image_io import read_image
+
+import display
+
+
+@pytest.fixture
+def pool():
+    yield
+    display.shutdownDecodePool()
+
+
+def test_decode_in_pool(samples, pool):
+    image, metadata = display.decodedResult(display.submitDecode(samples['png']))
+    np.testing.assert_array_equal(image, read_image(samples['png'])[0])
+    assert metadata.fileInfo.width == 41
+
+
+def test_broken_pool_is_replaced(samples, pool):
+    # 模拟解码进程崩溃
+    crashed = display.decodePool().submit(os._exit, 1)
+    with pytest.raises(display.concurrent.futures.process.BrokenProcessPool):
+        crashed.result(timeout=60)
+    future = display.submitDecode(samples['tif'])
+    image, _ = display.decodedResult(future)
+    assert image.shape == (30, 40)
+
+
+def test_loader_resubmits_decode_failed_by_broken_pool(samples, pool):
+    prefetched = display.decodePool().submit(os._exit, 1)
+    loader = display.ImageLoader(samples['tif'], future=prefetched)
+    image, metadata = loader.decode()
+    assert image.shape == (30, 40)
+    assert metadata.fileInfo.pixelPrecision == 16
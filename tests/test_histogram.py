@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+from conftest import bayerMetadata
+from cxx_image_io import ImageMetadata, PixelType
+
+import display
+
+
+@pytest.mark.parametrize('pixelType', [
+    PixelType.BAYER_RGGB, PixelType.BAYER_BGGR, PixelType.BAYER_GRBG,
+    PixelType.BAYER_GBRG
+])
+def test_histogram_matches_bincount(bayer, pixelType):
+    engine = display.HistogramEngine(bayer, bayerMetadata(10, pixelType))
+    engine.chunk_rows = 8
+    counts = engine.compute()
+    assert list(counts) == ['R', 'Gr', 'Gb', 'B']
+    for channel, (dy, dx) in display.BAYER_OFFSETS[pixelType].items():
+        expected = np.bincount(bayer[dy::2, dx::2].ravel(), minlength=1024)
+        np.testing.assert_array_equal(counts[channel], expected)
+
+
+def test_histogram_rect_and_step(bayer):
+    engine = display.HistogramEngine(bayer, bayerMetadata(10))
+    counts = engine.compute((10, 20, 50, 70), step=3)
+    # 起点已是偶数，奇数步长不变，抽样后 CFA 相位不变
+    region = bayer[10:50:3, 20:70:3]
+    for channel, (dy, dx) in display.BAYER_OFFSETS[PixelType.BAYER_GRBG].items():
+        expected = np.bincount(region[dy::2, dx::2].ravel(), minlength=1024)
+        np.testing.assert_array_equal(counts[channel], expected)
+
+
+def test_histogram_clamps_values_above_precision(bayer):
+    image = bayer.copy()
+    image[0, 0] = 4000
+    counts = display.HistogramEngine(image, bayerMetadata(10)).compute()
+    assert counts['Gr'][-1] == np.count_nonzero(image[::2, ::2] >= 1023)
+    assert sum(c.sum() for c in counts.values()) == image.size
+
+
+def test_histogram_rgb():
+    rng = np.random.default_rng(2)
+    image = rng.integers(0, 256, (20, 30, 3), dtype=np.uint8)
+    metadata = ImageMetadata()
+    metadata.fileInfo.pixelType = PixelType.RGB
+    metadata.fileInfo.pixelPrecision = 8
+    counts = display.HistogramEngine(image, metadata).compute()
+    for c, channel in enumerate('RGB'):
+        np.testing.assert_array_equal(
+            counts[channel], np.bincount(image[..., c].ravel(), minlength=256))
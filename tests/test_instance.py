@@ -0,0 +1,69 @@
+import json
+import os
+import socket
+import uuid
+
+import pytest
+from PyQt6.QtCore import QDir
+from PyQt6.QtWidgets import QApplication
+
+import display
+
+
+@pytest.fixture
+def qapp():
+    return QApplication.instance() or QApplication([])
+
+
+@pytest.fixture
+def name(monkeypatch):
+    # 不能碰到正在运行的 display-image
+    name = 'display-image-test-{}'.format(uuid.uuid4().hex[:8])
+    monkeypatch.setattr(display, 'instanceName', lambda: name)
+    yield name
+    path = os.path.join(QDir.tempPath(), name)
+    if os.path.exists(path):
+        os.unlink(path)
+
+
+def test_parse_instance_request():
+    line = json.dumps({'argv': ['-i', 'a.png'], 'cwd': '/tmp'}).encode()
+    assert display.parseInstanceRequest(line) == (['-i', 'a.png'], '/tmp')
+
+
+@pytest.mark.parametrize('line', [
+    b'', b'not json', b'\xff\xfe', b'[1, 2]', b'{"argv": ["-i"]}',
+    b'{"argv": "-i a.png", "cwd": "/tmp"}', b'{"argv": [1], "cwd": "/tmp"}',
+    b'{"argv": [], "cwd": null}'
+])
+def test_parse_instance_request_rejects_malformed(line):
+    with pytest.raises(ValueError, match='Malformed request'):
+        display.parseInstanceRequest(line)
+
+
+def test_instance_window_keeps_live_server(qapp, name):
+    resident = display.InstanceWindow(None, 1024 * 1024)
+    assert resident.server.isListening()
+    with pytest.raises(RuntimeError, match='Another display-image'):
+        display.InstanceWindow(None, 1024 * 1024)
+    assert resident.server.isListening()
+    resident.server.close()
+
+
+@pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason='Unix sockets')
+def test_instance_window_replaces_stale_socket(qapp, name):
+    # 异常退出的进程留下的套接字文件，没有进程在监听
+    stale = socket.socket(socket.AF_UNIX)
+    stale.bind(os.path.join(QDir.tempPath(), name))
+    stale.close()
+    resident = display.InstanceWindow(None, 1024 * 1024)
+    assert resident.server.isListening()
+    resident.server.close()
+
+
+def test_instance_lock_serialises_launches(name):
+    lock = display.instanceLock()
+    with pytest.raises(RuntimeError, match='is starting'):
+        display.instanceLock(timeout=0)
+    lock.unlock()
+    display.instanceLock(timeout=0).unlock()
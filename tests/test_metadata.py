@@ -0,0 +1,155 @@
+import struct
+
+import numpy as np
+import pytest
+from PyQt6.QtGui import QImage, qRgb
+from conftest import HEIGHT, WIDTH, writeSample
+from cxx_image_io import (ExifMetadata, ImageLayout, ImageMetadata,
+                          ImageWriter, PixelType, read_image, write_image)
+
+import display
+
+
+def writeDng(path, raw, cfa=(0, 1, 1, 2), white=1023):
+    """Minimal uncompressed little endian DNG of a 16 bit CFA image"""
+    height, width = raw.shape
+    pixels = raw.astype('<u2').tobytes()
+    # (tag, type, values)，有理数按分子、分母展开
+    entries = [
+        (0x00FE, 4, [0]), (0x0100, 4, [width]), (0x0101, 4, [height]),
+        (0x0102, 3, [16]), (0x0103, 3, [1]), (0x0106, 3, [32803]),
+        (0x010F, 2, b'Test\0'), (0x0110, 2, b'Cam 1\0'), (0x0111, 4, [8]),
+        (0x0115, 3, [1]), (0x0116, 4, [height]), (0x0117, 4, [len(pixels)]),
+        (0x011C, 3, [1]), (0x828D, 3, [2, 2]), (0x828E, 1, list(cfa)),
+        (0xC612, 1, [1, 4, 0, 0]), (0xC614, 2, b'Test Cam 1\0'),
+        (0xC61A, 3, [64]), (0xC61D, 3, [white]),
+        (0xC621, 10, [1, 1, 0, 1, 0, 1, 0, 1, 1, 1, 0, 1, 0, 1, 0, 1, 1, 1]),
+        (0xC628, 5, [1, 2, 1, 1, 1, 1]), (0xC65A, 3, [21]),
+    ]
+    formats = {1: 'B', 3: 'H', 4: 'I', 5: 'I', 10: 'i'}
+    # 像素紧跟文件头，IFD 和放不进项里的值在最后
+    ifd_offset = 8 + len(pixels)
+    data_offset = ifd_offset + 2 + 12 * len(entries) + 4
+    directory, blobs = struct.pack('<H', len(entries)), b''
+    for tag, kind, values in entries:
+        blob = bytes(values) if kind == 2 else struct.pack(
+            '<' + formats[kind] * len(values), *values)
+        count = len(values) // 2 if kind in (5, 10) else len(values)
+        if len(blob) <= 4:
+            directory += struct.pack('<HHI', tag, kind, count)
+            directory += blob.ljust(4, b'\0')
+        else:
+            directory += struct.pack('<HHII', tag, kind, count,
+                                     data_offset + len(blobs))
+            blobs += blob + b'\0' * (len(blob) % 2)
+    path.write_bytes(b'II*\0' + struct.pack('<I', ifd_offset) + pixels +
+                     directory + struct.pack('<I', 0) + blobs)
+    return path
+
+
+@pytest.fixture(scope='module')
+def headers(tmp_path_factory):
+    """Files whose metadata readMetadata takes from the headers"""
+    root = tmp_path_factory.mktemp('headers')
+    rng = np.random.default_rng(1)
+    rgb = rng.integers(0, 256, (HEIGHT, WIDTH + 1, 3), dtype=np.uint8)
+    gray16 = rng.integers(0, 65536, (HEIGHT, WIDTH), dtype=np.uint16)
+    raw = rng.integers(64, 1024, (HEIGHT, WIDTH), dtype=np.uint16)
+    paths = {
+        'rgb.png': writeSample(root / 'rgb.png', rgb, PixelType.RGB,
+                               ImageLayout.INTERLEAVED, 8),
+        'gray16.png': writeSample(root / 'gray16.png', gray16,
+                                  PixelType.GRAYSCALE, ImageLayout.PLANAR, 16),
+        'rgb.tif': writeSample(root / 'rgb.tif', rgb, PixelType.RGB,
+                               ImageLayout.INTERLEAVED, 8),
+        'gray16.tif': writeSample(root / 'gray16.tif', gray16,
+                                  PixelType.GRAYSCALE, ImageLayout.PLANAR, 16),
+        'rgb.bmp': writeSample(root / 'rgb.bmp', rgb, PixelType.RGB,
+                               ImageLayout.INTERLEAVED, 8),
+        'grbg.dng': writeDng(root / 'grbg.dng', raw, (1, 0, 2, 1)),
+        'bggr.dng': writeDng(root / 'bggr.dng', raw * 4, (2, 1, 1, 0), 4095),
+        'rggb.nef': writeDng(root / 'rggb.nef', raw),
+    }
+    # EXIF 方向为 6 的 JPEG，read_image 不旋转
+    metadata = ImageMetadata()
+    metadata.fileInfo.pixelType = PixelType.RGB
+    metadata.fileInfo.imageLayout = ImageLayout.INTERLEAVED
+    metadata.fileInfo.pixelPrecision = 8
+    metadata.fileInfo.width, metadata.fileInfo.height = WIDTH + 1, HEIGHT
+    exif = ExifMetadata()
+    exif.make, exif.orientation = 'Test', 6
+    metadata.exifMetadata = exif
+    paths['exif.jpg'] = root / 'exif.jpg'
+    write_image(paths['exif.jpg'], rgb, ImageWriter.Options(metadata))
+    return paths
+
+
+@pytest.mark.parametrize('kind',
+                         ['png', 'jpg', 'tif', 'RAWMIPI10', 'plain16'])
+def test_read_metadata_matches_read_image(samples, kind):
+    path = samples[kind]
+    expected = read_image(path)[1].fileInfo
+    fileInfo = display.readMetadata(path).fileInfo
+    assert fileInfo.serialize() == expected.serialize()
+    assert fileInfo.width and fileInfo.height
+    assert fileInfo.pixelType is not None
+    assert fileInfo.pixelPrecision
+
+
+def test_extract_metadata_record(samples):
+    path = samples['plain16']
+    record = display.extractMetadata(path)
+    assert 'error' not in record
+    assert record['path'] == str(path)
+    assert record['size'] == path.stat().st_size
+    fileInfo = record['metadata']['fileInfo']
+    assert (fileInfo['width'], fileInfo['height']) == (40, 30)
+    assert fileInfo['pixelType'] == 'bayer_grbg'
+    assert fileInfo['pixelPrecision'] == 10
+    flat = display.flattenRecord(record)
+    assert flat['metadata.fileInfo.width'] == 40
+
+
+def test_extract_metadata_error(tmp_path):
+    path = tmp_path / 'broken.png'
+    path.write_bytes(b'not an image')
+    record = display.extractMetadata(path)
+    assert 'metadata' not in record
+    assert record['error']
+
+
+@pytest.mark.parametrize('kind', [
+    'rgb.png', 'gray16.png', 'rgb.tif', 'gray16.tif', 'rgb.bmp', 'exif.jpg',
+    'grbg.dng', 'bggr.dng', 'rggb.nef'
+])
+def test_read_metadata_from_headers(headers, kind, monkeypatch):
+    path = headers[kind]
+    expected = read_image(path)[1].serialize()
+
+    def decode(*args):
+        raise AssertionError('read_image decoded ' + str(path))
+
+    monkeypatch.setattr(display, 'read_image', decode)
+    assert display.readMetadata(path).serialize() == expected
+
+
+def test_read_metadata_of_samples_without_decoding(samples, monkeypatch):
+    expected = {
+        kind: read_image(samples[kind])[1].serialize()
+        for kind in ('png', 'jpg', 'tif', 'RAWMIPI10', 'plain16')
+    }
+    monkeypatch.setattr(display, 'read_image', None)
+    for kind, metadata in expected.items():
+        assert display.readMetadata(samples[kind]).serialize() == metadata
+
+
+def test_read_metadata_falls_back_to_read_image(tmp_path):
+    # 调色板 PNG 由 read_image 展开为 RGB，头部读取器不处理
+    image = QImage(WIDTH, HEIGHT, QImage.Format.Format_Indexed8)
+    image.setColorTable([qRgb(i, 255 - i, i // 2) for i in range(256)])
+    image.fill(7)
+    path = tmp_path / 'palette.png'
+    image.save(str(path))
+    assert display.readHeader(path) is None
+    assert display.readMetadata(path).serialize() == read_image(
+        path)[1].serialize()
@@ -0,0 +1,67 @@
+import struct
+
+import numpy as np
+from PyQt6.QtCore import QBuffer, QIODevice
+from PyQt6.QtGui import QImage
+
+import display
+
+
+def jpegBytes(width, height):
+    image = QImage(width, height, QImage.Format.Format_RGB888)
+    image.fill(0x336699)
+    buffer = QBuffer()
+    buffer.open(QIODevice.OpenModeFlag.WriteOnly)
+    image.save(buffer, 'JPG')
+    return bytes(buffer.data())
+
+
+def ifd(entries, next_ifd=0):
+    """Little endian IFD of (tag, type, count, value) entries"""
+    data = struct.pack('<H', len(entries))
+    for tag, kind, count, value in entries:
+        data += struct.pack('<HHII', tag, kind, count, value)
+    return data + struct.pack('<I', next_ifd)
+
+
+def writeDng(path, preview):
+    """TIFF laid out like a DNG: a small IFD0 thumbnail whose SubIFD is the
+    4000x3000 raw, followed by a JPEG preview"""
+    ifd0 = 8
+    raw = ifd0 + 2 + 12 * 4 + 4
+    data = b'II*\x00' + struct.pack('<I', ifd0)
+    data += ifd([(0x00FE, 4, 1, 1), (0x0100, 3, 1, 256), (0x0101, 3, 1, 171),
+                 (0x014A, 4, 1, raw)])
+    data += ifd([(0x00FE, 4, 1, 0), (0x0100, 4, 1, 4000),
+                 (0x0101, 4, 1, 3000)])
+    path.write_bytes(data + preview)
+
+
+def test_tiff_frame_picks_full_resolution_subifd(tmp_path):
+    path = tmp_path / 'shot.dng'
+    writeDng(path, b'')
+    assert display.tiffFrame(path.read_bytes()) == (4000, 3000)
+
+
+def test_tiff_frame_of_written_tiff(samples):
+    assert display.tiffFrame(samples['tif'].read_bytes()) == (40, 30)
+
+
+def test_tiff_frame_rejects_truncated_header(samples):
+    assert display.tiffFrame(samples['tif'].read_bytes()[:12]) is None
+    assert display.tiffFrame(b'') is None
+
+
+def test_embedded_preview_reports_dng_size(tmp_path):
+    path = tmp_path / 'shot.dng'
+    writeDng(path, jpegBytes(400, 300))
+    thumbnail, size = display.embeddedPreview(path)
+    assert thumbnail.shape == (300, 400, 3)
+    assert size == (4000, 3000)
+    assert np.abs(thumbnail[150, 200].astype(int) - [0x33, 0x66, 0x99]).max() < 8
+
+
+def test_embedded_preview_of_jpeg_without_thumbnail(tmp_path):
+    path = tmp_path / 'photo.jpg'
+    path.write_bytes(jpegBytes(64, 48))
+    assert display.embeddedPreview(path) == (None, (64, 48))
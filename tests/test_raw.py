@@ -0,0 +1,42 @@
+import sys
+
+import numpy as np
+import pytest
+from cxx_image_io import read_image
+
+import display
+
+KEYS = [
+    (slice(None), slice(None)),
+    (slice(3, 17), slice(5, 31)),
+    (slice(None, None, 4), slice(1, None, 3)),
+    (slice(None, None, -1), slice(7, 8)),
+    (5, slice(None)),
+    (slice(None), 9),
+    (11, 13),
+]
+
+
+@pytest.mark.parametrize('kind', ['RAWMIPI10', 'RAWMIPI12', 'plain16'])
+def test_raw_file_matches_read_image(samples, kind):
+    path = samples[kind]
+    expected = read_image(path)[0]
+    raw = display.openRawFile(path)
+    assert raw is not None
+    assert raw.shape == expected.shape
+    np.testing.assert_array_equal(np.asarray(raw), expected)
+    for key in KEYS:
+        np.testing.assert_array_equal(raw[key], expected[key])
+
+
+def test_open_raw_file_without_sidecar(samples):
+    assert display.openRawFile(samples['png']) is None
+
+
+def test_open_raw_file_without_sidecar_parser(samples, monkeypatch):
+    # cxx_image_io 的内部模块找不到时不使用 RawFile，由 read_image 解码
+    monkeypatch.setitem(sys.modules, 'cxx_image', None)
+    assert display.readSidecar(samples['plain16'],
+                               samples['plain16'].with_suffix('.json')) is None
+    assert display.openRawFile(samples['plain16']) is None
+    assert display.readMetadata(samples['plain16']).fileInfo.width == 40
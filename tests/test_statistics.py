@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+from conftest import bayerMetadata
+from cxx_image_io import PixelType
+
+import display
+
+
+@pytest.mark.parametrize('rect', [(0, 0, 61, 83), (3, 5, 40, 71),
+                                  (10, 10, 11, 12), (60, 82, 61, 83)])
+@pytest.mark.parametrize('max_memory_bytes', [64 * 1024 * 1024, 0])
+def test_integral_stats_match_numpy(bayer, rect, max_memory_bytes):
+    stats = display.IntegralStats(bayer, bayerMetadata(10))
+    stats.chunk_rows = 7
+    # 0 字节时所有表都放在临时文件中
+    stats.max_memory_bytes = max_memory_bytes
+    result = stats.build().stats(rect)
+    top, left, bottom, right = rect
+    for channel, (dy, dx) in display.BAYER_OFFSETS[PixelType.BAYER_GRBG].items():
+        plane = bayer[top:bottom, left:right][(dy - top) % 2::2,
+                                              (dx - left) % 2::2]
+        if plane.size == 0:
+            assert result[channel] is None
+            continue
+        count, mean, std = result[channel]
+        assert count == plane.size
+        assert mean == pytest.approx(plane.mean())
+        assert std == pytest.approx(plane.std())
+        assert (count, mean, std) == pytest.approx(
+            stats.pixelStats(rect)[channel])
+    assert sum(v[0] for v in result.values() if v) == bayer[
+        top:bottom, left:right].size
+    assert sum(v[0] * v[1] for v in result.values()
+               if v) == pytest.approx(bayer[top:bottom, left:right].sum())
+
+
+def test_integral_stats_extrema(bayer):
+    stats = display.IntegralStats(bayer, bayerMetadata(10))
+    extrema = stats.extrema((0, 0, 61, 83))
+    plane = bayer[::2, 1::2]
+    assert extrema['R'] == (plane.min(), plane.max())